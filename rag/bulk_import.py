@@ -0,0 +1,163 @@
+import os
+import shutil
+import logging
+import argparse
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
+from rag import init_config
+
+logger = logging.getLogger(__name__)
+
+RAG_FEEDS_DIR = os.getenv("RAG_FEEDS_DIR")
+# 记录进行中导入的日期目录，导入完成后删除
+IMPORT_STATE_FILE = ".bulk_import"
+
+def iter_files(root: Path, extensions: List[str]) -> Iterator[Path]:
+    """递归遍历目录，跳过隐藏文件及目录"""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        for file_name in file_names:
+            if file_name.startswith("."):
+                continue
+            if Path(file_name).suffix.replace(".", "").lower() in extensions:
+                yield Path(dir_path).joinpath(file_name)
+
+def iter_batches(items: Iterator[Path], batch_size: int) -> Iterator[List[Path]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def resolve_import_dir(feeds_dir: Path) -> Path:
+    """本次导入的日期目录；上次导入中断时沿用其目录，使已放置但元数据未写入的文件可以复用"""
+    state_path = feeds_dir.joinpath(IMPORT_STATE_FILE)
+    if state_path.exists():
+        dest_dir = Path(state_path.read_text(encoding="utf-8").strip())
+        logger.info(f"resume interrupted import into {dest_dir}")
+    else:
+        dest_dir = feeds_dir.joinpath(datetime.now().strftime("%Y-%m-%d"))
+        state_path.write_text(str(dest_dir), encoding="utf-8")
+    dest_dir.mkdir(mode=0o755, parents=True, exist_ok=True)
+    return dest_dir
+
+def place_file(src: Path, dest_dir: Path, doc_hash: str, link: bool) -> Path:
+    """将文件硬链接（跨设备时复制）到 RAG_FEEDS_DIR，先写临时文件再原子重命名"""
+    from core.doc.document import resolve_dest_path
+    from utils.files import get_file_hash
+
+    # 上次导入中断时文件可能已放置但元数据未写入，内容一致则直接复用
+    for candidate in (dest_dir.joinpath(src.name), dest_dir.joinpath(doc_hash[:12], src.name)):
+        if candidate.exists() and get_file_hash(candidate) == doc_hash:
+            return candidate
+
+    dest_path = resolve_dest_path(dest_dir, src.name, doc_hash)
+    tmp_path = dest_path.parent.joinpath(f".import-{doc_hash}.part")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        if link:
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                shutil.copyfile(src, tmp_path)
+        else:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return dest_path
+
+def import_batch(files: List[Path], dest_dir: Path, hash_pool: ThreadPoolExecutor, link: bool, parse: bool) -> int:
+    """导入一批文件，返回新建文档数
+
+    parse 为 True 时新文档与解析任务在同一事务中写入；已存在但尚未建立索引且没有排队任务的文档
+    （上次导入中断或解析失败）重新排队。
+    """
+    from utils.files import get_file_hash
+    from dao.sqlite.document import get_docs, save_docs, Document, INDEX_INDEXED
+    from dao.sqlite.job import save_docs_with_job, filter_unqueued_docs
+
+    file_hashes: Dict[str, Path] = {}
+    for path, doc_hash in zip(files, hash_pool.map(get_file_hash, files)):
+        file_hashes.setdefault(doc_hash, path)
+
+    existing_docs = get_docs(doc_hashes=list(file_hashes.keys()))
+    existing = {doc.doc_hash for doc in existing_docs}
+
+    new_docs = []
+    for doc_hash, path in file_hashes.items():
+        if doc_hash in existing:
+            continue
+        dest_path = place_file(path, dest_dir, doc_hash, link)
+        new_docs.append(Document(
+            dest_dir=str(dest_path.parent),
+            doc_name=dest_path.name,
+            doc_hash=doc_hash,
+            doc_size=dest_path.stat().st_size,
+        ))
+
+    requeue_ids = []
+    if parse:
+        requeue_ids = filter_unqueued_docs([doc.id for doc in existing_docs if doc.index_status != INDEX_INDEXED])
+        saved, _ = save_docs_with_job(new_docs, requeue_ids)
+    else:
+        saved = save_docs(new_docs)
+    logger.info(
+        f"batch imported: {len(files)} files, {len(existing)} existing, {len(saved)} new, {len(requeue_ids)} requeued"
+    )
+    return len(saved)
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入目录中的文档并建立索引")
+    parser.add_argument("source", type=Path, help="待导入的目录")
+    parser.add_argument("--extensions", default="pdf", help="导入的文件扩展名，逗号分隔")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每个事务写入的文档数")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1, help="并行计算哈希的线程数")
+    parser.add_argument("--workers", type=int, default=None, help="并行向量化的线程数")
+    parser.add_argument("--processes", type=int, default=None, help="并行提取文本的进程数")
+    parser.add_argument("--copy", action="store_true", help="复制文件而非硬链接")
+    parser.add_argument("--no-parse", action="store_true", help="只导入文件和元数据，不建立索引")
+    args = parser.parse_args()
+
+    init_config()
+
+    extensions = [ext.strip().lstrip(".").lower() for ext in args.extensions.split(",") if ext.strip()]
+    feeds_dir = Path(RAG_FEEDS_DIR).resolve()
+    feeds_dir.mkdir(mode=0o755, parents=True, exist_ok=True)
+    dest_dir = resolve_import_dir(feeds_dir)
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=args.hash_workers) as hash_pool:
+        for files in iter_batches(iter_files(args.source.resolve(), extensions), args.batch_size):
+            # 每批文档对应一个持久化的解析任务，进程中断后再次运行会继续处理
+            total += import_batch(files, dest_dir, hash_pool, link=not args.copy, parse=not args.no_parse)
+    feeds_dir.joinpath(IMPORT_STATE_FILE).unlink(missing_ok=True)
+    logger.info(f"import finished, new documents: {total}")
+
+    if args.no_parse:
+        return
+
+    from core.vector.base import VectorAnalyzer
+    from core.doc.worker import IngestWorkerPool, RAG_INGEST_WORKERS, RAG_INGEST_PROCESSES
+
+    analyzer = VectorAnalyzer()
+    pool = IngestWorkerPool(
+        analyzer,
+        workers=args.workers or RAG_INGEST_WORKERS,
+        processes=args.processes or RAG_INGEST_PROCESSES,
+    )
+    try:
+        pool.run_until_idle()
+    finally:
+        pool.stop()
+        analyzer.close()
+    logger.info("parse finished")
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,139 @@
 import os
+import time
+import base64
+import asyncio
+import hashlib
 import logging
+import tempfile
 import aiofiles
 from datetime import datetime
 from pathlib import Path
 from fastapi import UploadFile
-from typing import Union, List
-from dao.sqlite.document import save_doc, list_doc, count_doc, get_docs, Document
-from utils.files import get_file_hash, validate_upload_file, check_file_size
+from typing import Union, List, Optional, Tuple
+from dao.sqlite.document import get_docs_async, save_docs_async, list_doc_async, count_doc_async, list_indexed_states, Document
+from dao.sqlite.job import create_job_async, get_job_async, ParseJob
+from utils.files import validate_upload_file, validate_file_content, check_file_size, get_file_ext, MAX_FILE_SIZE
 from core.vector.base import VectorAnalyzer
 
 RAG_FEEDS_DIR = os.getenv("RAG_FEEDS_DIR")
+# 上传文件分块读写大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 文档总数缓存时间（秒）
+RAG_DOCUMENT_COUNT_TTL = float(os.getenv("RAG_DOCUMENT_COUNT_TTL", 30))
+# 扫描过期索引时每次读取的文档数
+STALE_SCAN_PAGE_SIZE = 5000
+
+_count_cache: dict[str, tuple[float, int]] = {}
 
 logger = logging.getLogger(__name__)
 
-async def process_document(file: UploadFile) -> str:
+async def process_documents(files: List[UploadFile]) -> List[Optional[str]]:
+    """批量处理上传文件，新文档的元数据在一个事务中写入；返回每个文件的 doc_hash，失败为 None
+
+    未写入数据库的文档（并发上传了相同内容或写入失败）会删除已落盘的文件。
+    """
+    doc_hashes = []
+    new_docs = []
+    # 本批次已落盘的 doc_hash，同一批次中内容相同的文件只保存一份
+    pending_hashes = set()
+    for file in files:
+        try:
+            doc_hash, doc = await store_document(file, pending_hashes)
+            doc_hashes.append(doc_hash)
+            if doc:
+                new_docs.append(doc)
+                pending_hashes.add(doc_hash)
+        except Exception as e:
+            logger.warning(f"document process error: {file.filename}, {str(e)}")
+            doc_hashes.append(None)
+
+    saved_ids = set()
     try:
-        validate_upload_file(file)
-        
-        check_file_size(file)
-        
-        date = datetime.now().strftime("%Y-%m-%d")
-        dest_dir = Path(RAG_FEEDS_DIR).resolve().joinpath(date)
-        dest_path = Path(dest_dir).resolve().joinpath(file.filename)
-        await safe_write(
-            dest_dir,
-            file
-        )
-
-        doc_hash = get_file_hash(dest_path)
-        save_doc(Document(
-            dest_dir=str(dest_dir),
-            doc_name=file.filename,
-            doc_hash=doc_hash,
-            doc_size=file.size,
-        ))
-        return doc_hash
-    except Exception as e:
-        logger.error(f"document process error: {str(e)}")
-        raise
+        saved_ids = {id(doc) for doc in await save_docs_async(new_docs)}
+    finally:
+        for doc in new_docs:
+            if id(doc) not in saved_ids:
+                Path(doc.dest_dir).joinpath(doc.doc_name).unlink(missing_ok=True)
+    return doc_hashes
 
-async def safe_write(dest_dir: str, file: UploadFile) -> int:
-    Path(dest_dir).mkdir(mode=0o755, parents=True, exist_ok=True)
-    dest_path = Path(dest_dir).resolve().joinpath(file.filename)
-    async with aiofiles.open(dest_path, "wb") as buffer:
-        content = await file.read()
-        await buffer.write(content)
-        return len(content)
+async def store_document(file: UploadFile, pending_hashes: Optional[set] = None) -> Tuple[str, Optional[Document]]:
+    """校验并落盘上传文件，返回 (doc_hash, 待写入的文档)，文档已存在或在 pending_hashes 中时后者为 None"""
+    check_file_size(file)
+
+    if not await validate_upload_file(file):
+        raise ValueError(f"文件签名校验失败: {file.filename}")
     
-def list_document(page: int, page_count: int) -> tuple:
-    total = count_doc()
-    if total <= (page - 1) * page_count:
-        return total, []
+    date = datetime.now().strftime("%Y-%m-%d")
+    dest_dir = Path(RAG_FEEDS_DIR).resolve().joinpath(date)
+    doc_hash, doc_size, dest_path = await safe_write(
+        dest_dir,
+        file,
+        pending_hashes
+    )
+    if dest_path is None:
+        logger.info(f"文档已存在: {file.filename}, {doc_hash}")
+        return doc_hash, None
+
+    return doc_hash, Document(
+        dest_dir=str(dest_path.parent),
+        doc_name=dest_path.name,
+        doc_hash=doc_hash,
+        doc_size=doc_size,
+    )
+
+async def safe_write(dest_dir: str, file: UploadFile, pending_hashes: Optional[set] = None) -> Tuple[str, int, Optional[Path]]:
+    """分块流式写入临时文件并同时计算 SHA-256，内存占用不超过 UPLOAD_CHUNK_SIZE
+
+    文档已存在（或已在本批次 pending_hashes 中）时丢弃临时文件并返回 (doc_hash, size, None)，
+    否则原子重命名到目标位置并返回 (doc_hash, size, dest_path)。
+    """
+    Path(dest_dir).mkdir(mode=0o755, parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        sha256 = hashlib.sha256()
+        size = 0
+        await file.seek(0)
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    raise ValueError("文件大小超过限制")
+                sha256.update(chunk)
+                await buffer.write(chunk)
+        doc_hash = sha256.hexdigest()
+
+        if not await asyncio.to_thread(validate_file_content, tmp_path, get_file_ext(file.filename)):
+            raise ValueError(f"文件内容校验失败: {file.filename}")
+
+        if (pending_hashes and doc_hash in pending_hashes) or await get_docs_async(doc_hashes=doc_hash):
+            tmp_path.unlink()
+            return doc_hash, size, None
+
+        dest_path = resolve_dest_path(dest_dir, file.filename, doc_hash)
+        os.replace(tmp_path, dest_path)
+        return doc_hash, size, dest_path
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
     
-    doc_list = list_doc(page, page_count)
+def resolve_dest_path(dest_dir: Union[str, Path], file_name: str, doc_hash: str) -> Path:
+    """确定文档存放路径，同名不同内容的文件放到以哈希前缀命名的子目录，避免覆盖已入库文档"""
+    dest_path = Path(dest_dir).resolve().joinpath(Path(file_name).name)
+    if dest_path.exists():
+        dest_path = dest_path.parent.joinpath(doc_hash[:12], dest_path.name)
+        dest_path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+    return dest_path
+
+async def list_document(page_count: int, cursor: Optional[str] = None, name_prefix: Optional[str] = None) -> tuple:
+    """游标分页列出文档，返回 (total, documents, next_cursor)"""
+    doc_list = await list_doc_async(page_count + 1, decode_cursor(cursor), name_prefix)
+    next_cursor = None
+    if len(doc_list) > page_count:
+        doc_list = doc_list[:page_count]
+        next_cursor = encode_cursor(doc_list[-1])
+
     new_doc_list = []
     for doc in doc_list:
         new_doc_list.append({
@@ -62,25 +143,119 @@ def list_document(page: int, page_count: int) -> tuple:
             "doc_hash": doc.doc_hash,
             "doc_size": doc.doc_size,
             "create_time": doc.create_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "index_status": doc.index_status,
+            "parsed_at": doc.parsed_at.strftime("%Y-%m-%d %H:%M:%S") if doc.parsed_at else None,
         })
 
-    return total, new_doc_list
+    return await count_document(name_prefix), new_doc_list, next_cursor
 
-def parse_documents(doc_ids: Union[int, List[int], None] = None, doc_hashes: Union[str, List[str], None] = None) -> int:
-    if not doc_ids and not doc_hashes:
-        return None, 1
-    
+async def count_document(name_prefix: Optional[str] = None) -> int:
+    """文档总数，缓存 RAG_DOCUMENT_COUNT_TTL 秒，避免每页都全表计数"""
+    key = name_prefix or ""
+    cached = _count_cache.get(key)
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        return cached[1]
+    total = await count_doc_async(name_prefix)
+    _count_cache[key] = (now + RAG_DOCUMENT_COUNT_TTL, total)
+    return total
+
+def encode_cursor(doc: Document) -> str:
+    raw = f"{doc.create_time.isoformat()}|{doc.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
     try:
-        docs = get_docs(doc_ids, doc_hashes)
-   
-        for doc in docs:
-            dest_path = Path(doc.dest_dir).resolve().joinpath(doc.doc_name)
-            if not dest_path.exists():
-                raise FileNotFoundError(f"document not found: {doc.doc_name}")
-        analyzer = VectorAnalyzer()
-        return analyzer.process_files(docs)
-    
-    except Exception as e:
-        logging.error(f"vecotr analyze failed: {str(e)}")
-        raise
-    
\ No newline at end of file
+        create_time, doc_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(create_time), int(doc_id)
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+
+async def submit_parse_job(
+    analyzer: VectorAnalyzer,
+    doc_ids: Union[int, List[int], None] = None,
+    doc_hashes: Union[str, List[str], None] = None,
+    force: bool = False
+) -> Tuple[Optional[ParseJob], int]:
+    """创建后台解析任务，由 IngestWorkerPool 异步执行
+
+    已按当前配置建立索引的文档跳过（force 时全部重建），返回 (任务, 跳过的文档数)，
+    文档不存在或全部跳过时任务为 None。
+    """
+    if not doc_ids and not doc_hashes:
+        return None, 0
+
+    docs = await get_docs_async(doc_ids, doc_hashes)
+    # 计算当前索引配置需要读取插件与向量模型信息，放到线程中执行，避免阻塞事件循环
+    stale = docs if force else await asyncio.to_thread(
+        lambda: [doc for doc in docs if not analyzer.is_index_current(doc)]
+    )
+    skipped = len(docs) - len(stale)
+    if not stale:
+        return None, skipped
+    return await create_job_async([doc.id for doc in stale]), skipped
+
+def find_stale_documents(analyzer: VectorAnalyzer) -> Tuple[List[int], int]:
+    """扫描已建立索引的文档，返回 (索引配置与当前不一致的文档 id, 扫描的文档数)"""
+    current_states = {}
+    stale_ids = []
+    scanned = 0
+    after_id = 0
+    while rows := list_indexed_states(after_id, STALE_SCAN_PAGE_SIZE):
+        for doc_id, doc_name, *state in rows:
+            file_format = Path(doc_name).suffix.replace(".", "")
+            if file_format not in current_states:
+                try:
+                    current = analyzer.index_state(file_format)
+                    current_states[file_format] = [
+                        current["embedding_model"], current["embedding_dimension"],
+                        current["chunker_version"], current["plugin_version"],
+                    ]
+                except Exception as e:
+                    # 不再支持的格式无法重建
+                    logger.warning(f"skip unsupported format: {file_format}, {str(e)}")
+                    current_states[file_format] = None
+            current = current_states[file_format]
+            if current is not None and state != current:
+                stale_ids.append(doc_id)
+        scanned += len(rows)
+        after_id = rows[-1][0]
+    return stale_ids, scanned
+
+async def submit_reindex_stale(analyzer: VectorAnalyzer, dry_run: bool = False) -> dict:
+    """只为向量模型、维度、分块或插件版本变化的文档创建解析任务"""
+    stale_ids, scanned = await asyncio.to_thread(find_stale_documents, analyzer)
+    job = None
+    if stale_ids and not dry_run:
+        job = await create_job_async(stale_ids)
+    logger.info(f"reindex stale documents: {len(stale_ids)}/{scanned}, dry run: {dry_run}")
+    return {
+        "job_id": job.id if job else None,
+        "scanned": scanned,
+        "stale": len(stale_ids),
+    }
+
+async def get_parse_job(job_id: int) -> Optional[dict]:
+    job, items = await get_job_async(job_id)
+    if not job:
+        return None
+
+    doc_names = {doc.id: doc.doc_name for doc in await get_docs_async(doc_ids=[item.doc_id for item in items])}
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "succeeded": job.succeeded,
+        "failed": job.failed,
+        "create_time": job.create_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "update_time": job.update_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "items": [{
+            "doc_id": item.doc_id,
+            "doc_name": doc_names.get(item.doc_id),
+            "status": item.status,
+            "attempts": item.attempts,
+            "error": item.error,
+        } for item in items],
+    }
@@ -0,0 +1,333 @@
+import os
+import time
+import logging
+import signal
+import resource
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from itertools import count, islice
+from multiprocessing.pool import AsyncResult
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from core.vector.base import VectorAnalyzer
+from core.vector.loader import PluginManager
+from dao.sqlite.document import get_docs, update_index_state, INDEX_FAILED
+from dao.sqlite.job import claim_item, finish_item, renew_items, ParseJobItem
+
+logger = logging.getLogger(__name__)
+
+# 并发处理文档的线程数（向量化为 IO 密集型）
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", 2))
+# 文本提取进程数（CPU 密集型）
+RAG_INGEST_PROCESSES = int(os.getenv("RAG_INGEST_PROCESSES", os.cpu_count() or 1))
+# 单个文档最大尝试次数
+RAG_INGEST_MAX_ATTEMPTS = int(os.getenv("RAG_INGEST_MAX_ATTEMPTS", 3))
+# 无任务时的轮询间隔（秒）
+RAG_INGEST_POLL_INTERVAL = float(os.getenv("RAG_INGEST_POLL_INTERVAL", 2))
+# 处理中文档的租期（秒），处理期间每隔租期的 1/3 续租，进程退出后超过租期的文档由其它进程重新领取
+RAG_INGEST_LEASE_SECONDS = float(os.getenv("RAG_INGEST_LEASE_SECONDS", 120))
+# 页数超过该值的文档按页段拆分到多个提取进程并行处理
+RAG_INGEST_PAGES_PER_TASK = int(os.getenv("RAG_INGEST_PAGES_PER_TASK", 16))
+# 提取进程处理该数量的任务后退出并重建，释放解析大文件时积累的内存，0 表示不重建
+RAG_INGEST_MAX_TASKS_PER_CHILD = int(os.getenv("RAG_INGEST_MAX_TASKS_PER_CHILD", 50))
+# 提取进程的虚拟内存上限（MB），超出时当前任务抛出 MemoryError，0 表示不限
+RAG_INGEST_WORKER_MEMORY_MB = int(os.getenv("RAG_INGEST_WORKER_MEMORY_MB", 2048))
+# 单个提取任务的最长执行时间（秒），超时后该文档解析失败，0 表示不限
+RAG_INGEST_TASK_TIMEOUT = float(os.getenv("RAG_INGEST_TASK_TIMEOUT", 600))
+# 单个提取任务的 CPU 时间上限（秒），用于无法响应超时信号的情况，超出后进程被系统结束并由进程池重建，0 表示不限
+RAG_INGEST_TASK_CPU_SECONDS = int(os.getenv("RAG_INGEST_TASK_CPU_SECONDS", 900))
+# 等待提取结果时检查执行进程是否存活的间隔（秒）
+RESULT_POLL_INTERVAL = 1
+
+_plugin_manager: Optional[PluginManager] = None
+# 子进程开始执行任务时上报 (任务编号, 进程号)
+_task_started = None
+
+def warm_plugins():
+    """子进程启动时加载插件，之后的文档复用同一组插件实例"""
+    global _plugin_manager
+    if _plugin_manager is None:
+        _plugin_manager = PluginManager()
+
+def init_extract_worker(task_started=None, memory_mb: int = RAG_INGEST_WORKER_MEMORY_MB):
+    """提取进程初始化：加载插件后限制虚拟内存"""
+    global _task_started
+    _task_started = task_started
+    warm_plugins()
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _on_task_timeout(signum, frame):
+    raise TimeoutError(f"extract task timeout after {RAG_INGEST_TASK_TIMEOUT}s")
+
+@contextmanager
+def task_limits():
+    """限制单个提取任务的执行时间与 CPU 时间
+
+    超时在任务内抛出 TimeoutError，进程继续处理后续任务；
+    CPU 时间按进程累计，每个任务开始时在已用时间基础上重新设置软限制。
+    """
+    if RAG_INGEST_TASK_CPU_SECONDS > 0:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + RAG_INGEST_TASK_CPU_SECONDS
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    if RAG_INGEST_TASK_TIMEOUT > 0:
+        signal.signal(signal.SIGALRM, _on_task_timeout)
+        signal.setitimer(signal.ITIMER_REAL, RAG_INGEST_TASK_TIMEOUT)
+    try:
+        yield
+    finally:
+        if RAG_INGEST_TASK_TIMEOUT > 0:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def count_document_pages(file_path: str, file_format: str) -> Optional[int]:
+    """在子进程中读取文档页数，不能按页拆分的格式返回 None"""
+    warm_plugins()
+    with task_limits():
+        plugin = _plugin_manager.get_plugin_for_file(file_path, file_format)
+        return plugin.page_count(file_path)
+
+def extract_document_pages(file_path: str, file_format: str, start: Optional[int] = None, end: Optional[int] = None) -> List[str]:
+    """在子进程中提取文档文本，按文件内容识别插件，扩展名作为兜底
+
+    指定 start/end 时只提取第 [start, end) 页，否则提取全文，返回逐段文本。
+    """
+    warm_plugins()
+    with task_limits():
+        plugin = _plugin_manager.get_plugin_for_file(file_path, file_format)
+        if start is None:
+            return list(plugin.iter_text(file_path))
+        return plugin.extract_page_range(file_path, start, end)
+
+def run_extract_task(token: int, func: Callable, *args):
+    """在子进程中执行提取任务，开始前上报执行进程，主进程据此发现进程异常退出"""
+    if _task_started is not None:
+        _task_started.put((token, os.getpid()))
+    return func(*args)
+
+class IngestWorkerPool:
+    """从 parse_job_item 表领取文档并执行 提取 -> 分块 -> 向量化 -> 入库"""
+
+    def __init__(
+        self,
+        analyzer: VectorAnalyzer,
+        workers: int = RAG_INGEST_WORKERS,
+        processes: int = RAG_INGEST_PROCESSES,
+        max_attempts: int = RAG_INGEST_MAX_ATTEMPTS,
+    ):
+        self.analyzer = analyzer
+        self.workers = max(1, workers)
+        self.processes = max(1, processes)
+        self.max_attempts = max_attempts
+        # 提取进程异常退出（如超出 CPU 或内存限制被结束）时任务结果不会返回，
+        # 任务开始时子进程上报进程号，等待期间发现该进程已退出即放弃；
+        # 尚未开始的任务可能排在其它处理线程的任务之后，等待时间按线程数放宽
+        self.result_timeout = RAG_INGEST_TASK_TIMEOUT * (self.workers + 1) or None
+        # 服务进程内已有多个线程，使用 spawn 避免 fork 继承锁状态；
+        # multiprocessing.Pool 支持处理一定数量任务后重建进程，进程异常退出后也会自动补齐
+        context = multiprocessing.get_context("spawn")
+        self.task_started = context.SimpleQueue()
+        self.task_tokens = count()
+        # 等待中的任务编号 -> 执行进程号，尚未开始执行时为 None
+        self.task_pids: Dict[int, Optional[int]] = {}
+        self.task_lock = threading.Lock()
+        self.process_pool = context.Pool(
+            processes=self.processes,
+            initializer=init_extract_worker,
+            initargs=(self.task_started,),
+            maxtasksperchild=RAG_INGEST_MAX_TASKS_PER_CHILD or None,
+        )
+        self.task_thread = threading.Thread(target=self._collect_task_pids, name="ingest-task-pids", daemon=True)
+        self.task_thread.start()
+        self.stop_event = threading.Event()
+        self.wakeup_event = threading.Event()
+        self.threads: List[threading.Thread] = []
+        # 本进程处理中的文档，由续租线程定期续租
+        self.active_items: Set[int] = set()
+        self.active_lock = threading.Lock()
+        self.lease_thread: Optional[threading.Thread] = None
+
+    def _renew_leases(self):
+        while not self.stop_event.wait(RAG_INGEST_LEASE_SECONDS / 3):
+            with self.active_lock:
+                item_ids = list(self.active_items)
+            try:
+                renew_items(item_ids)
+            except Exception as e:
+                logger.error(f"renew parse item lease error: {str(e)}")
+
+    def _start_lease_thread(self):
+        if self.lease_thread is None:
+            self.lease_thread = threading.Thread(target=self._renew_leases, name="ingest-lease", daemon=True)
+            self.lease_thread.start()
+
+    def start(self):
+        self._start_lease_thread()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ingest-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def notify(self):
+        """有新任务时唤醒空闲线程"""
+        self.wakeup_event.set()
+
+    def run_until_idle(self):
+        """在当前线程处理完所有待处理文档后返回（供命令行使用）"""
+        self._start_lease_thread()
+        threads = [
+            threading.Thread(target=self._run, args=(True,), name=f"ingest-worker-{index}")
+            for index in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run(self, until_idle: bool = False):
+        while not self.stop_event.is_set():
+            try:
+                if not self._run_once(until_idle):
+                    return
+            except Exception:
+                # 数据库暂时不可用（如 database is locked）等错误不能让处理线程退出；
+                # 未能结束的文档在租期过期后重新领取
+                logger.exception("ingest worker error")
+                self.stop_event.wait(RAG_INGEST_POLL_INTERVAL)
+
+    def _run_once(self, until_idle: bool) -> bool:
+        """领取并处理一个文档，until_idle 时没有待处理文档返回 False"""
+        item = claim_item(RAG_INGEST_LEASE_SECONDS)
+        if item is None:
+            if until_idle:
+                return False
+            self.wakeup_event.wait(RAG_INGEST_POLL_INTERVAL)
+            self.wakeup_event.clear()
+            return True
+        if item.attempts > self.max_attempts:
+            # 租期过期后被重新领取，说明之前处理该文档的进程已退出
+            self._fail(item, "parse process exited before finishing")
+            return True
+        with self.active_lock:
+            self.active_items.add(item.id)
+        try:
+            self._process(item)
+        finally:
+            with self.active_lock:
+                self.active_items.discard(item.id)
+        return True
+
+    def _collect_task_pids(self):
+        while (started := self.task_started.get()) is not None:
+            token, pid = started
+            with self.task_lock:
+                if token in self.task_pids:
+                    self.task_pids[token] = pid
+
+    def _submit(self, func: Callable, args: tuple) -> Tuple[int, AsyncResult]:
+        token = next(self.task_tokens)
+        with self.task_lock:
+            self.task_pids[token] = None
+        return token, self.process_pool.apply_async(run_extract_task, (token, func, *args))
+
+    def _discard(self, token: int):
+        with self.task_lock:
+            self.task_pids.pop(token, None)
+
+    @staticmethod
+    def _ready(result: AsyncResult, timeout: float) -> bool:
+        # AsyncResult.wait 不返回是否完成
+        result.wait(timeout)
+        return result.ready()
+
+    def _wait(self, task: Tuple[int, AsyncResult]):
+        """等待任务结果，执行进程已退出或超过 result_timeout 时抛出异常"""
+        token, result = task
+        deadline = time.monotonic() + self.result_timeout if self.result_timeout else None
+        try:
+            while not self._ready(result, RESULT_POLL_INTERVAL):
+                with self.task_lock:
+                    pid = self.task_pids.get(token)
+                if pid is not None and pid not in {process.pid for process in multiprocessing.active_children()}:
+                    # 结果可能已在进程退出前发出，但尚未被进程池的结果线程处理
+                    if self._ready(result, RESULT_POLL_INTERVAL):
+                        break
+                    raise ChildProcessError(f"extract process {pid} exited before returning the result")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"extract task result not returned after {self.result_timeout}s")
+            return result.get()
+        finally:
+            self._discard(token)
+
+    def iter_document_text(self, file_path: str, file_format: str) -> Iterator[str]:
+        """在提取进程中逐段提取文档文本，按原顺序返回
+
+        页数较多的文档按页段拆分，同一文档最多 processes 个页段同时提取；
+        调用方在处理已返回的页时，后续页段仍在其它进程中提取。
+        """
+        pages = self._wait(self._submit(count_document_pages, (file_path, file_format)))
+        if not pages or pages <= RAG_INGEST_PAGES_PER_TASK:
+            tasks = iter([(file_path, file_format)])
+        else:
+            tasks = (
+                (file_path, file_format, start, min(start + RAG_INGEST_PAGES_PER_TASK, pages))
+                for start in range(0, pages, RAG_INGEST_PAGES_PER_TASK)
+            )
+            logger.info(f"extract {pages} pages in ranges of {RAG_INGEST_PAGES_PER_TASK}: {file_path}")
+
+        pending = deque(
+            self._submit(extract_document_pages, args)
+            for args in islice(tasks, self.processes)
+        )
+        try:
+            while pending:
+                texts = self._wait(pending.popleft())
+                args = next(tasks, None)
+                if args is not None:
+                    pending.append(self._submit(extract_document_pages, args))
+                yield from texts
+        finally:
+            # 提取失败或调用方提前结束时，不再等待剩余页段
+            for token, _ in pending:
+                self._discard(token)
+
+    def _process(self, item: ParseJobItem):
+        try:
+            docs = get_docs(doc_ids=item.doc_id)
+            if not docs:
+                raise LookupError(f"document not found: {item.doc_id}")
+            doc = docs[0]
+            full_path = doc.full_path()
+            if not full_path.exists():
+                raise FileNotFoundError(f"document not found: {doc.doc_name}")
+
+            texts = self.iter_document_text(full_path.as_posix(), full_path.suffix.replace(".", ""))
+            chunks = self.analyzer.index_stream(doc, texts)
+            finish_item(item)
+            logger.info(f"document parsed: {doc.doc_name}, chunks: {chunks}")
+        except Exception as e:
+            logger.error(f"parse document {item.doc_id} error: {str(e)}")
+            self._fail(item, str(e))
+
+    def _fail(self, item: ParseJobItem, error: str):
+        """记录解析失败；索引状态只用于展示，写入失败不影响结束任务"""
+        try:
+            update_index_state(item.doc_id, INDEX_FAILED)
+        except Exception as e:
+            logger.error(f"update index state of document {item.doc_id} error: {str(e)}")
+        finish_item(item, error=error, max_attempts=self.max_attempts)
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup_event.set()
+        for thread in self.threads:
+            thread.join()
+        # 处理线程已全部退出，剩余的只可能是超时未返回的任务
+        self.process_pool.terminate()
+        self.process_pool.join()
+        self.task_started.put(None)
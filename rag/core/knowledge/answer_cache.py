@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, Optional, Set
+from dao.sqlite.chunk import get_docs_version
+
+logger = logging.getLogger(__name__)
+
+RAG_ANSWER_CACHE_ENABLED = os.getenv("RAG_ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# 问题向量余弦相似度不低于该值才视为同一问题
+RAG_ANSWER_CACHE_THRESHOLD = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", 0.95))
+# 回答缓存有效期（秒）
+RAG_ANSWER_CACHE_TTL = int(os.getenv("RAG_ANSWER_CACHE_TTL", 3600))
+# 缓存条数上限，超过后按最近访问淘汰
+RAG_ANSWER_CACHE_MAX_ITEMS = int(os.getenv("RAG_ANSWER_CACHE_MAX_ITEMS", 1000))
+
+@dataclass
+class AnswerEntry:
+    question: str
+    vector: np.ndarray
+    doc_hashes: FrozenSet[str]
+    answer: str
+    # 生成该回答耗费的时间，命中时计入节省时间
+    generation_ms: float
+    expire_at: float
+    # 生成前读取的分块版本，引用的文档之后被重新写入时条目失效
+    corpus_version: int = field(default=0)
+    hits: int = field(default=0)
+
+class AnswerCache:
+    """语义回答缓存：问题向量相似且检索到的文档集合相同时复用回答
+
+    条目按检索文档集合分组，查找时只与同组条目比较向量；
+    命中时按 SQLite 中记录的文档分块版本确认回答未过期，文档无论由本进程、
+    快照导入还是批量导入命令重新写入，引用该文档的条目都会失效。
+    """
+
+    def __init__(self, threshold: float, ttl: int, max_items: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[int, AnswerEntry]" = OrderedDict()
+        self.groups: Dict[FrozenSet[str], Set[int]] = {}
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_generation_ms = 0.0
+
+    @staticmethod
+    def normalize(vector: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        group = self.groups.get(entry.doc_hashes)
+        if group is not None:
+            group.discard(entry_id)
+            if not group:
+                del self.groups[entry.doc_hashes]
+
+    def lookup(self, vector: Iterable[float], doc_hashes: Iterable[str]) -> Optional[AnswerEntry]:
+        """查找相似问题的回答，未命中返回 None；会读取 SQLite，不要在事件循环中直接调用"""
+        vector = self.normalize(vector)
+        doc_hashes = frozenset(doc_hashes)
+        now = time.time()
+        with self.lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self.groups.get(doc_hashes, ())):
+                entry = self.entries[entry_id]
+                if entry.expire_at <= now:
+                    self._remove(entry_id)
+                    continue
+                score = float(vector @ entry.vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            corpus_version = self.entries[best_id].corpus_version
+
+        # 同组条目引用的文档相同，只需确认文档在生成之后没有被重新写入
+        stale = get_docs_version(list(doc_hashes)) > corpus_version
+        with self.lock:
+            entry = self.entries.get(best_id)
+            if stale or entry is None:
+                if entry is not None:
+                    self._remove(best_id)
+                    self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_id)
+            entry.hits += 1
+            self.hits += 1
+            self.saved_generation_ms += entry.generation_ms
+            return entry
+
+    def put(
+        self,
+        question: str,
+        vector: Iterable[float],
+        doc_hashes: Iterable[str],
+        answer: str,
+        generation_ms: float,
+        corpus_version: int
+    ):
+        """写入回答，corpus_version 为检索前 get_corpus_version() 的值，生成期间文档被重新写入的回答命中时失效"""
+        if not answer:
+            return
+        doc_hashes = frozenset(doc_hashes)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = AnswerEntry(
+                question=question,
+                vector=self.normalize(vector),
+                doc_hashes=doc_hashes,
+                answer=answer,
+                generation_ms=generation_ms,
+                expire_at=time.time() + self.ttl,
+                corpus_version=corpus_version,
+            )
+            self.groups.setdefault(doc_hashes, set()).add(entry_id)
+            while len(self.entries) > self.max_items:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.groups.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_generation_ms": round(self.saved_generation_ms, 1),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "items": len(self.entries),
+                "max_items": self.max_items,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+            }
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    """进程内共享同一个回答缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(
+                threshold=RAG_ANSWER_CACHE_THRESHOLD,
+                ttl=RAG_ANSWER_CACHE_TTL,
+                max_items=RAG_ANSWER_CACHE_MAX_ITEMS,
+            )
+        return _cache
@@ -0,0 +1,228 @@
+import os
+import time
+import json
+import asyncio
+import logging
+import httpx
+from dataclasses import dataclass
+from typing import AsyncIterator, Collection, List, Optional
+from urllib.parse import urljoin
+
+logger = logging.getLogger(__name__)
+
+LLM_SERVER_BASE_URL = os.getenv("LLM_SERVER_BASE_URL")
+LLM_CHAT_ENDPOINT = os.getenv("LLM_CHAT_ENDPOINT")
+# OpenAI 兼容后端列表，逗号分隔；为空时只使用 LLM_SERVER_BASE_URL
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+LLM_HEALTH_ENDPOINT = os.getenv("LLM_HEALTH_ENDPOINT", "health")
+LLM_SLOTS_ENDPOINT = os.getenv("LLM_SLOTS_ENDPOINT", "slots")
+# 健康检查与 /slots 探测间隔、超时（秒）
+LLM_PROBE_INTERVAL = float(os.getenv("LLM_PROBE_INTERVAL", 5))
+LLM_PROBE_TIMEOUT = float(os.getenv("LLM_PROBE_TIMEOUT", 2))
+# 连续失败次数达到该值后熔断，熔断期间不分配请求，冷却后放行一个试探请求
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+# 首个 token 之前失败时换后端重试的次数
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", 2))
+# 会话绑定的后端比最空闲后端多出的在途请求超过该值时改用最空闲后端
+LLM_STICKY_SLACK = int(os.getenv("LLM_STICKY_SLACK", 4))
+
+def parse_backends(value: str) -> List[str]:
+    urls = [url.strip() for url in value.split(",") if url.strip()] or [LLM_SERVER_BASE_URL]
+    # urljoin 以最后一个 / 为基准拼接路径
+    return [url if url.endswith("/") else f"{url}/" for url in urls]
+
+def parse_stream_line(line: str) -> Optional[dict]:
+    """解析 llama.cpp 流式返回的一行，控制信息（如 [DONE] 或空段）与非法内容返回 None"""
+    line = line.strip()
+    if not line or line == "data: [DONE]":
+        return None
+    if line.startswith("data: "):
+        line = line[len("data: "):]
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        logger.warning(f"invalid JSON line: {e}")
+        return None
+
+@dataclass
+class LLMBackend:
+    base_url: str
+    # 本进程发往该后端、尚未结束的请求数
+    outstanding: int = 0
+    healthy: bool = True
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+    # /slots 探测结果，后端未开启 /slots 时为 None
+    slot_count: Optional[int] = None
+    idle_slots: Optional[int] = None
+    requests: int = 0
+    failures: int = 0
+
+    def url(self, path: str) -> str:
+        return urljoin(self.base_url, path)
+
+    def breaker_state(self, now: float) -> str:
+        if self.consecutive_failures < LLM_BREAKER_FAILURES:
+            return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def available(self, now: float) -> bool:
+        state = self.breaker_state(now)
+        # 半开状态同一时间只放行一个试探请求
+        return self.healthy and (state == "closed" or (state == "half_open" and self.outstanding == 0))
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= LLM_BREAKER_FAILURES:
+            self.open_until = time.time() + LLM_BREAKER_COOLDOWN
+            logger.warning(f"llm backend circuit open: {self.base_url}, failures: {self.consecutive_failures}")
+
+    def summary(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "breaker": self.breaker_state(time.time()),
+            "outstanding": self.outstanding,
+            "slot_count": self.slot_count,
+            "idle_slots": self.idle_slots,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+class LLMBackendPool:
+    """多个 llama.cpp（OpenAI 兼容）后端的负载均衡
+
+    按在途请求数最少选择后端，会话优先使用绑定的后端；后台定期探测 /health 与 /slots；
+    连续失败后熔断；首个 token 之前失败时换后端重试。只在事件循环线程内使用。
+    """
+
+    def __init__(self, client: httpx.AsyncClient, base_urls: Optional[List[str]] = None):
+        self.client = client
+        self.backends = [LLMBackend(base_url=url) for url in base_urls or parse_backends(LLM_BACKENDS)]
+        self.probe_task: Optional[asyncio.Task] = None
+
+    def get(self, base_url: Optional[str]) -> Optional[LLMBackend]:
+        return next((backend for backend in self.backends if backend.base_url == base_url), None)
+
+    def choose(
+        self,
+        preferred: Optional[str] = None,
+        exclude: Collection[str] = (),
+        slack: Optional[int] = LLM_STICKY_SLACK
+    ) -> Optional[LLMBackend]:
+        """选择后端，preferred 可用且负载差不超过 slack（None 表示不限）时优先使用，全部不可用时返回 None"""
+        now = time.time()
+        candidates = [backend for backend in self.backends if backend.base_url not in exclude and backend.available(now)]
+        if not candidates:
+            return None
+        # 在途请求相同时优先空闲 slot 多的后端
+        least = min(candidates, key=lambda backend: (backend.outstanding, -(backend.idle_slots or 0)))
+        sticky = next((backend for backend in candidates if backend.base_url == preferred), None)
+        if sticky is not None and (slack is None or sticky.outstanding - least.outstanding <= slack):
+            return sticky
+        return least
+
+    async def stream_chat(self, payload: dict, preferred: Optional[str] = None, usage: Optional[dict] = None) -> AsyncIterator[dict]:
+        """流式请求对话接口，逐条返回解析后的 JSON
+
+        首先使用 preferred 后端；返回首条内容之前失败时换其它后端重试，
+        id_slot 只对 preferred 后端有效，换后端时去掉。usage 不为空时写入实际使用的后端。
+        """
+        tried = set()
+        last_error = None
+        for _ in range(LLM_RETRY_ATTEMPTS + 1):
+            backend = self.choose(preferred, exclude=tried, slack=None)
+            if backend is None:
+                break
+            tried.add(backend.base_url)
+            body = payload
+            if backend.base_url != preferred and "id_slot" in payload:
+                body = {key: value for key, value in payload.items() if key != "id_slot"}
+            if usage is not None:
+                usage["backend"] = backend.base_url
+
+            started = False
+            backend.outstanding += 1
+            backend.requests += 1
+            try:
+                async with self.client.stream("POST", backend.url(LLM_CHAT_ENDPOINT), json=body) as chat_resp:
+                    chat_resp.raise_for_status()
+                    async for line in chat_resp.aiter_lines():
+                        chunk = parse_stream_line(line)
+                        if chunk is None:
+                            continue
+                        started = True
+                        yield chunk
+                backend.record_success()
+                return
+            except httpx.HTTPError as e:
+                # 4xx 为请求本身的问题，换后端也无法成功
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    raise
+                backend.record_failure()
+                if started:
+                    raise
+                last_error = e
+                logger.warning(f"llm backend failed before first token: {backend.base_url}, error: {str(e)}")
+            finally:
+                backend.outstanding -= 1
+        raise RuntimeError(f"no available llm backend, last error: {last_error}")
+
+    async def probe(self, backend: LLMBackend):
+        try:
+            resp = await self.client.get(backend.url(LLM_HEALTH_ENDPOINT), timeout=LLM_PROBE_TIMEOUT)
+            # llama.cpp 加载模型期间返回 503
+            healthy = resp.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != backend.healthy:
+            logger.warning(f"llm backend {'healthy' if healthy else 'unhealthy'}: {backend.base_url}")
+        backend.healthy = healthy
+        if not healthy:
+            return
+
+        try:
+            resp = await self.client.get(backend.url(LLM_SLOTS_ENDPOINT), timeout=LLM_PROBE_TIMEOUT)
+            if resp.status_code != 200:
+                # 未开启 --slots 时返回 501
+                backend.slot_count, backend.idle_slots = None, None
+                return
+            slots = resp.json()
+            backend.slot_count = len(slots)
+            backend.idle_slots = sum(
+                1 for slot in slots
+                if not slot.get("is_processing", slot.get("state", 0) != 0)
+            )
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"llm backend slots probe failed: {backend.base_url}, error: {str(e)}")
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"llm backend probe error: {str(e)}")
+            await asyncio.sleep(LLM_PROBE_INTERVAL)
+
+    def start(self):
+        if LLM_PROBE_INTERVAL > 0:
+            self.probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self.probe_task is not None:
+            self.probe_task.cancel()
+            try:
+                await self.probe_task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> List[dict]:
+        return [backend.summary() for backend in self.backends]
@@ -0,0 +1,176 @@
+import os
+import re
+import logging
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from chromadb.api.types import QueryResult
+
+logger = logging.getLogger(__name__)
+
+# 提示词（系统提示 + 历史 + 资料 + 问题）的估算 token 上限
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", 3072))
+# 历史对话最多占用的 token 数，超出时从最早的轮次开始丢弃
+RAG_CONTEXT_HISTORY_TOKENS = int(os.getenv("RAG_CONTEXT_HISTORY_TOKENS", 1024))
+# 单条资料最多保留的 token 数
+RAG_CONTEXT_PASSAGE_TOKENS = int(os.getenv("RAG_CONTEXT_PASSAGE_TOKENS", 512))
+# 剩余预算低于该值时不再截断加入资料
+RAG_CONTEXT_MIN_PASSAGE_TOKENS = int(os.getenv("RAG_CONTEXT_MIN_PASSAGE_TOKENS", 32))
+# 固定的系统提示，放在最前面保证各轮提示词前缀一致
+RAG_CONTEXT_SYSTEM_PROMPT = os.getenv(
+    "RAG_CONTEXT_SYSTEM_PROMPT",
+    "你是本地知识库问答助手，请优先依据提供的资料回答问题，资料不足时如实说明。"
+)
+
+# 每条消息的角色、分隔符等模板开销
+MESSAGE_OVERHEAD_TOKENS = 4
+# 中日韩字符大多单独成 token，其余文本按约 4 个字符一个 token 估算
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+ASCII_CHARS_PER_TOKEN = 4
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+HINTS_HEADER = "以下是相关资料：\n"
+QUESTION_PROMPT = "\n请根据上述内容回答问题: "
+
+def estimate_tokens(text: str) -> int:
+    """不依赖分词器的 token 估算，偏保守"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + -(-(len(text) - cjk) // ASCII_CHARS_PER_TOKEN)
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """按估算 token 数截断文本"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cost = 0.0
+    for index, char in enumerate(text):
+        cost += 1 if CJK_PATTERN.match(char) else 1 / ASCII_CHARS_PER_TOKEN
+        if cost > max_tokens:
+            return text[:index].rstrip() + "…"
+    return text
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+@dataclass
+class Passage:
+    doc_hash: str
+    doc_name: str
+    chunk_index: int
+    content: str
+
+    @property
+    def sort_key(self):
+        return self.doc_name, self.doc_hash, self.chunk_index
+
+@dataclass
+class ChatContext:
+    messages: List[Dict[str, str]]
+    passages: List[Passage]
+    # 估算的提示词 token 数，实际值以 llama.cpp 返回的 timings 为准
+    estimated_tokens: int
+    dropped_history: int
+    dropped_passages: int
+
+def extract_passages(query_results: Optional[QueryResult]) -> List[Passage]:
+    """按检索排名取出资料，去掉内容重复（忽略空白差异）或被更靠前资料包含的分块"""
+    if not query_results or not query_results.get("documents"):
+        return []
+    documents = query_results["documents"][0] or []
+    metadatas = (query_results.get("metadatas") or [[]])[0] or [None] * len(documents)
+    passages: List[Passage] = []
+    seen = set()
+    kept: List[str] = []
+    for content, metadata in zip(documents, metadatas):
+        normalized = WHITESPACE_PATTERN.sub(" ", content or "").strip()
+        if not normalized:
+            continue
+        digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+        if digest in seen or any(normalized in other for other in kept):
+            continue
+        seen.add(digest)
+        kept.append(normalized)
+        metadata = metadata or {}
+        passages.append(Passage(
+            doc_hash=metadata.get("doc_hash", ""),
+            doc_name=metadata.get("doc_name", ""),
+            chunk_index=int(metadata.get("chunk_index", 0)),
+            content=normalized,
+        ))
+    return passages
+
+def format_question(passages: List[Passage], question: str) -> str:
+    if not passages:
+        return question
+    hints = "".join(
+        f"{index}. [{passage.doc_name}] {passage.content}\n" if passage.doc_name else f"{index}. {passage.content}\n"
+        for index, passage in enumerate(passages, start=1)
+    )
+    return f"{HINTS_HEADER}{hints}{QUESTION_PROMPT}{question}"
+
+def build_chat_context(
+    query_results: Optional[QueryResult],
+    question: str,
+    contexts: Optional[List[Dict[str, str]]],
+    budget: int = RAG_CONTEXT_TOKEN_BUDGET
+) -> ChatContext:
+    """在 token 预算内组装消息：系统提示 → 历史对话 → 资料与问题
+
+    系统提示固定在最前，历史保持原顺序，资料按 (文档, 分块序号) 排序，
+    相邻两轮对话的提示词前缀尽量一致，以命中 llama.cpp 的 cache_prompt。
+    不修改调用方传入的 contexts。
+    """
+    history = [dict(message) for message in contexts or []]
+    # 调用方自带系统提示时使用调用方的
+    if history and history[0].get("role") == "system":
+        system = history.pop(0)
+    else:
+        system = {"role": "system", "content": RAG_CONTEXT_SYSTEM_PROMPT}
+
+    fixed_tokens = message_tokens(system) + message_tokens({"content": format_question([], question)})
+
+    # 从最近的轮次往前保留历史
+    history_budget = min(RAG_CONTEXT_HISTORY_TOKENS, max(budget - fixed_tokens, 0))
+    kept_history: List[Dict[str, str]] = []
+    history_tokens = 0
+    for message in reversed(history):
+        tokens = message_tokens(message)
+        if history_tokens + tokens > history_budget:
+            break
+        kept_history.append(message)
+        history_tokens += tokens
+    kept_history.reverse()
+    # 历史以 user 开头，避免截断后出现孤立的 assistant 回复
+    while kept_history and kept_history[0].get("role") == "assistant":
+        history_tokens -= message_tokens(kept_history.pop(0))
+
+    # 按检索排名在剩余预算内选取资料
+    candidates = extract_passages(query_results)
+    remaining = budget - fixed_tokens - history_tokens - estimate_tokens(HINTS_HEADER + QUESTION_PROMPT)
+    selected: List[Passage] = []
+    for passage in candidates:
+        # 序号与文档名的开销
+        overhead = estimate_tokens(f"{len(selected) + 1}. [{passage.doc_name}] \n")
+        allowed = min(RAG_CONTEXT_PASSAGE_TOKENS, remaining - overhead)
+        if allowed < RAG_CONTEXT_MIN_PASSAGE_TOKENS:
+            break
+        content = truncate_tokens(passage.content, allowed)
+        remaining -= estimate_tokens(content) + overhead
+        selected.append(Passage(passage.doc_hash, passage.doc_name, passage.chunk_index, content))
+    selected.sort(key=lambda passage: passage.sort_key)
+
+    messages = [system, *kept_history, {"role": "user", "content": format_question(selected, question)}]
+    context = ChatContext(
+        messages=messages,
+        passages=selected,
+        estimated_tokens=sum(message_tokens(message) for message in messages),
+        dropped_history=len(history) - len(kept_history),
+        dropped_passages=len(candidates) - len(selected),
+    )
+    if context.dropped_history or context.dropped_passages:
+        logger.info(
+            f"context trimmed to {context.estimated_tokens} tokens, "
+            f"dropped history: {context.dropped_history}, dropped passages: {context.dropped_passages}"
+        )
+    return context
@@ -1,78 +1,151 @@
-import os
 import logging
-import pprint
-import json
-import requests
-from typing import Dict, List
+import time
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 from core.vector.base import VectorAnalyzer
+from core.knowledge.answer_cache import RAG_ANSWER_CACHE_ENABLED, get_answer_cache
+from core.knowledge.context import ChatContext, build_chat_context
+from core.knowledge.session import SessionTurn
+from core.knowledge.backend import LLMBackendPool
+from dao.sqlite.chunk import get_corpus_version
 from chromadb.api.types import QueryResult
 from pydantic import BaseModel, Field
-from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
-LLM_SERVER_BASE_URL = os.getenv("LLM_SERVER_BASE_URL")
-LLM_CHAT_ENDPOINT = os.getenv("LLM_CHAT_ENDPOINT")
+async def retrieval_and_ask(
+    analyzer: VectorAnalyzer,
+    pool: LLMBackendPool,
+    question: str,
+    contexts: list[dict[str, str]],
+    usage: Optional[dict] = None,
+    turn: Optional[SessionTurn] = None
+) -> str:
+    """检索并提问，等待生成结束后返回完整回答"""
+    full_content = ""
+    async for content in stream_retrieval_and_ask(analyzer, pool, question, contexts, usage, turn):
+        full_content += content
+    return full_content
 
-def retrieval_and_ask(question: str, contexts: list[dict[str, str]]) -> str:
-    analyzer = VectorAnalyzer()
-    query_results = analyzer.search_similarity(question)
-    # pprint.pp(f"query_results: {query_results}")
-    
-    chat_payload = generate_chat_payload(query_results=query_results, question=question, contexts=contexts)
-    chat_resp = requests.post(
-        url=urljoin(LLM_SERVER_BASE_URL, LLM_CHAT_ENDPOINT),
-        json=chat_payload,
-        stream=True,
-    )
+async def stream_retrieval_and_ask(
+    analyzer: VectorAnalyzer,
+    pool: LLMBackendPool,
+    question: str,
+    contexts: list[dict[str, str]],
+    usage: Optional[dict] = None,
+    turn: Optional[SessionTurn] = None
+) -> AsyncIterator[str]:
+    """检索并提问，按 llama.cpp 生成顺序逐段返回回答内容
 
-    # 用于拼接最终输出
-    full_content = ""
+    调用方提前关闭生成器（如客户端断开）时会关闭上游连接，llama.cpp 随之停止生成。
+    请求由 pool 按负载分配到后端，会话优先使用 turn 绑定的后端。
+    usage 不为空时写入本次请求的提示词统计，见 parse_usage。
+    turn 不为空时使用服务端会话历史（忽略 contexts）与会话绑定的 slot，完整生成后记录本轮对话。
+    """
+    usage = usage if usage is not None else {}
+    if turn is not None:
+        contexts = turn.history
 
-    for line in chat_resp.iter_lines():
-        if not line:
-            continue
-        line = line.decode("utf-8")
+    # 带对话上下文的提问回答依赖上下文，不走回答缓存
+    use_cache = RAG_ANSWER_CACHE_ENABLED and not contexts and turn is None
+    if use_cache:
+        answer_cache = get_answer_cache()
+        # 在检索之前读取，检索到的文档之后被重新写入时写入的回答会在命中时失效
+        corpus_version = await asyncio.to_thread(get_corpus_version)
 
-        # 跳过控制信息，比如 [DONE] 或空段
-        if line.strip() == "" or line.strip() == "data: [DONE]":
-            continue
+    # 检索包含同步的 embedding 与向量库调用，放到线程池避免阻塞事件循环
+    query_results = await asyncio.to_thread(analyzer.search_similarity, question)
 
-        # 解析 JSON 内容
-        if line.startswith("data: "):
-            line = line[len("data: "):]
+    if use_cache:
+        # 向量检索已计算过问题向量，此处通常命中向量缓存
+        question_vector = await asyncio.to_thread(analyzer.embedding.embed_query, question)
+        doc_hashes = retrieved_doc_hashes(query_results)
+        cached = await asyncio.to_thread(answer_cache.lookup, question_vector, doc_hashes)
+        if cached is not None:
+            logger.info(f"answer cache hit, saved {cached.generation_ms:.1f}ms")
+            usage["answer_cache"] = True
+            yield cached.answer
+            return
 
-        try:
-            chunk = json.loads(line)
-            delta = chunk.get("choices", [{}])[0].get("delta", {})
+    started = time.perf_counter()
+    answer_parts = []
+    chat_payload, chat_context = generate_chat_payload(query_results=query_results, question=question, contexts=contexts)
+    usage.update({
+        "answer_cache": False,
+        "estimated_prompt_tokens": chat_context.estimated_tokens,
+        "passages": len(chat_context.passages),
+        "dropped_passages": chat_context.dropped_passages,
+        "dropped_history": chat_context.dropped_history,
+    })
+    if turn is not None and turn.id_slot is not None:
+        # 固定 slot，复用该会话上一轮的 KV 缓存
+        chat_payload["id_slot"] = turn.id_slot
+        usage["id_slot"] = turn.id_slot
+    # 首个 token 之前失败时 stream_chat 会换后端重试
+    async with aclosing(pool.stream_chat(chat_payload, turn.backend if turn is not None else None, usage)) as chunks:
+        async for chunk in chunks:
+            # 最后一段带有 timings/usage，choices 可能为空
+            usage.update(parse_usage(chunk))
+            delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
             content = delta.get("content")
             if content:
-                print(content, end="", flush=True)  # 实时输出
-                full_content += content
-        except json.JSONDecodeError as e:
-            print(f"Invalid JSON line: {e}")
-            
-    return full_content
-    
-def generate_chat_payload(query_results: QueryResult, question: str, contexts: List[dict[str, str]]) -> Dict:
-    hints = ""
-    index = 1
-    for doc_content in zip(
-        query_results["documents"][0]
-    ):
-        hints = f"{hints}{index}. {doc_content}\n"
-    
-    hint_question = question
-    if hints:
-        hint_question = f"以下是相关资料：\n{hints}\n\n请根据上述内容回答问题: {question}"
-        
-    contexts.append({
-        "role": "user",
-        "content": hint_question
-    })
-    
+                answer_parts.append(content)
+                yield content
+    if turn is not None and usage.get("backend") != turn.backend:
+        usage.pop("id_slot", None)
+
+    logger.info(
+        f"prompt tokens: {usage.get('prompt_tokens')}, cached tokens: {usage.get('cached_tokens')}, "
+        f"estimated: {chat_context.estimated_tokens}"
+    )
+
+    if turn is not None:
+        # 历史只保存原始问题，资料每轮重新检索，避免带资料的提示占满历史预算
+        turn.record(question, "".join(answer_parts))
+
+    # 只缓存完整生成的回答，提前关闭的生成器不会执行到这里
+    if use_cache:
+        answer_cache.put(
+            question=question,
+            vector=question_vector,
+            doc_hashes=doc_hashes,
+            answer="".join(answer_parts),
+            generation_ms=(time.perf_counter() - started) * 1000,
+            corpus_version=corpus_version,
+        )
+
+def parse_usage(chunk: dict) -> dict:
+    """从 llama.cpp 返回中读取提示词 token 数与命中 KV 缓存的 token 数
+
+    llama.cpp 在 timings 中返回 prompt_n（本次实际计算的 token）与 cache_n（复用缓存的 token），
+    兼容 OpenAI 格式的 usage.prompt_tokens_details.cached_tokens。
+    """
+    timings = chunk.get("timings")
+    if timings and "prompt_n" in timings:
+        cached = timings.get("cache_n", 0)
+        return {
+            "prompt_tokens": timings["prompt_n"] + cached,
+            "cached_tokens": cached,
+            "prompt_ms": timings.get("prompt_ms"),
+        }
+    openai_usage = chunk.get("usage")
+    if openai_usage and "prompt_tokens" in openai_usage:
+        return {
+            "prompt_tokens": openai_usage["prompt_tokens"],
+            "cached_tokens": (openai_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+        }
+    return {}
+
+def retrieved_doc_hashes(query_results: QueryResult) -> Set[str]:
+    metadatas = (query_results.get("metadatas") or [[]])[0] or []
+    return {metadata["doc_hash"] for metadata in metadatas if metadata and "doc_hash" in metadata}
+
+def generate_chat_payload(query_results: QueryResult, question: str, contexts: List[dict[str, str]]) -> Tuple[Dict, ChatContext]:
+    """组装 llama.cpp 请求，返回 (请求体, 组装后的上下文)"""
+    chat_context = build_chat_context(query_results=query_results, question=question, contexts=contexts)
     return {
-        "messages": contexts,
+        "messages": chat_context.messages,
         "stream": True,
         "cache_prompt": True,
         "samplers": "edkypmxt",
@@ -94,6 +167,7 @@ def generate_chat_payload(query_results: QueryResult, question: str, contexts: L
         "dry_allowed_length": 2,
         "dry_penalty_last_n": -1,
         "max_tokens": -1,
-        "timings_per_token": False
-    }
-  
\ No newline at end of file
+        "timings_per_token": False,
+        # 最后一段返回 usage，用于统计提示词 token
+        "stream_options": {"include_usage": True},
+    }, chat_context
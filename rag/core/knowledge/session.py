@@ -0,0 +1,266 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import httpx
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from core.knowledge.context import RAG_CONTEXT_HISTORY_TOKENS, message_tokens
+from core.knowledge.backend import LLM_SLOTS_ENDPOINT, LLMBackend, LLMBackendPool
+
+logger = logging.getLogger(__name__)
+
+# 会话空闲超过该时间（秒）后过期
+RAG_CHAT_SESSION_TTL = int(os.getenv("RAG_CHAT_SESSION_TTL", 1800))
+# 同时保留的会话数上限，超过后淘汰最久未活动的会话
+RAG_CHAT_SESSION_MAX = int(os.getenv("RAG_CHAT_SESSION_MAX", 1000))
+# 会话历史的 token 上限，不超过上下文组装的历史预算，超出时一次丢弃到一半，减少提示词前缀变化
+RAG_CHAT_SESSION_HISTORY_TOKENS = min(
+    int(os.getenv("RAG_CHAT_SESSION_HISTORY_TOKENS", RAG_CONTEXT_HISTORY_TOKENS)),
+    RAG_CONTEXT_HISTORY_TOKENS,
+)
+# llama.cpp 的 slot 数（--parallel），0 表示不绑定 slot；后端开启 /slots 时以探测结果为准
+LLM_SLOT_COUNT = int(os.getenv("LLM_SLOT_COUNT", 0))
+# llama.cpp 是否配置了 --slot-save-path，开启后 slot 被其他会话占用前保存 KV 缓存，再次使用时恢复
+LLM_SLOT_SAVE_ENABLED = os.getenv("LLM_SLOT_SAVE_ENABLED", "false").lower() == "true"
+
+@dataclass
+class ChatSession:
+    session_id: str
+    # (角色, 内容)，user 内容为原始问题，不含检索资料，使历史在预算内保留多轮
+    messages: List[Tuple[str, str]] = field(default_factory=list)
+    tokens: int = 0
+    last_active: float = field(default_factory=time.time)
+    # 绑定的后端与 slot
+    backend: Optional[str] = None
+    slot: Optional[int] = None
+    # slot 被占用前保存的 KV 缓存文件名，只能在保存它的后端恢复
+    saved_file: Optional[str] = None
+    saved_backend: Optional[str] = None
+    turns: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def history(self) -> List[Dict[str, str]]:
+        return [{"role": role, "content": content} for role, content in self.messages]
+
+    def append(self, user_content: str, answer: str, max_tokens: int):
+        self.messages.append(("user", user_content))
+        self.messages.append(("assistant", answer))
+        self.tokens += message_tokens({"content": user_content}) + message_tokens({"content": answer})
+        self.turns += 1
+        if self.tokens <= max_tokens:
+            return
+        # 按整轮从最早开始丢弃，保留最近一轮
+        while self.tokens > max_tokens // 2 and len(self.messages) > 2:
+            for _ in range(2):
+                _, content = self.messages.pop(0)
+                self.tokens -= message_tokens({"content": content})
+
+    def summary(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "turns": self.turns,
+            "messages": len(self.messages),
+            "tokens": self.tokens,
+            "backend": self.backend,
+            "slot": self.slot,
+            "saved": self.saved_file is not None,
+            "idle_seconds": round(time.time() - self.last_active, 1),
+        }
+
+@dataclass
+class SessionTurn:
+    """会话中正在进行的一轮提问"""
+    session: ChatSession
+    # 本轮优先使用的后端，id_slot 只对该后端有效
+    backend: Optional[str]
+    id_slot: Optional[int]
+    history: List[Dict[str, str]]
+    max_tokens: int
+
+    def record(self, user_content: str, answer: str):
+        self.session.append(user_content, answer, self.max_tokens)
+
+class SessionManager:
+    """服务端会话：保存有限长度的历史，并将会话绑定到固定的后端与 llama.cpp slot
+
+    同一会话的多轮提问串行执行；后端由 LLMBackendPool 按负载与粘性选择，后端变化时释放原 slot；
+    slot 不足时占用该后端上最久未活动且空闲的会话的 slot，
+    开启 LLM_SLOT_SAVE_ENABLED 时先保存其 KV 缓存，该会话再次提问时恢复。
+    只在事件循环线程内使用。
+    """
+
+    def __init__(
+        self,
+        ttl: int = RAG_CHAT_SESSION_TTL,
+        max_sessions: int = RAG_CHAT_SESSION_MAX,
+        history_tokens: int = RAG_CHAT_SESSION_HISTORY_TOKENS,
+        slot_count: int = LLM_SLOT_COUNT,
+        slot_save: bool = LLM_SLOT_SAVE_ENABLED
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.history_tokens = history_tokens
+        self.slot_count = slot_count
+        self.slot_save = slot_save
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        # (后端, slot) -> 会话 id
+        self.slot_owners: Dict[Tuple[str, int], str] = {}
+        self.slot_lock = asyncio.Lock()
+        self.expired = 0
+        self.slot_saves = 0
+        self.slot_restores = 0
+        self.slot_failures = 0
+
+    def _release_slot(self, session: ChatSession):
+        key = (session.backend, session.slot)
+        if session.slot is not None and self.slot_owners.get(key) == session.session_id:
+            del self.slot_owners[key]
+        session.slot = None
+
+    def _drop(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self._release_slot(session)
+
+    def purge_expired(self):
+        deadline = time.time() - self.ttl
+        # sessions 按最近活动排序，从最早的开始检查
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_active > deadline or session.lock.locked():
+                break
+            self._drop(session_id)
+            self.expired += 1
+
+    def create(self) -> ChatSession:
+        self.purge_expired()
+        while len(self.sessions) >= self.max_sessions:
+            self._drop(next(iter(self.sessions)))
+            self.expired += 1
+        session = ChatSession(session_id=uuid.uuid4().hex)
+        self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        self.purge_expired()
+        return self.sessions.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        exists = session_id in self.sessions
+        self._drop(session_id)
+        return exists
+
+    async def _slot_action(self, client: httpx.AsyncClient, backend: LLMBackend, slot: int, action: str, filename: str) -> bool:
+        try:
+            resp = await client.post(
+                backend.url(f"{LLM_SLOTS_ENDPOINT}/{slot}"),
+                params={"action": action},
+                json={"filename": filename},
+            )
+            resp.raise_for_status()
+            return True
+        except httpx.HTTPError as e:
+            self.slot_failures += 1
+            logger.warning(f"slot {action} failed, backend: {backend.base_url}, slot: {slot}, file: {filename}, error: {str(e)}")
+            return False
+
+    async def _assign_slot(self, pool: LLMBackendPool, session: ChatSession) -> Optional[int]:
+        """为会话选择后端并分配 slot，该后端所有 slot 都在生成中时返回 None（本轮不绑定 slot）
+
+        slot_lock 内只预留 slot，保存/恢复 KV 缓存的 HTTP 请求在锁外执行，
+        不阻塞其它会话分配 slot；请求期间被取消时释放预留的 slot。
+        """
+        backend = pool.choose(preferred=session.backend)
+        if backend is None:
+            # 全部后端不可用，交给 stream_chat 报错
+            return None
+        victim: Optional[ChatSession] = None
+        async with self.slot_lock:
+            if backend.base_url != session.backend:
+                if session.backend is not None:
+                    logger.info(f"session {session.session_id} moved from {session.backend} to {backend.base_url}")
+                self._release_slot(session)
+                session.backend = backend.base_url
+
+            slot_count = backend.slot_count if backend.slot_count is not None else self.slot_count
+            if self.slot_count <= 0 or slot_count <= 0:
+                return None
+            if session.slot is not None:
+                if session.slot < slot_count:
+                    return session.slot
+                self._release_slot(session)
+
+            owned = {slot for base_url, slot in self.slot_owners if base_url == backend.base_url}
+            free = [slot for slot in range(slot_count) if slot not in owned]
+            if free:
+                slot = free[0]
+            else:
+                # 占用该后端上最久未活动且不在生成中的会话的 slot
+                victims = [
+                    self.sessions[owner] for (base_url, _), owner in self.slot_owners.items()
+                    if base_url == backend.base_url and owner in self.sessions and not self.sessions[owner].lock.locked()
+                ]
+                if not victims:
+                    return None
+                victim = min(victims, key=lambda item: item.last_active)
+                slot = victim.slot
+                self._release_slot(victim)
+
+            self.slot_owners[(backend.base_url, slot)] = session.session_id
+            session.slot = slot
+            restore_file = session.saved_file if session.saved_backend == backend.base_url else None
+            session.saved_file, session.saved_backend = None, None
+
+        if not self.slot_save or (victim is None and restore_file is None):
+            return slot
+        try:
+            if victim is not None:
+                filename = f"rag-session-{victim.session_id}.bin"
+                if await self._slot_action(pool.client, backend, slot, "save", filename):
+                    self.slot_saves += 1
+                    # 保存期间被占用的会话可能已开始新一轮并分配了其它 slot，此时缓存已过时
+                    if victim.slot is None and victim.session_id in self.sessions:
+                        victim.saved_file, victim.saved_backend = filename, backend.base_url
+            if restore_file is not None:
+                if await self._slot_action(pool.client, backend, slot, "restore", restore_file):
+                    self.slot_restores += 1
+        except BaseException:
+            async with self.slot_lock:
+                self._release_slot(session)
+            raise
+        return slot
+
+    @asynccontextmanager
+    async def turn(self, pool: LLMBackendPool, session: ChatSession) -> AsyncIterator[SessionTurn]:
+        """开始一轮提问，同一会话的提问按顺序执行"""
+        async with session.lock:
+            session.last_active = time.time()
+            self.sessions.move_to_end(session.session_id, last=True)
+            id_slot = await self._assign_slot(pool, session)
+            try:
+                yield SessionTurn(
+                    session=session,
+                    backend=session.backend,
+                    id_slot=id_slot,
+                    history=session.history(),
+                    max_tokens=self.history_tokens,
+                )
+            finally:
+                session.last_active = time.time()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "expired": self.expired,
+            "slot_count": self.slot_count,
+            "slots_in_use": len(self.slot_owners),
+            "slot_saves": self.slot_saves,
+            "slot_restores": self.slot_restores,
+            "slot_failures": self.slot_failures,
+        }
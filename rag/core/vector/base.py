@@ -1,44 +1,213 @@
+import os
+import re
 import logging
 import pprint
-from typing import List, Union
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Union
 from core.vector.loader import PluginManager
-from core.vector.storage.db import VectorDatabase
-from core.vector.embeddings.embedding import get_embeddings
-from dao.sqlite.document import Document as DaoDocument
-from langchain_core.embeddings import Embeddings
+from core.vector.storage.db import VectorDatabase, RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN
+from core.vector.embeddings.embedding import get_embeddings, get_embedding_signature
+from dao.sqlite.document import Document as DaoDocument, INDEX_INDEXED, update_index_state
+from dao.sqlite.chunk import replace_chunks, search_chunks
 from langchain_core.documents.base import Document as LangchainDocument
 from chromadb.api.types import GetResult, QueryResult
 
 logger = logging.getLogger(__name__)
 
+# 检索模式：vector 纯向量；lexical 纯全文(BM25)；hybrid 两路并发后 RRF 融合；auto 标识符类查询走全文，其余走 hybrid
+SEARCH_MODES = ("vector", "lexical", "hybrid", "auto")
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "vector")
+# RRF 融合常数，越大排名靠后的结果权重衰减越慢
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", 60))
+# hybrid 模式每路召回的候选数为最终返回数的倍数
+RAG_HYBRID_CANDIDATE_FACTOR = int(os.getenv("RAG_HYBRID_CANDIDATE_FACTOR", 2))
+
+# 错误码、配置项、函数名等：不含空白，且包含数字、分隔符或驼峰
+IDENTIFIER_PATTERN = re.compile(r"^(?=.*(?:[\d_.:/#-]|[a-z][A-Z]))[\w.:/#-]+$")
+
+def is_identifier_query(text: str) -> bool:
+    return bool(IDENTIFIER_PATTERN.match(text.strip()))
+
 class VectorAnalyzer:
     
     def __init__(self):
-        self.plugin_manager = PluginManager()
         self.embedding = get_embeddings()
+        # 启动时加载全部插件，实例在处理线程间共享
+        self.plugin_manager = PluginManager(self.embedding)
         self.vector_db = VectorDatabase(self.embedding)
+        # hybrid 模式下全文检索与向量检索并发执行
+        self.search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical-search")
         
-    def process_files(self, docs: List[DaoDocument]) -> int:
+    def process_file(self, doc: DaoDocument) -> int:
+        """逐段提取文本并建立索引，返回分块数"""
+        plugin = self.plugin_manager.get_plugin(doc)
+        return self.index_stream(doc, plugin.iter_text(doc.full_path().as_posix()))
+
+    def index_stream(self, doc: DaoDocument, texts: Iterable[str]) -> int:
+        """对逐段到达的文本边分块边向量化，全部完成后写入向量库，返回分块数"""
+        plugin = self.plugin_manager.get_plugin(doc)
+        chunks, vectors = plugin.stream_to_vector(texts)
+        return self._save_index(doc, plugin, chunks, vectors)
+
+    def _save_index(self, doc: DaoDocument, plugin, chunks: List[LangchainDocument], vectors: List[List[float]]) -> int:
+        self.vector_db.save(
+            doc=doc,
+            chunks=chunks,
+            vectors=vectors
+        )
+        # 同时递增该文档的分块版本，引用该文档的缓存回答命中时失效
+        replace_chunks(doc.doc_hash, doc.doc_name, [{
+            "chunk_id": f"{doc.doc_hash}-{chunk.metadata['chunk_index']}",
+            "chunk_index": chunk.metadata["chunk_index"],
+            "content": chunk.page_content,
+        } for chunk in chunks])
+        if doc.id is not None:
+            update_index_state(doc.id, INDEX_INDEXED, self.index_state_for_plugin(plugin))
+        return len(chunks)
+
+    def index_state_for_plugin(self, plugin) -> Dict[str, object]:
+        embedding_model, embedding_dimension = get_embedding_signature()
+        return {
+            "embedding_model": embedding_model,
+            "embedding_dimension": embedding_dimension,
+            "chunker_version": plugin.chunker.version,
+            "plugin_version": plugin.version_tag(),
+        }
+
+    def index_state(self, file_format: str) -> Dict[str, object]:
+        """按当前配置处理该格式文档时的索引状态"""
+        return self.index_state_for_plugin(self.plugin_manager.get_plugin_by_format(file_format))
+
+    def is_index_current(self, doc: DaoDocument) -> bool:
+        """文档已按当前的向量模型、维度、分块与插件版本建立索引"""
+        if doc.index_status != INDEX_INDEXED:
+            return False
         try:
-            for doc in docs:
-                plugin = self.plugin_manager.get_plugin(doc, self.embedding)
-                full_path = Path(doc.dest_dir).joinpath(doc.doc_name)
-                doc_content, vector = plugin.document_to_vector(full_path.as_posix())
-                self.vector_db.save(
-                    doc=doc,
-                    vector=vector,
-                    doc_content=doc_content
-                )
-
-            return 0
-        except Exception as e:
-            logger.error(f"process file error: {str(e)}")
-            return 1
-
-    def get_vectors(self, doc_hash: Union[str, List[str]]) -> GetResult:
-        return self.vector_db.collection.get(ids=doc_hash, include=["metadatas", "uris", "embeddings", "documents"])
+            state = self.index_state_for_plugin(self.plugin_manager.get_plugin(doc))
+        except Exception:
+            return False
+        return all(getattr(doc, key) == value for key, value in state.items())
+
+    def get_vectors(self, doc_hash: Union[str, List[str]], include: Optional[List[str]] = None) -> GetResult:
+        """获取文档所有分块的向量，include 为空时返回全部字段"""
+        doc_hashes = [doc_hash] if isinstance(doc_hash, str) else doc_hash
+        return self.vector_db.get(doc_hashes, include)
         
-    def search_similarity(self, text: str) -> QueryResult:
-        return self.vector_db.find_similar(text=text)
+    def search_similarity(self, text: str, mode: Optional[str] = None, include: Optional[List[str]] = None) -> QueryResult:
+        """检索相关分块，mode 为空时使用 RAG_SEARCH_MODE，include 为空时返回全部字段
+
+        lexical 结果不经过 embedding 与向量库，返回中 embeddings 与 uris 为 None；
+        lexical/hybrid 结果额外带有 scores（越大越相关）。
+        """
+        mode = mode or RAG_SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"unsupported search mode: {mode}")
+        n_results = RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN
+
+        if mode == "auto":
+            if is_identifier_query(text):
+                query_results = self.lexical_search(text, n_results)
+                if query_results["ids"][0]:
+                    return query_results
+            mode = "hybrid"
+
+        if mode == "vector":
+            return self.vector_db.find_similar(text=text, n_results=n_results, include=include)
+        if mode == "lexical":
+            return self.lexical_search(text, n_results)
+        return self.hybrid_search(text, n_results, include=include)
+
+    def search_similarity_batch(
+        self,
+        texts: List[str],
+        n_results: Optional[int] = None,
+        include: Optional[List[str]] = None,
+        where: Optional[dict] = None
+    ) -> QueryResult:
+        """批量向量检索：全部文本一次 embed_documents（内部按接口上限并发分批），再一次多查询检索，结果与输入顺序对齐"""
+        vectors = self.embedding.embed_documents(texts)
+        return self.vector_db.find_similar_batch(
+            vectors,
+            n_results=n_results or RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN,
+            include=include,
+            where=where,
+        )
+
+    def lexical_search(self, text: str, n_results: int) -> QueryResult:
+        """仅使用 FTS5 全文索引检索"""
+        rows = search_chunks(text, n_results)
+        return {
+            "ids": [[row["chunk_id"] for row in rows]],
+            "metadatas": [[self._lexical_metadata(row) for row in rows]],
+            "documents": [[row["content"] for row in rows]],
+            "embeddings": None,
+            "uris": None,
+            "distances": None,
+            # bm25() 越小越相关，取反后与其它模式的 scores 方向一致
+            "scores": [[-row["score"] for row in rows]],
+        }
+
+    def hybrid_search(self, text: str, n_results: int, include: Optional[List[str]] = None) -> QueryResult:
+        """全文检索与向量检索并发执行，按倒数排名融合(RRF)合并结果"""
+        candidates = n_results * RAG_HYBRID_CANDIDATE_FACTOR
+        lexical_future = self.search_pool.submit(search_chunks, text, candidates)
+        vector_results = self.vector_db.find_similar(text=text, n_results=candidates, include=include)
+        lexical_rows = lexical_future.result()
+
+        fused: Dict[str, dict] = {}
+        vector_ids = vector_results["ids"][0]
+        columns = {
+            name: self._result_column(vector_results, key, len(vector_ids))
+            for name, key in (("metadata", "metadatas"), ("document", "documents"), ("embedding", "embeddings"),
+                              ("uri", "uris"), ("distance", "distances"))
+        }
+        for rank, chunk_id in enumerate(vector_ids):
+            fused[chunk_id] = {
+                "score": 1.0 / (RAG_RRF_K + rank + 1),
+                **{name: column[rank] for name, column in columns.items()},
+            }
+        for rank, row in enumerate(lexical_rows):
+            item = fused.setdefault(row["chunk_id"], {
+                "score": 0.0,
+                "metadata": self._lexical_metadata(row),
+                "document": row["content"],
+                "embedding": None,
+                "uri": None,
+                "distance": None,
+            })
+            item["score"] += 1.0 / (RAG_RRF_K + rank + 1)
+
+        # 分数相同时按 chunk_id 排序，保证结果稳定
+        ranked = sorted(fused.items(), key=lambda kv: (-kv[1]["score"], kv[0]))[:n_results]
+        return {
+            "ids": [[chunk_id for chunk_id, _ in ranked]],
+            "metadatas": [[item["metadata"] for _, item in ranked]],
+            "documents": [[item["document"] for _, item in ranked]],
+            "embeddings": [[item["embedding"] for _, item in ranked]],
+            "uris": [[item["uri"] for _, item in ranked]],
+            "distances": [[item["distance"] for _, item in ranked]],
+            "scores": [[item["score"] for _, item in ranked]],
+        }
+
+    @staticmethod
+    def _result_column(results: dict, key: str, size: int) -> list:
+        """取出结果中的一列，未请求的字段补 None"""
+        column = results.get(key)
+        return column[0] if column is not None else [None] * size
+
+    @staticmethod
+    def _lexical_metadata(row: dict) -> dict:
+        return {
+            "doc_hash": row["doc_hash"],
+            "doc_name": row["doc_name"],
+            "chunk_index": row["chunk_index"],
+        }
+
+    def close(self):
+        """释放 embedding 客户端连接池等资源"""
+        self.search_pool.shutdown(wait=False)
+        self.vector_db.close()
+        close = getattr(self.embedding, "close", None)
+        if close:
+            close()
             
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+from typing import Iterable, Iterator, List
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", 800))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", 100))
+# 流式切分时缓冲文本达到 chunk_size 的该倍数后切分一次
+RAG_CHUNK_STREAM_WINDOW = int(os.getenv("RAG_CHUNK_STREAM_WINDOW", 8))
+
+class TextChunker:
+    """将文档全文切分为带偏移量的小段落"""
+
+    # 切分逻辑变化时递增
+    VERSION = "1"
+
+    def __init__(self, chunk_size: int = RAG_CHUNK_SIZE, chunk_overlap: int = RAG_CHUNK_OVERLAP):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True,
+        )
+
+    @property
+    def version(self) -> str:
+        """切分逻辑版本与参数，任一变化后分块结果不同"""
+        return f"{self.VERSION}:{self.chunk_size}:{self.chunk_overlap}"
+
+    def _split(self, text: str, offset: int = 0, first_index: int = 0) -> List[Document]:
+        """切分文本，offset 为 text 在全文中的起始偏移，first_index 为首个分块的序号"""
+        chunks = self.splitter.create_documents([text])
+        for index, chunk in enumerate(chunks, start=first_index):
+            start = chunk.metadata.get("start_index", -1)
+            chunk.metadata = {
+                "chunk_index": index,
+                "start_offset": start + offset if start >= 0 else -1,
+                "end_offset": start + offset + len(chunk.page_content) if start >= 0 else -1,
+            }
+        return chunks
+
+    def split(self, text: str) -> List[Document]:
+        """切分文本，metadata 中记录分块序号及其在原文中的起止偏移"""
+        return self._split(text)
+
+    def split_stream(self, texts: Iterable[str]) -> Iterator[Document]:
+        """逐段切分文本流（如逐页提取的 PDF），偏移量为分块在各段拼接后全文中的位置
+
+        缓冲区末尾一个分块长度内的文本可能与下一段相连，留到后续文本到达后再切分；
+        已返回的分块不再变化，调用方可以边提取边向量化。
+        """
+        window = self.chunk_size * max(1, RAG_CHUNK_STREAM_WINDOW)
+        buffer = ""
+        # buffer 在全文中的起始偏移
+        offset = 0
+        next_index = 0
+        threshold = window
+        for text in texts:
+            if not text:
+                continue
+            buffer += text
+            if len(buffer) < threshold:
+                continue
+
+            chunks = self._split(buffer, offset, next_index)
+            limit = offset + len(buffer) - self.chunk_size
+            ready = 0
+            for chunk in chunks:
+                if chunk.metadata["start_offset"] < 0 or chunk.metadata["end_offset"] > limit:
+                    break
+                ready += 1
+            if ready == 0 or ready == len(chunks) or chunks[ready].metadata["start_offset"] < 0:
+                # 单个分块跨越整个缓冲区，等待更多文本
+                threshold = len(buffer) + window
+                continue
+
+            yield from chunks[:ready]
+            # 从第一个未返回的分块（含与上一分块的重叠）开始保留
+            cut = chunks[ready].metadata["start_offset"] - offset
+            buffer = buffer[cut:]
+            offset += cut
+            next_index += ready
+            threshold = window
+
+        if buffer:
+            yield from self._split(buffer, offset, next_index)
@@ -0,0 +1,271 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from dao.sqlite.database import RAG_SQLITE_BUSY_TIMEOUT
+from dao.sqlite.document import SQLITE_MAX_VARIABLES
+
+logger = logging.getLogger(__name__)
+
+RAG_SQLITE_DIR = os.getenv("RAG_SQLITE_DIR")
+RAG_EMBEDDING_CACHE_DB = os.getenv("RAG_EMBEDDING_CACHE_DB", "embedding_cache.db")
+# 磁盘缓存容量上限（字节），超过后按最近访问时间淘汰
+RAG_EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("RAG_EMBEDDING_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# 内存 LRU 缓存条数
+RAG_EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("RAG_EMBEDDING_CACHE_MEMORY_ITEMS", 10000))
+
+EVICT_BATCH_SIZE = 1000
+
+class EmbeddingCacheStore:
+    """内容寻址的向量缓存：内存 LRU + SQLite 磁盘存储（float32 小端二进制）
+
+    API 服务、批量导入命令与提取进程共用同一个缓存文件，磁盘占用记录在 embedding_cache_size 表中，
+    与写入、淘汰在同一事务内更新，各进程据此判断是否超过容量上限。
+    每个线程使用独立的连接，WAL 模式下读取互不阻塞。
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int, memory_items: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory: OrderedDict[bytes, bytes] = OrderedDict()
+        # 只保护内存 LRU 与计数器，不在持有时访问磁盘
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections: List[sqlite3.Connection] = []
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_access INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_access ON embedding_cache (last_access)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache_size (id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL)"
+        )
+        # 旧版本没有记录占用，按已有数据统计一次
+        with self._transaction(conn):
+            conn.execute(
+                "INSERT OR IGNORE INTO embedding_cache_size (id, bytes) "
+                "SELECT 1, COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path.as_posix(), check_same_thread=False, isolation_level=None, timeout=RAG_SQLITE_BUSY_TIMEOUT
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        # 立即获取写锁，读取占用与更新占用之间不会被其它进程插入写入
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _disk_bytes(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT bytes FROM embedding_cache_size WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, bytes]:
+        found = {}
+        with self.lock:
+            for key in keys:
+                value = self.memory.get(key)
+                if value is not None:
+                    self.memory.move_to_end(key)
+                    found[key] = value
+            self.memory_hits += len(found)
+
+        pending = [key for key in set(keys) if key not in found]
+        if pending:
+            conn = self._conn()
+            rows = []
+            for start in range(0, len(pending), SQLITE_MAX_VARIABLES):
+                batch = pending[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", batch
+                ).fetchall())
+            if rows:
+                now = int(time.time())
+                conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE key = ?", [(now, key) for key, _ in rows])
+            with self.lock:
+                for key, value in rows:
+                    found[key] = value
+                    self._remember(key, value)
+                self.disk_hits += len(rows)
+
+        with self.lock:
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: Dict[bytes, bytes]):
+        if not items:
+            return
+        conn = self._conn()
+        now = int(time.time())
+        with self._transaction(conn):
+            added = 0
+            for key, value in items.items():
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO embedding_cache (key, vector, last_access) VALUES (?, ?, ?)",
+                    (key, value, now)
+                )
+                if cursor.rowcount:
+                    added += len(value)
+            if added:
+                conn.execute("UPDATE embedding_cache_size SET bytes = bytes + ? WHERE id = 1", (added,))
+            disk_bytes = self._disk_bytes(conn)
+        with self.lock:
+            for key, value in items.items():
+                self._remember(key, value)
+        if disk_bytes > self.max_bytes:
+            self._evict(conn)
+
+    def _remember(self, key: bytes, value: bytes):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """淘汰最久未访问的条目，直到低于容量上限的 90%；其它进程已完成淘汰时直接返回"""
+        target = int(self.max_bytes * 0.9)
+        evicted_keys = []
+        with self._transaction(conn):
+            disk_bytes = self._disk_bytes(conn)
+            while disk_bytes > target:
+                rows = conn.execute(
+                    "SELECT key, LENGTH(vector) FROM embedding_cache ORDER BY last_access LIMIT ?", (EVICT_BATCH_SIZE,)
+                ).fetchall()
+                if not rows:
+                    disk_bytes = 0
+                    break
+                evicted = []
+                for key, size in rows:
+                    if disk_bytes <= target:
+                        break
+                    evicted.append((key,))
+                    disk_bytes -= size
+                conn.executemany("DELETE FROM embedding_cache WHERE key = ?", evicted)
+                evicted_keys.extend(key for key, in evicted)
+            conn.execute("UPDATE embedding_cache_size SET bytes = ? WHERE id = 1", (disk_bytes,))
+        if not evicted_keys:
+            return
+        with self.lock:
+            for key in evicted_keys:
+                self.memory.pop(key, None)
+            self.evictions += len(evicted_keys)
+        logger.info(f"embedding cache evicted to {disk_bytes} bytes")
+
+    def stats(self) -> dict:
+        disk_bytes = self._disk_bytes(self._conn())
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self.memory),
+                "disk_bytes": disk_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
+
+_store: Optional[EmbeddingCacheStore] = None
+_store_lock = threading.Lock()
+
+def get_cache_store() -> EmbeddingCacheStore:
+    """进程内共享同一个缓存存储，使内存 LRU 和计数器在请求之间有效"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingCacheStore(
+                db_path=Path(RAG_SQLITE_DIR).resolve().joinpath(RAG_EMBEDDING_CACHE_DB),
+                max_bytes=RAG_EMBEDDING_CACHE_MAX_BYTES,
+                memory_items=RAG_EMBEDDING_CACHE_MEMORY_ITEMS,
+            )
+        return _store
+
+class CachedEmbeddings(Embeddings):
+    """带缓存的 Embeddings 包装器，缓存键为 hash(模型 + 维度 + 文本)"""
+
+    def __init__(self, embeddings: Embeddings, namespace: str, store: Optional[EmbeddingCacheStore] = None):
+        self.embeddings = embeddings
+        self.namespace = namespace.encode("utf-8")
+        self.store = store or get_cache_store()
+
+    def _key(self, text: str) -> bytes:
+        digest = hashlib.sha256(self.namespace)
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.digest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self.store.get_many(keys)
+
+        # 未命中的文本去重后一次性向量化
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = {
+                key: np.asarray(vector, dtype="<f4").tobytes()
+                for key, vector in zip(missing.keys(), vectors)
+            }
+            self.store.put_many(computed)
+            cached.update(computed)
+
+        return [np.frombuffer(cached[key], dtype="<f4").tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+    def close(self):
+        close = getattr(self.embeddings, "close", None)
+        if close:
+            close()
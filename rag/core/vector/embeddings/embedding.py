@@ -1,8 +1,22 @@
 import os
+from typing import Tuple
 from langchain_core.embeddings import Embeddings
-from core.vector.embeddings.qwen import QwenEmbeddings
+from core.vector.embeddings.qwen import QwenEmbeddings, DASH_SCOPE_EMBEDDINGS_MODEL, EMBEDDING_DIMENSION
+from core.vector.embeddings.cache import CachedEmbeddings
+
+RAG_EMBEDDING_CACHE_ENABLED = os.getenv("RAG_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
 
 def get_embeddings() -> Embeddings:
     model = os.getenv("EMBEDDINGS_MODEL")
     if model == "QWen":
-        return QwenEmbeddings()
\ No newline at end of file
+        embeddings = QwenEmbeddings()
+        if RAG_EMBEDDING_CACHE_ENABLED:
+            return CachedEmbeddings(embeddings, namespace=f"{DASH_SCOPE_EMBEDDINGS_MODEL}:{EMBEDDING_DIMENSION}")
+        return embeddings
+
+def get_embedding_signature() -> Tuple[str, int]:
+    """当前向量模型与维度，记录在文档索引状态中，变化后需要重建索引"""
+    model = os.getenv("EMBEDDINGS_MODEL")
+    if model == "QWen":
+        return f"{model}/{DASH_SCOPE_EMBEDDINGS_MODEL}", int(EMBEDDING_DIMENSION)
+    return model, int(EMBEDDING_DIMENSION)
@@ -0,0 +1,93 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """令牌桶限流器，rate 为每秒补充的令牌数，capacity 为允许的突发量"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """阻塞直到获取到足够令牌；rate <= 0 表示不限流"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+class EmbeddingExecutor:
+    """将大批量文本拆分为接口允许的批次，限流、并发执行并按输入顺序合并结果"""
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        batch_size: int = 10,
+        concurrency: int = 4,
+        rate_limit: float = 0,
+        max_retries: int = 5,
+        is_retryable: Callable[[Exception], bool] = lambda e: False,
+        retry_after: Callable[[Exception], Optional[float]] = lambda e: None,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        self.embed_batch = embed_batch
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.is_retryable = is_retryable
+        self.retry_after = retry_after
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate_limit)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="embedding")
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_with_retry(batches[0])
+
+        vectors = []
+        # map 按提交顺序返回结果，保证输出与输入顺序一致
+        for batch_vectors in self.pool.map(self._embed_with_retry, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def _embed_with_retry(self, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                vectors = self.embed_batch(batch)
+                if len(vectors) != len(batch):
+                    raise ValueError(f"embedding count mismatch: expect {len(batch)}, got {len(vectors)}")
+                return vectors
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                # 指数退避 + 全抖动，服务端给出 Retry-After 时以其为下限
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                delay = max(delay, self.retry_after(e) or 0)
+                attempt += 1
+                logger.warning(f"embedding batch failed ({str(e)}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
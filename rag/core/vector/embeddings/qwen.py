@@ -1,18 +1,43 @@
 import os
 import logging
-import pprint
+import openai
 from openai import OpenAI
-from typing import Any
+from typing import Any, Optional
 from langchain_core.embeddings import Embeddings
+from core.vector.embeddings.executor import EmbeddingExecutor
 
 logger = logging.getLogger(__name__)
 DASH_SCOPE_EMBEDDINGS_MODEL = os.getenv("DASH_SCOPE_EMBEDDINGS_MODEL")
 EMBEDDING_DIMENSION = os.getenv("EMBEDDING_DIMENSION")
 
+# 单次请求的文本条数上限（text-embedding-v3 为 10）
+DASH_SCOPE_EMBEDDINGS_BATCH_SIZE = int(os.getenv("DASH_SCOPE_EMBEDDINGS_BATCH_SIZE", 10))
+# 同时进行的请求数
+DASH_SCOPE_EMBEDDINGS_CONCURRENCY = int(os.getenv("DASH_SCOPE_EMBEDDINGS_CONCURRENCY", 4))
+# 每秒请求数上限，0 表示不限流
+DASH_SCOPE_EMBEDDINGS_RATE_LIMIT = float(os.getenv("DASH_SCOPE_EMBEDDINGS_RATE_LIMIT", 0))
+DASH_SCOPE_EMBEDDINGS_MAX_RETRIES = int(os.getenv("DASH_SCOPE_EMBEDDINGS_MAX_RETRIES", 5))
+
+def _is_retryable(e: Exception) -> bool:
+    """429、5xx 及网络错误可重试"""
+    if isinstance(e, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+def _retry_after(e: Exception) -> Optional[float]:
+    if isinstance(e, openai.APIStatusError):
+        try:
+            return float(e.response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
 class QwenEmbeddings(Embeddings):
     
     """Qwen embedding models.
-    To use, you should have the ``sentence_transformers`` python package installed.
+    To use, you should have the ``openai`` python package installed.
 
     Demo:
         https://help.aliyun.com/zh/model-studio/text-embedding-synchronous-api?spm=a2c4g.11186623.0.0.17f23e8fw8gd74
@@ -26,19 +51,26 @@ class QwenEmbeddings(Embeddings):
         self.client = OpenAI(
             api_key=os.getenv("DASH_SCOPE_API_KEY"),  # 如果您没有配置环境变量，请在此处用您的API Key进行替换
             base_url=os.getenv("DASH_SCOPE_BASE_URL"),  # 百炼服务的base_url
+            max_retries=0,  # 重试由 EmbeddingExecutor 统一处理
+        )
+        self.executor = EmbeddingExecutor(
+            embed_batch=self._embed,
+            batch_size=DASH_SCOPE_EMBEDDINGS_BATCH_SIZE,
+            concurrency=DASH_SCOPE_EMBEDDINGS_CONCURRENCY,
+            rate_limit=DASH_SCOPE_EMBEDDINGS_RATE_LIMIT,
+            max_retries=DASH_SCOPE_EMBEDDINGS_MAX_RETRIES,
+            is_retryable=_is_retryable,
+            retry_after=_retry_after,
         )
         
     def _embed(
         self, texts: list[str]
     ) -> list[list[float]]:
         """
-        Embed a text using the HuggingFace transformer model.
+        Embed one API-sized batch of texts with the DashScope Client.
 
         Args:
             texts: The list of texts to embed.
-            encode_kwargs: Keyword arguments to pass when calling the
-                `encode` method for the documents of the SentenceTransformer
-                 encode method.
 
         Returns:
             List of embeddings, one for each text.
@@ -46,13 +78,10 @@ class QwenEmbeddings(Embeddings):
         completion = self.client.embeddings.create(
             model=DASH_SCOPE_EMBEDDINGS_MODEL,
             input=texts,
-            dimensions=EMBEDDING_DIMENSION,
+            dimensions=int(EMBEDDING_DIMENSION),
             encoding_format="float"
         )
-        vectors = []
-        for val in completion.data:
-            vectors.append(val.embedding)
-        return vectors
+        return [val.embedding for val in sorted(completion.data, key=lambda val: val.index)]
         
     def embed_documents(self, texts: list[str]) -> list[list[float]]:
         """Compute doc embeddings using a Qwen DashScope Client.
@@ -63,7 +92,7 @@ class QwenEmbeddings(Embeddings):
         Returns:
             List of embeddings, one for each text.
         """
-        self._embed(texts)
+        return self.executor.embed(texts)
             
     def embed_query(self, text: str) -> list[float]:
         """Compute query embeddings using a Qwen DashScope Client.
@@ -74,4 +103,9 @@ class QwenEmbeddings(Embeddings):
         Returns:
             Embeddings for the text.
         """
-        return self._embed([text])[0]
\ No newline at end of file
+        return self.executor.embed([text])[0]
+
+    def close(self):
+        """释放线程池与连接池"""
+        self.executor.shutdown()
+        self.client.close()
@@ -1,61 +1,105 @@
+import os
 import importlib
 import pkgutil
 import logging
+import threading
+from importlib.metadata import entry_points
 from pathlib import Path
-from typing import Dict
+from types import MappingProxyType, ModuleType
+from typing import Dict, List, Mapping, Optional, Tuple, Type, Union
+import core.vector.plugins as plugins_package
 from core.vector.plugins.interface import FileAnalyzerPlugin
 from langchain_core.embeddings import Embeddings
 from dao.sqlite.document import Document
 
 logger = logging.getLogger(__name__)
 
+# 第三方插件通过该 entry point 分组注册，值为插件类或包含插件类的模块
+RAG_PLUGIN_ENTRY_POINT_GROUP = os.getenv("RAG_PLUGIN_ENTRY_POINT_GROUP", "rag.plugins")
+# 识别文件格式时读取的文件头字节数
+SNIFF_HEADER_BYTES = 8192
+
+_plugin_classes: Optional[Tuple[Type[FileAnalyzerPlugin], ...]] = None
+_discover_lock = threading.Lock()
+
+def _is_valid_plugin_class(obj) -> bool:
+    """验证是否为有效插件类"""
+    return (
+        isinstance(obj, type) and
+        issubclass(obj, FileAnalyzerPlugin) and
+        obj is not FileAnalyzerPlugin
+    )
+
+def _find_plugin_classes(module: ModuleType) -> list:
+    """查找模块中定义的插件类（不含从其它模块导入的）"""
+    return [
+        obj for obj in vars(module).values()
+        if _is_valid_plugin_class(obj) and obj.__module__ == module.__name__
+    ]
+
+def discover_plugin_classes() -> Tuple[Type[FileAnalyzerPlugin], ...]:
+    """扫描内置插件包与 entry points，进程内只执行一次；加载失败的插件记录日志后跳过"""
+    global _plugin_classes
+    with _discover_lock:
+        if _plugin_classes is not None:
+            return _plugin_classes
+
+        classes: List[Type[FileAnalyzerPlugin]] = []
+        for module_info in pkgutil.iter_modules(plugins_package.__path__):
+            if module_info.name == "interface":
+                continue
+            try:
+                module = importlib.import_module(f"{plugins_package.__name__}.{module_info.name}")
+            except Exception as e:
+                logger.error(f"导入插件模块 {module_info.name} 失败: {str(e)}")
+                continue
+            classes.extend(_find_plugin_classes(module))
+
+        for entry_point in entry_points(group=RAG_PLUGIN_ENTRY_POINT_GROUP):
+            try:
+                obj = entry_point.load()
+            except Exception as e:
+                logger.error(f"加载插件 {entry_point.name} 失败: {str(e)}")
+                continue
+            found = [obj] if _is_valid_plugin_class(obj) else _find_plugin_classes(obj) if isinstance(obj, ModuleType) else []
+            if not found:
+                logger.warning(f"entry point {entry_point.name} 未包含插件类")
+            classes.extend(cls for cls in found if cls not in classes)
+
+        _plugin_classes = tuple(classes)
+        logger.info(f"插件加载完成: {[cls.__name__ for cls in _plugin_classes]}")
+        return _plugin_classes
+
 class PluginManager:
-    
-    def __init__(self):
-        self.plugin_dict: Dict[str, FileAnalyzerPlugin] = {}
-        
-    def _get_plugin(self, plugin_name: str, embeddings: Embeddings) -> FileAnalyzerPlugin:
-        """安全加载插件并处理依赖"""
-        plugin_dir = Path(__file__).parent / "plugins"
-        
-        # 确保是有效Python包
-        if not (plugin_dir / "__init__.py").exists():
-            (plugin_dir / "__init__.py").touch(exist_ok=True)
-        
-        try:
-            module = importlib.import_module(
-                f"{__package__}.plugins.{plugin_name}"  # 动态获取当前包名
-            )
-            logger.debug(f"成功导入插件模块: {plugin_name}")
-        except Exception as e:
-            logger.error(f"导入插件模块 {plugin_name} 失败: {str(e)}")
-            raise ModuleNotFoundError(f"导入插件模块 {plugin_name} 失败")
-
-        # 扫描有效插件类
-        for cls in self._find_plugin_classes(module):
+    """创建时初始化全部插件实例，并建立 扩展名 -> 插件、文件头魔数 -> 插件 的只读索引
+
+    插件实例无可变状态，可在线程间共享；每个进程创建一次即可。
+    """
+
+    def __init__(self, embeddings: Optional[Embeddings] = None):
+        plugins: List[FileAnalyzerPlugin] = []
+        by_extension: Dict[str, FileAnalyzerPlugin] = {}
+        by_magic: Dict[bytes, Tuple[FileAnalyzerPlugin, ...]] = {}
+        for cls in discover_plugin_classes():
             try:
-                if issubclass(cls, FileAnalyzerPlugin):
-                    self.plugin_dict[plugin_name] = cls(embeddings)
-                    break
+                plugin = cls(embeddings)
             except Exception as e:
                 logger.error(f"初始化插件 {cls.__name__} 失败: {str(e)}")
-                raise Exception(f"初始化插件 {cls.__name__} 失败")
-        
-        return self.plugin_dict[plugin_name]
-
-    def _find_plugin_classes(self, module) -> list:
-        """查找模块中有效的插件类"""
-        return [
-            obj for _, obj in vars(module).items()
-            if self._is_valid_plugin_class(obj)
-        ]
-
-    def _is_valid_plugin_class(self, obj) -> bool:
-        """验证是否为有效插件类"""
-        return (
-            isinstance(obj, type) and
-            issubclass(obj, FileAnalyzerPlugin) and
-            obj is not FileAnalyzerPlugin
+                continue
+            plugins.append(plugin)
+            for fmt in self._validate_formats(plugin):
+                if fmt in by_extension:
+                    logger.warning(f"格式 {fmt} 已由 {type(by_extension[fmt]).__name__} 处理，忽略 {cls.__name__}")
+                    continue
+                by_extension[fmt] = plugin
+            for magic in plugin.magic_numbers:
+                by_magic[magic] = by_magic.get(magic, ()) + (plugin,)
+
+        self.plugins = tuple(plugins)
+        self.by_extension: Mapping[str, FileAnalyzerPlugin] = MappingProxyType(by_extension)
+        # 较长的魔数更具体，优先匹配
+        self.by_magic: Mapping[bytes, Tuple[FileAnalyzerPlugin, ...]] = MappingProxyType(
+            dict(sorted(by_magic.items(), key=lambda item: -len(item[0])))
         )
 
     def _validate_formats(self, plugin: FileAnalyzerPlugin) -> list:
@@ -65,13 +109,56 @@ class PluginManager:
             logger.warning(f"插件 {type(plugin).__name__} 未声明支持格式")
         return [fmt.lower() for fmt in formats]
 
-    def get_plugin(self, doc: Document, embeddings: Embeddings) -> FileAnalyzerPlugin:
-        file_format = Path(doc.doc_name).suffix.replace(".", "")
-        if self.plugin_dict.get(file_format):
-            return self.plugin_dict[file_format]
-        return self._get_plugin(file_format, embeddings)
-    
+    def get_plugin(self, doc: Document) -> FileAnalyzerPlugin:
+        """按文件内容识别插件，文件不存在时按扩展名"""
+        full_path = doc.full_path()
+        file_format = full_path.suffix.replace(".", "")
+        if full_path.exists():
+            return self.get_plugin_for_file(full_path, file_format)
+        return self.get_plugin_by_format(file_format)
+
+    def get_plugin_by_format(self, file_format: str) -> FileAnalyzerPlugin:
+        plugin = self.by_extension.get(file_format.lower())
+        if plugin is None:
+            raise ValueError(f"unsupported document format: {file_format}")
+        return plugin
+
+    def get_plugin_for_file(self, file_path: Union[str, Path], file_format: Optional[str] = None) -> FileAnalyzerPlugin:
+        if file_format is None:
+            file_format = Path(file_path).suffix.replace(".", "")
+        with open(file_path, "rb") as f:
+            header = f.read(SNIFF_HEADER_BYTES)
+        return self.get_plugin_for_header(header, file_format)
+
+    def get_plugin_for_header(self, header: bytes, file_format: str = "") -> FileAnalyzerPlugin:
+        """按文件头识别插件：魔数匹配 -> 扩展名对应插件 -> 其它插件的 detect_format -> 扩展名兜底"""
+        ext_plugin = self.by_extension.get(file_format.lower())
+        for magic, candidates in self.by_magic.items():
+            if not header.startswith(magic):
+                continue
+            # 多个格式共用魔数（如 zip 容器）时优先扩展名对应的插件
+            if ext_plugin in candidates and ext_plugin.detect_format(header):
+                return ext_plugin
+            for plugin in candidates:
+                if plugin.detect_format(header):
+                    return self._sniffed(plugin, file_format)
+
+        if ext_plugin is not None and ext_plugin.detect_format(header):
+            return ext_plugin
+        for plugin in self.plugins:
+            if plugin is not ext_plugin and plugin.detect_format(header):
+                return self._sniffed(plugin, file_format)
+
+        if ext_plugin is not None:
+            logger.warning(f"文件内容与扩展名 {file_format} 不符，按扩展名处理")
+            return ext_plugin
+        raise ValueError(f"unsupported document format: {file_format}")
+
+    def _sniffed(self, plugin: FileAnalyzerPlugin, file_format: str) -> FileAnalyzerPlugin:
+        logger.info(f"按文件内容识别为 {type(plugin).__name__}，扩展名: {file_format}")
+        return plugin
+
     @property
     def supported_formats(self) -> list:
         """获取所有支持格式"""
-        return list(self.plugin_dict.keys())
\ No newline at end of file
+        return list(self.by_extension.keys())
@@ -1,10 +1,22 @@
+import os
+from itertools import islice
 from abc import ABC, abstractmethod
-from typing import List, Union
+from typing import Iterable, Iterator, List, Optional, Tuple
 from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
+from core.vector.chunker import TextChunker
+
+RAG_EMBEDDING_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", 10))
 
 class FileAnalyzerPlugin(ABC):
-    def __init__(self, embeddings: Embeddings):
+    # 文本提取逻辑变化时递增，使用旧版本建立的索引会被视为过期
+    version: str = "1"
+    # 文件头魔数，用于按内容识别格式，命中后再由 detect_format 确认
+    magic_numbers: Tuple[bytes, ...] = ()
+
+    def __init__(self, embeddings: Embeddings, chunker: Optional[TextChunker] = None):
         self.embeddings = embeddings
+        self.chunker = chunker or TextChunker()
         
     @abstractmethod
     def supported_formats(cls) -> List[str]:
@@ -17,7 +29,38 @@ class FileAnalyzerPlugin(ABC):
         pass
 
     @abstractmethod
-    def document_to_vector(self, file_path: str) -> tuple[str, list[float]]:
-        """文件处理主逻辑"""
+    def extract_text(self, file_path: str) -> str:
+        """提取文件全文"""
         pass
 
+    def iter_text(self, file_path: str) -> Iterator[str]:
+        """逐段提取文本（如逐页），各段拼接后为全文；默认一次返回全文"""
+        yield self.extract_text(file_path)
+
+    def page_count(self, file_path: str) -> Optional[int]:
+        """可按页拆分提取的格式返回页数，默认 None 表示只能整体提取"""
+        return None
+
+    def extract_page_range(self, file_path: str, start: int, end: int) -> List[str]:
+        """提取第 [start, end) 页的文本，每页一段；默认逐段遍历 iter_text，插件可覆盖为按页随机读取"""
+        return list(islice(self.iter_text(file_path), start, end))
+
+    def version_tag(self) -> str:
+        """插件类名与版本，记录在文档索引状态中"""
+        return f"{type(self).__name__}:{self.version}"
+
+    def stream_to_vector(self, texts: Iterable[str]) -> tuple[List[Document], List[List[float]]]:
+        """边提取边分块，分块凑满一批即向量化，不等待全文提取完成"""
+        chunks: List[Document] = []
+        vectors = []
+        batch: List[Document] = []
+        for chunk in self.chunker.split_stream(texts):
+            batch.append(chunk)
+            if len(batch) >= RAG_EMBEDDING_BATCH_SIZE:
+                vectors.extend(self.embeddings.embed_documents([item.page_content for item in batch]))
+                chunks.extend(batch)
+                batch = []
+        if batch:
+            vectors.extend(self.embeddings.embed_documents([item.page_content for item in batch]))
+            chunks.extend(batch)
+        return chunks, vectors
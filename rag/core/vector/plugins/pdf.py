@@ -1,35 +1,40 @@
 import logging
-import pprint
-from typing import List, Union
+from typing import Iterable, Iterator, List, Optional
 from core.vector.plugins.interface import FileAnalyzerPlugin
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PDFMinerLoader
-from langchain_core.embeddings import Embeddings
-from langchain_core.documents import Document
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+from pdfminer.pdfpage import PDFPage
 
 logger = logging.getLogger(__name__)
 
 class PDFAnalyzer(FileAnalyzerPlugin):
-    def __init__(self, embeddings: Embeddings):
-        self.embeddings = embeddings
-        
+    magic_numbers = (b"%PDF-",)
+
     def supported_formats(cls) -> List[str]:
         return ["pdf"]
 
     def detect_format(cls, file_header: bytes) -> bool:
         return file_header.startswith(b"%PDF-")
 
-    def document_to_vector(self, file_path: str) -> tuple[str, list[float]]:
-        loader = PDFMinerLoader(
-            file_path=file_path,
-            mode="single",
-        )
-        doc = loader.load()
-        if not doc or not doc[0].page_content:
-            return None, []
-            
-        # return doc_contents, self.embeddings.embed_documents(doc_contents)
-        # return doc[0].page_content, self.embeddings.embed_query(doc[0].page_content)
-        vectors = self.embeddings.embed_query(doc[0].page_content)
-        return doc[0].page_content, vectors
-    
\ No newline at end of file
+    def _iter_pages(self, file_path: str, page_numbers: Optional[Iterable[int]] = None, maxpages: int = 0) -> Iterator[str]:
+        """逐页解析版面并返回文本，同一时间只保留一页的版面对象"""
+        for page in extract_pages(file_path, page_numbers=page_numbers, maxpages=maxpages):
+            yield "".join(element.get_text() for element in page if isinstance(element, LTTextContainer)) + "\f"
+
+    def extract_text(self, file_path: str) -> str:
+        return "".join(self._iter_pages(file_path))
+
+    def iter_text(self, file_path: str) -> Iterator[str]:
+        return self._iter_pages(file_path)
+
+    def page_count(self, file_path: str) -> Optional[int]:
+        # 只读取页面树，不解析页面内容
+        with open(file_path, "rb") as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+
+    def extract_page_range(self, file_path: str, start: int, end: int) -> List[str]:
+        # pdfminer 把空的页码集合当作不过滤，会解析整个文档
+        if start >= end:
+            return []
+        # 读到最后一页后停止遍历页面树
+        return list(self._iter_pages(file_path, set(range(start, end)), maxpages=end))
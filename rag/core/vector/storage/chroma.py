@@ -0,0 +1,114 @@
+import os
+import shutil
+import logging
+from pathlib import Path
+from typing import List, Optional, Sequence
+import chromadb
+from chromadb.api.types import GetResult, QueryResult
+from core.vector.storage.interface import VectorStorageBackend
+from dao.sqlite.document import get_docs
+
+RAG_VECTOR_DIR = os.getenv("RAG_VECTOR_DIR")
+RAG_CHROMA_DB = os.getenv("RAG_CHROMA_DB")
+RAR_CHROMA_DB_COLLECTION_NAME = os.getenv("RAR_CHROMA_DB_COLLECTION_NAME")
+# 旧版本使用 chromadb.PersistentClient() 的默认目录（相对于工作目录），新目录为空时从这里复制已有数据
+RAG_CHROMA_LEGACY_DIR = os.getenv("RAG_CHROMA_LEGACY_DIR", "./chroma")
+# Chroma 持久化目录中的元数据文件，用于判断目录是否已有数据
+CHROMA_SQLITE_FILE = "chroma.sqlite3"
+# 已为旧分块补齐 date 元数据的标记文件，位于 Chroma 持久化目录
+DATE_BACKFILL_MARKER = "date_backfill.done"
+# 补齐 date 元数据时每页读取的分块数
+DATE_BACKFILL_PAGE_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+def migrate_legacy_dir(chroma_db_path: Path):
+    """将旧版本默认目录中的数据复制到 RAG_VECTOR_DIR/RAG_CHROMA_DB，旧目录保留不动，确认无误后可手动删除"""
+    if not RAG_CHROMA_LEGACY_DIR or chroma_db_path.joinpath(CHROMA_SQLITE_FILE).exists():
+        return
+    legacy_path = Path(RAG_CHROMA_LEGACY_DIR).resolve()
+    if legacy_path == chroma_db_path or not legacy_path.joinpath(CHROMA_SQLITE_FILE).exists():
+        return
+    logger.warning(f"migrate legacy chroma data: {legacy_path} -> {chroma_db_path}")
+    tmp_path = chroma_db_path.with_name(f".{chroma_db_path.name}.migrating")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.copytree(legacy_path, tmp_path)
+    # 新目录可能已被创建但没有数据
+    shutil.rmtree(chroma_db_path, ignore_errors=True)
+    os.replace(tmp_path, chroma_db_path)
+
+class ChromaBackend(VectorStorageBackend):
+    def __init__(self):
+        chroma_db_path = Path(RAG_VECTOR_DIR).resolve().joinpath(RAG_CHROMA_DB)
+        migrate_legacy_dir(chroma_db_path)
+        self.client = chromadb.PersistentClient(path=chroma_db_path.as_posix())
+        self.collection = self.client.get_or_create_collection(name=RAR_CHROMA_DB_COLLECTION_NAME)
+        self.max_batch_size = self.client.get_max_batch_size()
+        self.backfill_dates(chroma_db_path.joinpath(DATE_BACKFILL_MARKER))
+
+    def backfill_dates(self, marker: Path):
+        """按日期过滤依赖分块的 date 元数据，为之前写入的分块按文档创建日期补齐，只执行一次"""
+        if marker.exists():
+            return
+        updated = 0
+        offset = 0
+        while True:
+            page = self.collection.get(offset=offset, limit=DATE_BACKFILL_PAGE_SIZE, include=["metadatas"])
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            missing = [
+                (chunk_id, (metadata or {}).get("doc_hash", chunk_id))
+                for chunk_id, metadata in zip(page["ids"], page["metadatas"])
+                if not (metadata or {}).get("date")
+            ]
+            if not missing:
+                continue
+            dates = {
+                doc.doc_hash: doc.create_time.strftime("%Y-%m-%d")
+                for doc in get_docs(doc_hashes=list({doc_hash for _, doc_hash in missing}))
+            }
+            # 元数据按字段合并，只写入 date；文档已删除的分块跳过
+            found = [(chunk_id, dates[doc_hash]) for chunk_id, doc_hash in missing if doc_hash in dates]
+            if found:
+                self.collection.update(
+                    ids=[chunk_id for chunk_id, _ in found],
+                    metadatas=[{"date": date} for _, date in found],
+                )
+                updated += len(found)
+        marker.touch()
+        if updated:
+            logger.info(f"backfill chunk date metadata: {updated}")
+
+    def upsert(
+        self,
+        ids: List[str],
+        metadatas: List[dict],
+        documents: List[str],
+        embeddings: Sequence[Sequence[float]],
+        uris: List[Optional[str]]
+    ):
+        self.collection.upsert(ids=ids, metadatas=metadatas, documents=documents, embeddings=embeddings, uris=uris)
+
+    def delete_documents(self, doc_hashes: List[str]):
+        # 旧版本整篇文档以 doc_hash 为 id 存为一条记录
+        self.collection.delete(ids=doc_hashes)
+        self.collection.delete(where={"doc_hash": {"$in": doc_hashes}})
+
+    def get(self, doc_hashes: List[str], include: List[str]) -> GetResult:
+        return self.collection.get(where={"doc_hash": {"$in": doc_hashes}}, include=include)
+
+    def page(self, offset: int, limit: int, include: List[str]) -> GetResult:
+        return self.collection.get(offset=offset, limit=limit, include=include)
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int,
+        include: List[str],
+        where: Optional[dict] = None
+    ) -> QueryResult:
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, include=include, where=where)
+
+    def count(self) -> int:
+        return self.collection.count()
@@ -1,72 +1,110 @@
 import os
 import logging
 import pprint
-from pathlib import Path
-from typing import List
-from langchain_chroma import Chroma
+from typing import List, Optional
 from langchain_core.embeddings import Embeddings
-import chromadb
-from chromadb.api.types import QueryResult
+from langchain_core.documents.base import Document as LangchainDocument
+from chromadb.api.types import GetResult, QueryResult
+from core.vector.storage.interface import VectorStorageBackend
 from dao.sqlite.document import Document as DaoDocument
 
+# 向量存储后端：Chroma 或 NumPy（进程内内存映射）
 RAG_VECTOR_STORAGE_TYPE = os.getenv("RAG_VECTOR_STORAGE_TYPE")
-RAG_VECTOR_DIR = os.getenv("RAG_VECTOR_DIR")
-RAG_CHROMA_DB = os.getenv("RAG_CHROMA_DB")
-chroma_db_path = Path(RAG_VECTOR_DIR).resolve().joinpath(RAG_CHROMA_DB)
-
 RAR_CHROMA_DB_COLLECTION_NAME = os.getenv("RAR_CHROMA_DB_COLLECTION_NAME")
 RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN = int(os.getenv("RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN"))
+# 默认返回的字段，调用方可按需裁剪以减少读取与序列化开销
+DEFAULT_INCLUDE = ["metadatas", "uris", "embeddings", "documents"]
 
 logger = logging.getLogger(__name__)
 
+# 支持过滤的元数据字段
+FILTER_FIELDS = ("doc_hash", "doc_name", "date")
+
+def build_where(**filters: Optional[List[str]]) -> Optional[dict]:
+    """将 doc_hash/doc_name/date 的取值列表转换为 Chroma where 条件，多个条件取交集"""
+    conditions = []
+    for field, values in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"unsupported filter field: {field}")
+        if values:
+            conditions.append({field: {"$in": list(values)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def create_backend() -> VectorStorageBackend:
+    """按 RAG_VECTOR_STORAGE_TYPE 创建存储后端，按需导入避免加载未使用的依赖"""
+    if RAG_VECTOR_STORAGE_TYPE == "Chroma":
+        from core.vector.storage.chroma import ChromaBackend
+        return ChromaBackend()
+    if RAG_VECTOR_STORAGE_TYPE == "NumPy":
+        from core.vector.storage.numpy_mmap import NumpyBackend
+        return NumpyBackend()
+    raise ValueError(f"unsupported vector storage type: {RAG_VECTOR_STORAGE_TYPE}")
+
 class VectorDatabase:
-    def __init__(self, embeddings: Embeddings):
-        if RAG_VECTOR_STORAGE_TYPE == "Chroma":
-            persistent_client = chromadb.PersistentClient()
-            self.collection = persistent_client.get_or_create_collection(name=RAR_CHROMA_DB_COLLECTION_NAME)
-            self.database = Chroma(
-                collection_name=RAR_CHROMA_DB_COLLECTION_NAME,
-                embedding_function=embeddings,
-                persist_directory=chroma_db_path.as_posix(),  # Where to save data locally, remove if not necessary
-            )
-            self.embeddings = embeddings
+    def __init__(self, embeddings: Optional[Embeddings]):
+        self.backend = create_backend()
+        self.embeddings = embeddings
 
-    def save(self, doc: DaoDocument, vector: list[float], doc_content: str):
+    def save(self, doc: DaoDocument, chunks: List[LangchainDocument], vectors: List[List[float]]):
         try:
-            result = self.collection.get(doc.doc_hash)
-            if result and result.get("ids"):
-                # Update vectors to the collection
-                self.collection.update(
-                    ids=[doc.doc_hash],
-                    metadatas={
-                        "doc_name": doc.doc_name,
-                        "posix": doc.full_path().as_posix()
-                    },
-                    embeddings=[vector],
-                    documents=[doc_content],
-                    uris=[doc.full_path().as_uri()]
-                )
-                logger.info(f"update document: {doc}")
-            else:
-                # Add vectors to the collection
-                self.collection.add(
-                    ids=[doc.doc_hash],
+            # 先清理该文档的旧分块
+            self.backend.delete_documents([doc.doc_hash])
+            if not chunks:
+                logger.warning(f"document has no content: {doc}")
+                return
+
+            posix = doc.full_path().as_posix()
+            uri = doc.full_path().as_uri()
+            batch_size = self.backend.max_batch_size
+            for start in range(0, len(chunks), batch_size):
+                batch = chunks[start:start + batch_size]
+                self.backend.upsert(
+                    ids=[f"{doc.doc_hash}-{chunk.metadata['chunk_index']}" for chunk in batch],
                     metadatas=[{
+                        "doc_hash": doc.doc_hash,
                         "doc_name": doc.doc_name,
-                        "posix": doc.full_path().as_posix()
-                    }],
-                    embeddings=[vector],
-                    documents=[doc_content],
-                    uris=[doc.full_path().as_uri()]
+                        # 上传所在的日期目录，用于按日期过滤
+                        "date": doc.create_time.strftime("%Y-%m-%d"),
+                        "posix": posix,
+                        **chunk.metadata,
+                    } for chunk in batch],
+                    embeddings=vectors[start:start + batch_size],
+                    documents=[chunk.page_content for chunk in batch],
+                    uris=[uri] * len(batch)
                 )
-                logger.info(f"add document: {doc}")
+            logger.info(f"add document: {doc}, chunks: {len(chunks)}")
         except Exception as e:
             logger.error(f"save error: {str(e)}")
-        
-    def find_similar(self, text: str) -> QueryResult:
+            raise
+
+    def get(self, doc_hashes: List[str], include: Optional[List[str]] = None) -> GetResult:
+        return self.backend.get(doc_hashes, include or DEFAULT_INCLUDE)
+
+    def find_similar(
+        self,
+        text: str,
+        n_results: int = RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN,
+        include: Optional[List[str]] = None,
+        where: Optional[dict] = None
+    ) -> QueryResult:
         vectors = self.embeddings.embed_query(text=text)
-        return self.collection.query(
-            query_embeddings=vectors,
-            query_texts=text,
-            include=["metadatas", "uris", "embeddings", "documents"])
-        
\ No newline at end of file
+        return self.find_similar_batch([vectors], n_results, include, where)
+
+    def find_similar_batch(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN,
+        include: Optional[List[str]] = None,
+        where: Optional[dict] = None
+    ) -> QueryResult:
+        """多个查询向量一次检索，结果按输入顺序对齐"""
+        return self.backend.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=[*(include or DEFAULT_INCLUDE), "distances"],
+            where=where)
+
+    def close(self):
+        self.backend.close()
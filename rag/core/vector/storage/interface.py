@@ -0,0 +1,61 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+from chromadb.api.types import GetResult, QueryResult
+
+class VectorStorageBackend(ABC):
+    """向量存储后端，返回结构与 Chroma 的 GetResult/QueryResult 保持一致
+
+    include 可选 metadatas、documents、embeddings、uris（query 另有 distances），
+    未请求的字段在结果中为 None。
+    """
+
+    # 单次写入的最大记录数
+    max_batch_size: int = 1000
+
+    @abstractmethod
+    def upsert(
+        self,
+        ids: List[str],
+        metadatas: List[dict],
+        documents: List[str],
+        embeddings: Sequence[Sequence[float]],
+        uris: List[Optional[str]]
+    ):
+        """按 id 写入或覆盖记录，记录数不超过 max_batch_size"""
+        pass
+
+    @abstractmethod
+    def delete_documents(self, doc_hashes: List[str]):
+        """删除文档的全部分块"""
+        pass
+
+    @abstractmethod
+    def get(self, doc_hashes: List[str], include: List[str]) -> GetResult:
+        """获取文档的全部分块"""
+        pass
+
+    @abstractmethod
+    def page(self, offset: int, limit: int, include: List[str]) -> GetResult:
+        """按稳定顺序分页读取全部记录（快照导出使用）"""
+        pass
+
+    @abstractmethod
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int,
+        include: List[str],
+        where: Optional[dict] = None
+    ) -> QueryResult:
+        """批量查询，每个查询向量返回 n_results 条最相似记录
+
+        where 为 build_where 生成的条件，只在满足条件的记录中检索。
+        """
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    def close(self):
+        pass
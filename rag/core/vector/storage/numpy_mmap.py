@@ -0,0 +1,392 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from chromadb.api.types import GetResult, QueryResult
+from core.vector.storage.interface import VectorStorageBackend
+from core.vector.storage.quantization import Int8Quantizer
+from dao.sqlite.vector import (
+    VectorRecord, get_store_version, bump_store_version, load_valid_rows, load_row_changes, replace_records, delete_records,
+    get_records_by_rows, get_records_by_doc, page_records, count_records, find_rows,
+)
+
+RAG_VECTOR_DIR = os.getenv("RAG_VECTOR_DIR")
+EMBEDDING_DIMENSION = os.getenv("EMBEDDING_DIMENSION")
+# 向量文件名，位于 RAG_VECTOR_DIR 下
+RAG_NUMPY_VECTOR_FILE = os.getenv("RAG_NUMPY_VECTOR_FILE", "vectors.f32")
+# 检索时每次参与矩阵乘法的行数，控制临时内存占用
+RAG_NUMPY_SEARCH_BLOCK_ROWS = int(os.getenv("RAG_NUMPY_SEARCH_BLOCK_ROWS", 16384))
+# 量化方式：none 或 int8；int8 时首轮检索使用量化编码，再用原始向量对候选精确重排
+RAG_NUMPY_QUANTIZATION = os.getenv("RAG_NUMPY_QUANTIZATION", "none")
+# 精确重排的候选数为返回数的倍数
+RAG_NUMPY_RESCORE_FACTOR = int(os.getenv("RAG_NUMPY_RESCORE_FACTOR", 4))
+# 训练量化参数时最多抽样的行数
+RAG_NUMPY_QUANT_TRAIN_ROWS = int(os.getenv("RAG_NUMPY_QUANT_TRAIN_ROWS", 100000))
+# 向量行数达到该值后才训练量化参数，此前样本太少、量化区间不可靠，使用精确检索
+RAG_NUMPY_QUANT_MIN_ROWS = int(os.getenv("RAG_NUMPY_QUANT_MIN_ROWS", 10000))
+# 行数增长到上次训练时的该倍数后重新训练量化参数
+RAG_NUMPY_QUANT_RETRAIN_FACTOR = float(os.getenv("RAG_NUMPY_QUANT_RETRAIN_FACTOR", 2))
+
+logger = logging.getLogger(__name__)
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化为单位向量，零向量保持不变"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def select_top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """每个查询保留分数最高的 k 个并按分数降序排列"""
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        rows = np.take_along_axis(rows, top, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+class NumpyBackend(VectorStorageBackend):
+    """进程内向量存储
+
+    向量归一化后以 float32 小端行优先追加写入文件，检索时只读内存映射，多个进程共享页缓存；
+    id 与元数据保存在 SQLite 的 vector_record 表中，row_index 即向量所在行。
+    覆盖或删除只删除元数据，旧向量行保留在文件中但不再参与检索。
+    相似度为余弦相似度，distances 返回 1 - 余弦相似度。
+
+    开启 int8 量化时另存一份按维度量化的编码文件（约为原始向量的 1/4），首轮检索只读取编码，
+    候选再从原始向量文件中读取对应行精确重排，常驻页缓存的只有编码文件。
+    """
+
+    max_batch_size = 5000
+
+    def __init__(self):
+        self.dimension = int(EMBEDDING_DIMENSION)
+        self.row_bytes = self.dimension * 4
+        self.path = Path(RAG_VECTOR_DIR).resolve().joinpath(RAG_NUMPY_VECTOR_FILE)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch(exist_ok=True)
+        # 跨进程写锁，保证追加的行号不冲突
+        self.lock_path = self.path.with_name(f"{self.path.name}.lock")
+        self.codes_path = self.path.with_name(f"{self.path.name}.i8")
+        # 记录训练量化参数时的行数，用于判断是否需要重新训练
+        self.quant_meta_path = self.path.with_name(f"{self.path.name}.i8.json")
+        self.quantization = RAG_NUMPY_QUANTIZATION == "int8"
+        self._lock = threading.Lock()
+        self._matrix = np.empty((0, self.dimension), dtype="<f4")
+        self._mask = np.zeros(0, dtype=bool)
+        self._quantizer: Optional[Int8Quantizer] = None
+        self._codes = np.empty((0, self.dimension), dtype=np.int8)
+        self._version = None
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray, Optional[Int8Quantizer], np.ndarray]:
+        """返回 (向量矩阵, 有效行掩码, 量化参数, 量化编码)，元数据变化时重新加载
+
+        有效行优先按版本增量更新，只有首次加载或落后太多版本时才读取全部有效行。
+        """
+        with self._lock:
+            version = get_store_version()
+            if version == self._version:
+                return self._matrix, self._mask, self._quantizer, self._codes
+
+            changes = load_row_changes(self._version) if self._version is not None else None
+            if changes is None:
+                version, valid_rows = load_valid_rows()
+            else:
+                version, row_changes = changes
+            # 向量先于元数据落盘，在读取元数据之后取文件大小可保证有效行都在映射范围内
+            rows = os.path.getsize(self.path) // self.row_bytes
+            self._matrix = (
+                np.memmap(self.path, dtype="<f4", mode="r", shape=(rows, self.dimension))
+                if rows else np.empty((0, self.dimension), dtype="<f4")
+            )
+            if self.quantization:
+                # 编码文件可能被重建替换，随版本一起重新映射
+                self._quantizer, self._codes = Int8Quantizer.open(self.codes_path, self.dimension)
+                self._codes = self._codes[:rows]
+            if changes is None:
+                mask = np.zeros(rows, dtype=bool)
+                mask[np.asarray(valid_rows, dtype=np.int64)] = True
+            else:
+                # 已返回给检索方的掩码不能原地修改
+                mask = np.zeros(rows, dtype=bool)
+                kept = min(rows, len(self._mask))
+                mask[:kept] = self._mask[:kept]
+                for row_index, valid in row_changes:
+                    mask[row_index] = valid
+            self._mask = mask
+            self._version = version
+            return self._matrix, self._mask, self._quantizer, self._codes
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _trained_rows(self) -> int:
+        """上次训练量化参数时的行数，没有记录（如旧版本训练的编码）时为 0"""
+        try:
+            return int(json.loads(self.quant_meta_path.read_text())["trained_rows"])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _train_codes(self, matrix: np.ndarray, total_rows: int) -> int:
+        """抽样训练量化参数并重新编码全部向量，返回抽样行数"""
+        sample_rows = np.arange(total_rows)
+        if total_rows > RAG_NUMPY_QUANT_TRAIN_ROWS:
+            sample_rows = np.sort(np.random.default_rng().choice(total_rows, RAG_NUMPY_QUANT_TRAIN_ROWS, replace=False))
+        quantizer = Int8Quantizer.train(np.asarray(matrix[sample_rows]))
+        quantizer.write(self.codes_path, matrix)
+        self.quant_meta_path.write_text(json.dumps({"trained_rows": total_rows, "sample_rows": len(sample_rows)}))
+        logger.info(f"int8 quantization trained, rows: {total_rows}, sample: {len(sample_rows)}")
+        return len(sample_rows)
+
+    def _sync_codes(self, total_rows: int):
+        """补齐量化编码；行数不足 RAG_NUMPY_QUANT_MIN_ROWS 时不训练，
+        尚未训练或行数增长到上次训练的 RAG_NUMPY_QUANT_RETRAIN_FACTOR 倍时重新训练。调用方需持有写锁
+        """
+        if total_rows < RAG_NUMPY_QUANT_MIN_ROWS:
+            # 旧版本按首次写入的少量样本训练的编码不可靠，删除后继续精确检索
+            if self.codes_path.exists() and not self.quant_meta_path.exists():
+                self.codes_path.unlink()
+                logger.info("remove int8 codes trained on too few rows")
+            return
+        matrix = np.memmap(self.path, dtype="<f4", mode="r", shape=(total_rows, self.dimension))
+        quantizer, codes = Int8Quantizer.open(self.codes_path, self.dimension)
+        if quantizer is None or total_rows >= self._trained_rows() * RAG_NUMPY_QUANT_RETRAIN_FACTOR:
+            self._train_codes(matrix, total_rows)
+        elif codes.shape[0] < total_rows:
+            quantizer.append(self.codes_path, matrix[codes.shape[0]:total_rows], codes.shape[0])
+
+    def retrain_quantizer(self) -> Dict:
+        """按当前全部向量重新训练量化参数并重建编码，不受 RAG_NUMPY_QUANT_MIN_ROWS 限制"""
+        if not self.quantization:
+            raise ValueError("int8 quantization is disabled")
+        with self._write_lock():
+            total_rows = os.path.getsize(self.path) // self.row_bytes
+            if total_rows == 0:
+                raise ValueError("vector store is empty")
+            matrix = np.memmap(self.path, dtype="<f4", mode="r", shape=(total_rows, self.dimension))
+            sample_rows = self._train_codes(matrix, total_rows)
+            # 通知各进程重新映射编码文件
+            bump_store_version()
+        return {"trained_rows": total_rows, "sample_rows": sample_rows}
+
+    def upsert(
+        self,
+        ids: List[str],
+        metadatas: List[dict],
+        documents: List[str],
+        embeddings: Sequence[Sequence[float]],
+        uris: List[Optional[str]]
+    ):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(f"embedding dimension mismatch: expected {self.dimension}, got {vectors.shape}")
+        data = normalize(vectors).astype("<f4").tobytes()
+
+        with self._write_lock():
+            with open(self.path, "r+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                start = size // self.row_bytes
+                # 上次写入中断留下的不完整行直接覆盖
+                f.seek(start * self.row_bytes)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            if self.quantization:
+                self._sync_codes(start + len(vectors))
+            replace_records([
+                VectorRecord(
+                    row_index=start + i,
+                    chunk_id=chunk_id,
+                    doc_hash=metadata.get("doc_hash", chunk_id),
+                    meta=json.dumps(metadata, ensure_ascii=False),
+                    document=document,
+                    uri=uri,
+                )
+                for i, (chunk_id, metadata, document, uri) in enumerate(zip(ids, metadatas, documents, uris))
+            ])
+
+    def delete_documents(self, doc_hashes: List[str]):
+        delete_records(doc_hashes)
+
+    def _records_result(self, records: List[VectorRecord], include: List[str], matrix: np.ndarray) -> Dict:
+        rows = [record.row_index for record in records]
+        return {
+            "ids": [record.chunk_id for record in records],
+            "metadatas": [json.loads(record.meta) for record in records] if "metadatas" in include else None,
+            "documents": [record.document for record in records] if "documents" in include else None,
+            "uris": [record.uri for record in records] if "uris" in include else None,
+            "embeddings": np.asarray(matrix[rows]) if "embeddings" in include else None,
+            "include": include,
+        }
+
+    def get(self, doc_hashes: List[str], include: List[str]) -> GetResult:
+        records = get_records_by_doc(doc_hashes)
+        matrix = self._snapshot()[0]
+        return self._records_result(records, include, matrix)
+
+    def page(self, offset: int, limit: int, include: List[str]) -> GetResult:
+        records = page_records(offset, limit)
+        matrix = self._snapshot()[0]
+        return self._records_result(records, include, matrix)
+
+    def _blocked_top_k(self, score_block, start: int, end: int, mask: np.ndarray, k: int, queries: int) -> Tuple[np.ndarray, np.ndarray]:
+        """对 [start, end) 行分块打分，逐块与已有候选合并，只保留 k 个，临时内存与总行数无关"""
+        best_rows = np.empty((queries, 0), dtype=np.int64)
+        best_scores = np.empty((queries, 0), dtype=np.float32)
+        for block_start in range(start, end, RAG_NUMPY_SEARCH_BLOCK_ROWS):
+            block_end = min(block_start + RAG_NUMPY_SEARCH_BLOCK_ROWS, end)
+            scores = score_block(block_start, block_end)
+            scores[:, ~mask[block_start:block_end]] = -np.inf
+            rows = np.broadcast_to(np.arange(block_start, block_end), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+        return best_rows, best_scores
+
+    def search(
+        self,
+        queries: np.ndarray,
+        n_results: int,
+        exact: bool = False,
+        rescore: bool = True,
+        allowed_rows: Optional[List[int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (行号, 相似度)，形状均为 (查询数, k)
+
+        exact 为 True 或未开启量化时直接在原始向量上检索；rescore 为 False 时返回量化首轮的近似结果；
+        allowed_rows 不为 None 时只在这些行中检索。
+        """
+        matrix, mask, quantizer, codes = self._snapshot()
+        if allowed_rows is not None:
+            allowed = np.asarray(allowed_rows, dtype=np.int64)
+            filtered = np.zeros_like(mask)
+            filtered[allowed[allowed < len(mask)]] = True
+            mask = mask & filtered
+        queries = normalize(np.asarray(queries, dtype=np.float32))
+        valid = int(mask.sum())
+        k = min(n_results, valid)
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        def exact_block(start: int, end: int) -> np.ndarray:
+            return queries @ matrix[start:end].T
+
+        if exact or not self.quantization or quantizer is None:
+            return select_top_k(*self._blocked_top_k(exact_block, 0, matrix.shape[0], mask, k, len(queries)), k)
+
+        candidates = min(k * RAG_NUMPY_RESCORE_FACTOR, valid) if rescore else k
+        weights, bias = quantizer.query_terms(queries)
+        rows, scores = self._blocked_top_k(
+            lambda start, end: quantizer.score(codes[start:end], weights, bias),
+            0, codes.shape[0], mask, candidates, len(queries),
+        )
+        # 尚未编码的尾部（如其它进程刚写入）直接精确计算
+        if codes.shape[0] < matrix.shape[0]:
+            tail_rows, tail_scores = self._blocked_top_k(exact_block, codes.shape[0], matrix.shape[0], mask, candidates, len(queries))
+            rows = np.concatenate([rows, tail_rows], axis=1)
+            scores = np.concatenate([scores, tail_scores], axis=1)
+
+        if rescore:
+            invalid = np.isneginf(scores)
+            vectors = np.asarray(matrix[rows.ravel()]).reshape(rows.shape[0], rows.shape[1], self.dimension)
+            scores = np.einsum("qkd,qd->qk", vectors, queries)
+            scores[invalid] = -np.inf
+        return select_top_k(rows, scores, k)
+
+    def evaluate_recall(self, k: int = 10, samples: int = 100) -> Dict:
+        """以随机抽取的已存向量为查询，对比量化检索与精确检索的 recall@k 及耗时"""
+        if not self.quantization:
+            raise ValueError("int8 quantization is disabled")
+        matrix, mask, _, codes = self._snapshot()
+        valid_rows = np.flatnonzero(mask)
+        if not len(valid_rows):
+            raise ValueError("vector store is empty")
+        sample_rows = np.sort(np.random.default_rng().choice(valid_rows, min(samples, len(valid_rows)), replace=False))
+        queries = np.asarray(matrix[sample_rows])
+
+        results, latency = {}, {}
+        for name, options in (("exact", {"exact": True}), ("first_pass", {"rescore": False}), ("rescored", {})):
+            started = time.perf_counter()
+            results[name] = self.search(queries, k, **options)[0]
+            latency[name] = round((time.perf_counter() - started) * 1000 / len(queries), 3)
+
+        def recall(approx: np.ndarray) -> float:
+            hits = [len(set(a.tolist()) & set(e.tolist())) / max(len(e), 1) for a, e in zip(approx, results["exact"])]
+            return round(float(np.mean(hits)), 4)
+
+        return {
+            "k": k,
+            "samples": len(sample_rows),
+            "rows": int(matrix.shape[0]),
+            "quantized_rows": int(codes.shape[0]),
+            "trained_rows": self._trained_rows(),
+            "vector_bytes": int(matrix.shape[0] * self.row_bytes),
+            "code_bytes": int(codes.shape[0] * self.dimension),
+            "recall_first_pass": recall(results["first_pass"]),
+            "recall_rescored": recall(results["rescored"]),
+            "latency_ms_per_query": latency,
+        }
+
+    @staticmethod
+    def _parse_where(where: dict) -> Dict[str, List[str]]:
+        """解析 build_where 生成的条件，返回 {字段: 取值列表}"""
+        conditions = where.get("$and", [where])
+        filters = {}
+        for condition in conditions:
+            for field, operator in condition.items():
+                if field not in ("doc_hash", "doc_name", "date") or set(operator) != {"$in"}:
+                    raise ValueError(f"unsupported where condition: {condition}")
+                filters[field] = operator["$in"]
+        return filters
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int,
+        include: List[str],
+        where: Optional[dict] = None
+    ) -> QueryResult:
+        allowed_rows = None
+        if where:
+            filters = self._parse_where(where)
+            allowed_rows = find_rows(
+                doc_hashes=filters.get("doc_hash"),
+                doc_names=filters.get("doc_name"),
+                dates=filters.get("date"),
+            )
+        top_rows, top_scores = self.search(np.asarray(query_embeddings, dtype=np.float32), n_results, allowed_rows=allowed_rows)
+        records = {record.row_index: record for record in get_records_by_rows(np.unique(top_rows).tolist())}
+        matrix = self._snapshot()[0]
+
+        result = {key: [] for key in ("ids", "metadatas", "documents", "uris", "embeddings", "distances")}
+        for rows, scores in zip(top_rows, top_scores):
+            # 检索之后被删除的记录跳过
+            hits = [(records[row], score) for row, score in zip(rows.tolist(), scores.tolist()) if row in records]
+            part = self._records_result([record for record, _ in hits], include, matrix)
+            for key in ("ids", "metadatas", "documents", "uris", "embeddings"):
+                result[key].append(part[key])
+            result["distances"].append([1 - score for _, score in hits])
+        for key in ("metadatas", "documents", "uris", "embeddings", "distances"):
+            if key not in include:
+                result[key] = None
+        result["include"] = include
+        return result
+
+    def count(self) -> int:
+        return count_records()
@@ -0,0 +1,79 @@
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+
+# 每次编码的行数，控制转换时的临时内存
+ENCODE_BLOCK_ROWS = 16384
+
+class Int8Quantizer:
+    """按维度的 int8 标量量化：x ≈ offset + scale * (code + 128)
+
+    编码文件布局：offset(float32 × 维度)、scale(float32 × 维度)，之后是行优先的 int8 编码，
+    参数与编码在同一文件中，重建时整体替换即可保证一致。
+    """
+
+    def __init__(self, offset: np.ndarray, scale: np.ndarray):
+        self.offset = np.asarray(offset, dtype="<f4")
+        self.scale = np.asarray(scale, dtype="<f4")
+        self.dimension = len(self.offset)
+
+    @classmethod
+    def train(cls, sample: np.ndarray) -> "Int8Quantizer":
+        """以样本每个维度的最小、最大值确定量化区间，超出区间的值编码时截断"""
+        low = sample.min(axis=0)
+        high = sample.max(axis=0)
+        scale = (high - low) / 255
+        scale[scale == 0] = 1e-8
+        return cls(low, scale)
+
+    @property
+    def header_bytes(self) -> int:
+        return self.dimension * 4 * 2
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.offset) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def query_terms(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """将 q·x 展开为 (q * scale)·code + q·(offset + 128 * scale)，返回 (权重, 偏置)"""
+        return (queries * self.scale).astype(np.float32), queries @ (self.offset + 128 * self.scale)
+
+    def score(self, codes: np.ndarray, weights: np.ndarray, bias: np.ndarray) -> np.ndarray:
+        """近似内积，返回 (查询数, 行数)"""
+        return weights @ codes.astype(np.float32).T + bias[:, None]
+
+    def write(self, path: Path, matrix: np.ndarray):
+        """写入参数与全部编码，先写临时文件再原子替换"""
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(self.offset.tobytes())
+            f.write(self.scale.tobytes())
+            for start in range(0, matrix.shape[0], ENCODE_BLOCK_ROWS):
+                f.write(self.encode(matrix[start:start + ENCODE_BLOCK_ROWS]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def append(self, path: Path, vectors: np.ndarray, start_row: int):
+        """从 start_row 行开始写入编码，覆盖上次中断留下的不完整数据"""
+        with open(path, "r+b") as f:
+            f.seek(self.header_bytes + start_row * self.dimension)
+            for start in range(0, vectors.shape[0], ENCODE_BLOCK_ROWS):
+                f.write(self.encode(vectors[start:start + ENCODE_BLOCK_ROWS]).tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def open(cls, path: Path, dimension: int) -> Tuple[Optional["Int8Quantizer"], np.ndarray]:
+        """读取编码文件，返回 (量化参数, 编码内存映射)；文件不存在时返回 (None, 空矩阵)"""
+        empty = np.empty((0, dimension), dtype=np.int8)
+        if not path.exists():
+            return None, empty
+        header = np.fromfile(path, dtype="<f4", count=dimension * 2)
+        quantizer = cls(header[:dimension], header[dimension:])
+        rows = (os.path.getsize(path) - quantizer.header_bytes) // dimension
+        if rows <= 0:
+            return quantizer, empty
+        return quantizer, np.memmap(path, dtype=np.int8, mode="r", offset=quantizer.header_bytes, shape=(rows, dimension))
@@ -0,0 +1,158 @@
+import os
+import re
+import logging
+from typing import Dict, Iterable, List
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import SQLModel, Field, Session, delete, select, func, col
+from dao.sqlite.database import engine
+
+logger = logging.getLogger(__name__)
+
+# FTS5 分词器，trigram 同时支持中文子串与标识符（错误码、配置项）匹配
+RAG_FTS_TOKENIZER = os.getenv("RAG_FTS_TOKENIZER", "trigram")
+# trigram 分词器无法匹配少于 3 个字符的词
+FTS_MIN_TERM_LENGTH = 3 if RAG_FTS_TOKENIZER == "trigram" else 1
+SQLITE_INSERT_BATCH_SIZE = 500
+# upsert 每条语句的行数，需保证 行数 * 列数 不超过 SQLite 变量上限
+SQLITE_UPSERT_BATCH_SIZE = 150
+
+FTS_TABLE_NAME = "document_chunk_fts"
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE_NAME} USING fts5(
+        content, content='document_chunk', content_rowid='id', tokenize='{RAG_FTS_TOKENIZER}'
+    )""",
+    # 外部内容表需要触发器保持全文索引与分块表同步
+    f"""CREATE TRIGGER IF NOT EXISTS document_chunk_ai AFTER INSERT ON document_chunk BEGIN
+        INSERT INTO {FTS_TABLE_NAME}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_chunk_ad AFTER DELETE ON document_chunk BEGIN
+        INSERT INTO {FTS_TABLE_NAME}({FTS_TABLE_NAME}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS document_chunk_au AFTER UPDATE ON document_chunk BEGIN
+        INSERT INTO {FTS_TABLE_NAME}({FTS_TABLE_NAME}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE_NAME}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+_TERM_PATTERN = re.compile(r"\S+")
+# 中日韩文字没有空格分词，连续的中日韩字符与其它字符分开处理
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_RUN_PATTERN = re.compile(f"[{_CJK_CHARS}]+|[^{_CJK_CHARS}]+")
+_CJK_CHAR_PATTERN = re.compile(f"[{_CJK_CHARS}]")
+
+# 文档分块原文，作为全文索引的外部内容表
+class DocumentChunk(SQLModel, table=True):
+    __tablename__ = "document_chunk"
+
+    id: int | None = Field(default=None, primary_key=True)
+    chunk_id: str = Field(max_length=128, unique=True)
+    doc_hash: str = Field(max_length=128, index=True)
+    doc_name: str = Field(max_length=512)
+    chunk_index: int = Field(default=0)
+    content: str
+
+# 分块内容的版本：每次写入分块递增全局版本，并记录各文档最后一次变化时的版本。
+# 回答缓存据此判断引用的文档是否被其它进程（快照导入、批量导入命令）重新写入
+class CorpusState(SQLModel, table=True):
+    __tablename__ = "corpus_state"
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
+
+class DocumentChunkVersion(SQLModel, table=True):
+    __tablename__ = "document_chunk_version"
+
+    doc_hash: str = Field(max_length=128, primary_key=True)
+    version: int = Field(default=0)
+
+def _bump_corpus_version(session: Session, doc_hashes: Iterable[str]):
+    version = session.exec(
+        sqlite_insert(CorpusState)
+        .values(id=1, version=1)
+        .on_conflict_do_update(index_elements=["id"], set_={"version": CorpusState.version + 1})
+        .returning(CorpusState.version)
+    ).scalar_one()
+    values = [{"doc_hash": doc_hash, "version": version} for doc_hash in set(doc_hashes)]
+    for start in range(0, len(values), SQLITE_UPSERT_BATCH_SIZE):
+        statement = sqlite_insert(DocumentChunkVersion).values(values[start:start + SQLITE_UPSERT_BATCH_SIZE])
+        session.exec(statement.on_conflict_do_update(index_elements=["doc_hash"], set_={"version": version}))
+
+def get_corpus_version() -> int:
+    with Session(engine) as session:
+        state = session.get(CorpusState, 1)
+        return state.version if state else 0
+
+def get_docs_version(doc_hashes: List[str]) -> int:
+    """文档分块最后一次变化时的版本，取最大值；文档数量来自检索结果，不超过变量上限"""
+    if not doc_hashes:
+        return 0
+    with Session(engine) as session:
+        result = session.exec(
+            select(func.max(DocumentChunkVersion.version)).where(col(DocumentChunkVersion.doc_hash).in_(doc_hashes))
+        ).first()
+        return result or 0
+
+def create_fts_tables():
+    """创建全文索引虚拟表及同步触发器"""
+    with engine.begin() as conn:
+        for ddl in FTS_DDL:
+            conn.exec_driver_sql(ddl)
+
+def _split_terms(query: str) -> List[str]:
+    """按空白切分；连续的中日韩字符（trigram 分词器下）再切分为重叠的三字组，
+    整句中文不再作为一个短语要求原文完全包含，由 BM25 按命中的三字组数量排序
+    """
+    terms = []
+    for word in _TERM_PATTERN.findall(query):
+        for run in _CJK_RUN_PATTERN.findall(word):
+            if RAG_FTS_TOKENIZER == "trigram" and _CJK_CHAR_PATTERN.match(run) and len(run) > 3:
+                terms.extend(run[start:start + 3] for start in range(len(run) - 2))
+            else:
+                terms.append(run)
+    return [term for term in dict.fromkeys(terms) if len(term) >= FTS_MIN_TERM_LENGTH]
+
+def build_match_query(query: str) -> str:
+    """将用户输入转换为 FTS5 MATCH 表达式，每个词按短语匹配，词之间为 OR"""
+    return " OR ".join('"{}"'.format(term.replace('"', '""')) for term in _split_terms(query))
+
+def replace_chunks(doc_hash: str, doc_name: str, chunks: List[Dict]) -> int:
+    """替换文档的全部分块，chunks 中每项包含 chunk_id、chunk_index、content"""
+    with Session(engine) as session:
+        session.exec(delete(DocumentChunk).where(DocumentChunk.doc_hash == doc_hash))
+        for start in range(0, len(chunks), SQLITE_INSERT_BATCH_SIZE):
+            session.add_all([
+                DocumentChunk(doc_hash=doc_hash, doc_name=doc_name, **chunk)
+                for chunk in chunks[start:start + SQLITE_INSERT_BATCH_SIZE]
+            ])
+            session.flush()
+        _bump_corpus_version(session, [doc_hash])
+        session.commit()
+        return len(chunks)
+
+def upsert_chunks(chunks: List[Dict]) -> int:
+    """按 chunk_id 批量写入或覆盖分块（快照导入使用），chunks 中每项包含 chunk_id、doc_hash、doc_name、chunk_index、content"""
+    with Session(engine) as session:
+        for start in range(0, len(chunks), SQLITE_UPSERT_BATCH_SIZE):
+            statement = sqlite_insert(DocumentChunk).values(chunks[start:start + SQLITE_UPSERT_BATCH_SIZE])
+            session.exec(statement.on_conflict_do_update(
+                index_elements=["chunk_id"],
+                set_={column: statement.excluded[column] for column in ("doc_hash", "doc_name", "chunk_index", "content")},
+            ))
+        _bump_corpus_version(session, [chunk["doc_hash"] for chunk in chunks])
+        session.commit()
+        return len(chunks)
+
+def search_chunks(query: str, limit: int) -> List[Dict]:
+    """BM25 全文检索，按相关度从高到低返回分块；score 越小越相关"""
+    match_query = build_match_query(query)
+    if not match_query:
+        return []
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            f"""SELECT c.chunk_id, c.doc_hash, c.doc_name, c.chunk_index, c.content, bm25({FTS_TABLE_NAME}) AS score
+            FROM {FTS_TABLE_NAME} JOIN document_chunk c ON c.id = {FTS_TABLE_NAME}.rowid
+            WHERE {FTS_TABLE_NAME} MATCH :query
+            ORDER BY score LIMIT :limit"""
+        ), {"query": match_query, "limit": limit}).mappings().all()
+        return [dict(row) for row in rows]
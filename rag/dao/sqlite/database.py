@@ -1,16 +1,110 @@
 import os
+import logging
 from pathlib import Path
-from sqlmodel import create_engine, SQLModel
+from typing import List, Tuple
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import create_engine, Field, SQLModel
+
+logger = logging.getLogger(__name__)
 
 # 配置数据库
 RAG_SQLITE_DIR = os.getenv("RAG_SQLITE_DIR")
 Path(RAG_SQLITE_DIR).mkdir(parents=True, exist_ok=True)
 SQLITE_METADATA_DB = os.getenv("SQLITE_METADATA_DB")
+# 是否打印 SQL 语句（仅调试时开启）
+RAG_SQLITE_ECHO = os.getenv("RAG_SQLITE_ECHO", "false").lower() == "true"
+# 内存映射读取的最大字节数
+RAG_SQLITE_MMAP_SIZE = int(os.getenv("RAG_SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# 等待写锁的超时时间（秒）
+RAG_SQLITE_BUSY_TIMEOUT = float(os.getenv("RAG_SQLITE_BUSY_TIMEOUT", 30))
+# 异步连接池大小（SQLite 同时只有一个写连接，读连接可并发）
+RAG_SQLITE_ASYNC_POOL_SIZE = int(os.getenv("RAG_SQLITE_ASYNC_POOL_SIZE", 8))
+RAG_SQLITE_ASYNC_MAX_OVERFLOW = int(os.getenv("RAG_SQLITE_ASYNC_MAX_OVERFLOW", 8))
 
 sqlite_url = f"sqlite:///{Path(RAG_SQLITE_DIR)/SQLITE_METADATA_DB}"
-engine = create_engine(sqlite_url, echo=True, connect_args={"check_same_thread": False})
+engine = create_engine(
+    sqlite_url,
+    echo=RAG_SQLITE_ECHO,
+    connect_args={"check_same_thread": False, "timeout": RAG_SQLITE_BUSY_TIMEOUT},
+)
+
+# FastAPI 请求处理使用的异步引擎
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{Path(RAG_SQLITE_DIR)/SQLITE_METADATA_DB}",
+    echo=RAG_SQLITE_ECHO,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=RAG_SQLITE_ASYNC_POOL_SIZE,
+    max_overflow=RAG_SQLITE_ASYNC_MAX_OVERFLOW,
+    connect_args={"timeout": RAG_SQLITE_BUSY_TIMEOUT},
+)
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """WAL 模式下读写互不阻塞，synchronous=NORMAL 在 WAL 下可保证一致性"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={RAG_SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+# 已存在的表新增列的迁移，按顺序各执行一次，schema_state 记录已执行到第几个；新增列须允许为空
+SCHEMA_MIGRATIONS: List[Tuple[str, Tuple[str, ...]]] = [
+    # 文档索引状态
+    ("document", (
+        "index_status", "parsed_at", "embedding_model", "embedding_dimension", "chunker_version", "plugin_version",
+    )),
+]
+
+class SchemaState(SQLModel, table=True):
+    __tablename__ = "schema_state"
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
 
 # 初始化数据库
 def create_db_and_tables():
-    """自动创建所有注册的模型表"""
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    """自动创建所有注册的模型表，并执行尚未执行的结构迁移"""
+    # 导入模型模块，确保表结构已注册到 metadata
+    import dao.sqlite.document
+    import dao.sqlite.job
+    import dao.sqlite.chunk
+    import dao.sqlite.vector
+    SQLModel.metadata.create_all(engine)
+    migrate_schema()
+    # create_all 不会为已存在的表补建新增的索引
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    dao.sqlite.chunk.create_fts_tables()
+
+def migrate_schema(bind: Engine = engine):
+    """create_all 不会为已存在的表补充新增的列，按 SCHEMA_MIGRATIONS 补齐
+
+    持有写锁读取 schema_state，多个进程同时启动时只有一个执行迁移；
+    新建的库中 create_all 已建好这些列，跳过已存在的列后只更新版本号。
+    """
+    with bind.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        row = conn.exec_driver_sql("SELECT version FROM schema_state WHERE id = 1").first()
+        version = row[0] if row else 0
+        if version >= len(SCHEMA_MIGRATIONS):
+            conn.rollback()
+            return
+        for table_name, column_names in SCHEMA_MIGRATIONS[version:]:
+            table = SQLModel.metadata.tables[table_name]
+            existing = {column[1] for column in conn.exec_driver_sql(f'PRAGMA table_info("{table_name}")')}
+            for name in column_names:
+                if name in existing:
+                    continue
+                column_type = table.columns[name].type.compile(dialect=bind.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table_name}" ADD COLUMN "{name}" {column_type}')
+                logger.info(f"数据库补充列: {table_name}.{name}")
+        conn.exec_driver_sql(
+            "INSERT INTO schema_state (id, version) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET version = excluded.version",
+            (len(SCHEMA_MIGRATIONS),),
+        )
+        conn.commit()
@@ -1,59 +1,210 @@
 import logging
 from datetime import datetime
-from sqlmodel import SQLModel, Field, Session, select, func, col
-from typing import Sequence, Union, List
-from dao.sqlite.database import engine
+from sqlalchemy import Index, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import SQLModel, Field, Session, select, func, col, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Dict, Sequence, Union, List, Optional, Tuple
+from dao.sqlite.database import engine, async_engine
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# 单条语句中绑定变量数量上限（SQLite 旧版本默认 999）
+SQLITE_MAX_VARIABLES = 900
+
+# 索引状态，为空表示尚未建立索引
+INDEX_INDEXED = "indexed"
+INDEX_FAILED = "failed"
+
 # 数据模型
 class Document(SQLModel, table=True):
+    __table_args__ = (
+        # 游标分页
+        Index("ix_document_create_time_id", "create_time", "id"),
+        # 文件名前缀过滤
+        Index("ix_document_doc_name", "doc_name"),
+        # 按索引状态扫描过期文档
+        Index("ix_document_index_status_id", "index_status", "id"),
+    )
+
     id: int | None = Field(primary_key=True)
     dest_dir: str = Field(max_length=1024)
     doc_name: str = Field(max_length=255)
     doc_hash: str = Field(unique=True, max_length=64)
     doc_size: int = Field(default=0)
     create_time: datetime = Field(default_factory=datetime.now)
+    # 索引状态：建立索引时使用的向量模型、维度、分块与插件版本，任一变化即视为过期
+    index_status: str | None = Field(default=None, max_length=16)
+    parsed_at: datetime | None = Field(default=None)
+    embedding_model: str | None = Field(default=None, max_length=255)
+    embedding_dimension: int | None = Field(default=None)
+    chunker_version: str | None = Field(default=None, max_length=64)
+    plugin_version: str | None = Field(default=None, max_length=64)
     
     def full_path(self) -> Path:
         return Path(self.dest_dir).joinpath(self.doc_name)
 
-def count_doc() -> int:
+# 批量插入时每条语句的行数，行数 * 列数（不含自增 id）不超过变量上限，随模型新增列自动调整
+SQLITE_INSERT_BATCH_SIZE = SQLITE_MAX_VARIABLES // (len(Document.model_fields) - 1)
+
+# 查询语句构造，同步与异步接口共用
+def _name_prefix_clause(name_prefix: str):
+    # 使用范围查询代替 LIKE，可以命中 doc_name 索引
+    return col(Document.doc_name) >= name_prefix, col(Document.doc_name) < name_prefix + "\U0010ffff"
+
+def _count_doc_statement(name_prefix: Optional[str] = None):
+    statement = select(func.count(Document.id))
+    if name_prefix:
+        statement = statement.where(*_name_prefix_clause(name_prefix))
+    return statement
+
+def _get_docs_statements(
+    doc_ids: Union[int, List[int], None] = None,
+    doc_hashes: Union[str, List[str], None] = None
+) -> list:
+    """大列表按 SQLite 变量上限拆分为多条查询"""
+    if doc_ids:
+        column = Document.id
+        values = [doc_ids] if isinstance(doc_ids, int) else list(doc_ids)
+    elif doc_hashes:
+        column = Document.doc_hash
+        values = [doc_hashes] if isinstance(doc_hashes, str) else list(doc_hashes)
+    else:
+        return []
+    return [
+        select(Document).where(col(column).in_(values[start:start + SQLITE_MAX_VARIABLES]))
+        for start in range(0, len(values), SQLITE_MAX_VARIABLES)
+    ]
+
+def _list_doc_statement(
+    page_count: int,
+    cursor: Optional[Tuple[datetime, int]] = None,
+    name_prefix: Optional[str] = None
+):
+    statement = select(Document)
+    if cursor:
+        statement = statement.where(tuple_(Document.create_time, Document.id) < tuple_(*cursor))
+    if name_prefix:
+        statement = statement.where(*_name_prefix_clause(name_prefix))
+    return statement.order_by(col(Document.create_time).desc(), col(Document.id).desc()).limit(page_count)
+
+def _save_docs_statements(docs: List[Document]) -> list:
+    return [
+        sqlite_insert(Document)
+        .values([doc.model_dump(exclude={"id"}) for doc in docs[start:start + SQLITE_INSERT_BATCH_SIZE]])
+        .on_conflict_do_nothing(index_elements=["doc_hash"])
+        .returning(Document.id, Document.doc_hash)
+        for start in range(0, len(docs), SQLITE_INSERT_BATCH_SIZE)
+    ]
+
+def _collect_new_docs(docs: List[Document], inserted: Dict[str, int]) -> List[Document]:
+    new_docs = []
+    for doc in docs:
+        # 同一批次中重复的 doc_hash 只计一次
+        doc_id = inserted.pop(doc.doc_hash, None)
+        if doc_id is not None:
+            doc.id = doc_id
+            new_docs.append(doc)
+    logger.info(f"批量保存文档成功: {len(new_docs)}/{len(docs)}")
+    return new_docs
+
+# 同步接口（命令行、后台任务线程使用）
+def count_doc(name_prefix: Optional[str] = None) -> int:
     with Session(engine) as session:
-        # 同步执行查询
-        result = session.exec(
-            select(func.count(Document.id))
-        ).first()
+        result = session.exec(_count_doc_statement(name_prefix)).first()
         return result if result is not None else 0
     
 def get_docs(
     doc_ids: Union[int, List[int], None] = None,
     doc_hashes: Union[str, List[str], None] = None
 ) -> List[Document]:
-    """支持单值或列表查询，返回匹配的文档列表"""
+    """支持单值或列表查询，返回匹配的文档列表；大列表按 SQLite 变量上限分批查询后合并"""
+    result = []
     with Session(engine) as session:
-        
-        if doc_ids:
-            ids = [doc_ids] if isinstance(doc_ids, int) else doc_ids
-            where_clause = col(Document.id).in_(ids)
-        elif doc_hashes:
-            hashes = [doc_hashes] if isinstance(doc_hashes, str) else doc_hashes
-            where_clause = col(Document.doc_hash).in_(hashes)
-            
-        result = session.exec(
-            select(Document).where(where_clause)
-        ).all()
-        
-        return result
+        for statement in _get_docs_statements(doc_ids, doc_hashes):
+            result.extend(session.exec(statement).all())
+    return result
     
-def list_doc(page: int, page_count: int) -> Sequence[Document]:
+def list_doc(
+    page_count: int,
+    cursor: Optional[Tuple[datetime, int]] = None,
+    name_prefix: Optional[str] = None
+) -> Sequence[Document]:
+    """按 (create_time, id) 倒序的游标分页，cursor 为上一页最后一条记录的 (create_time, id)"""
+    with Session(engine) as session:
+        return session.exec(_list_doc_statement(page_count, cursor, name_prefix)).fetchall()
+
+def update_index_state(doc_id: int, status: str, state: Optional[Dict[str, object]] = None):
+    """记录文档的索引状态，state 为 embedding_model/embedding_dimension/chunker_version/plugin_version"""
+    values = {"index_status": status}
+    if status == INDEX_INDEXED:
+        values.update(parsed_at=datetime.now(), **(state or {}))
     with Session(engine) as session:
-        return session.exec(select(Document).offset((page - 1) * page_count).limit(page_count)).fetchall()
+        session.exec(update(Document).where(col(Document.id) == doc_id).values(**values))
+        session.commit()
 
-def save_doc(doc: Document):
+def list_indexed_states(after_id: int, limit: int) -> List[tuple]:
+    """按 id 分页读取已建立索引文档的索引状态，返回 (id, doc_name, embedding_model, embedding_dimension, chunker_version, plugin_version)"""
     with Session(engine) as session:
-        if not session.exec(select(Document).where(Document.doc_hash == doc.doc_hash)).first():
-            session.add(doc)
-            session.commit()
-            logger.info(f"文档保存成功: {doc.doc_name}")
+        return list(session.exec(
+            select(
+                Document.id, Document.doc_name, Document.embedding_model,
+                Document.embedding_dimension, Document.chunker_version, Document.plugin_version,
+            )
+            .where(Document.index_status == INDEX_INDEXED)
+            .where(col(Document.id) > after_id)
+            .order_by(col(Document.id))
+            .limit(limit)
+        ).all())
+
+def save_doc(doc: Document) -> bool:
+    """保存单个文档，doc_hash 已存在时跳过，返回是否新写入"""
+    return bool(save_docs([doc]))
+
+def save_docs(docs: List[Document]) -> List[Document]:
+    """单事务批量写入，doc_hash 冲突的文档跳过，返回新写入的文档（已回填 id）"""
+    if not docs:
+        return []
+
+    inserted = {}
+    with Session(engine) as session:
+        for statement in _save_docs_statements(docs):
+            inserted.update({row.doc_hash: row.id for row in session.exec(statement).all()})
+        session.commit()
+    return _collect_new_docs(docs, inserted)
+
+# 异步接口（FastAPI 请求处理使用，不阻塞事件循环）
+async def count_doc_async(name_prefix: Optional[str] = None) -> int:
+    async with AsyncSession(async_engine) as session:
+        result = (await session.exec(_count_doc_statement(name_prefix))).first()
+        return result if result is not None else 0
+
+async def get_docs_async(
+    doc_ids: Union[int, List[int], None] = None,
+    doc_hashes: Union[str, List[str], None] = None
+) -> List[Document]:
+    result = []
+    async with AsyncSession(async_engine) as session:
+        for statement in _get_docs_statements(doc_ids, doc_hashes):
+            result.extend((await session.exec(statement)).all())
+    return result
+
+async def list_doc_async(
+    page_count: int,
+    cursor: Optional[Tuple[datetime, int]] = None,
+    name_prefix: Optional[str] = None
+) -> Sequence[Document]:
+    async with AsyncSession(async_engine) as session:
+        return (await session.exec(_list_doc_statement(page_count, cursor, name_prefix))).fetchall()
+
+async def save_docs_async(docs: List[Document]) -> List[Document]:
+    if not docs:
+        return []
+
+    inserted = {}
+    async with AsyncSession(async_engine) as session:
+        for statement in _save_docs_statements(docs):
+            inserted.update({row.doc_hash: row.id for row in (await session.exec(statement)).all()})
+        await session.commit()
+    return _collect_new_docs(docs, inserted)
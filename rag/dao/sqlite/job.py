@@ -0,0 +1,222 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlmodel import SQLModel, Field, Session, select, func, col, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Iterable, List, Optional, Tuple
+from dao.sqlite.database import engine, async_engine
+from dao.sqlite.document import Document, SQLITE_MAX_VARIABLES, _save_docs_statements, _collect_new_docs
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# 解析任务
+class ParseJob(SQLModel, table=True):
+    __tablename__ = "parse_job"
+
+    id: int | None = Field(default=None, primary_key=True)
+    status: str = Field(default=JOB_PENDING, max_length=16)
+    total: int = Field(default=0)
+    succeeded: int = Field(default=0)
+    failed: int = Field(default=0)
+    create_time: datetime = Field(default_factory=datetime.now)
+    update_time: datetime = Field(default_factory=datetime.now)
+
+# 解析任务中的单个文档
+class ParseJobItem(SQLModel, table=True):
+    __tablename__ = "parse_job_item"
+
+    id: int | None = Field(default=None, primary_key=True)
+    job_id: int = Field(foreign_key="parse_job.id", index=True)
+    doc_id: int = Field(foreign_key="document.id")
+    status: str = Field(default=JOB_PENDING, max_length=16, index=True)
+    attempts: int = Field(default=0)
+    error: str | None = Field(default=None, max_length=2048)
+    update_time: datetime = Field(default_factory=datetime.now)
+
+def _add_job(session: Session, doc_ids: List[int]) -> ParseJob:
+    job = ParseJob(total=len(doc_ids))
+    session.add(job)
+    session.flush()
+    session.add_all([ParseJobItem(job_id=job.id, doc_id=doc_id) for doc_id in doc_ids])
+    return job
+
+def create_job(doc_ids: List[int]) -> ParseJob:
+    with Session(engine) as session:
+        job = _add_job(session, doc_ids)
+        session.commit()
+        session.refresh(job)
+        logger.info(f"解析任务创建成功: {job.id}, 文档数: {len(doc_ids)}")
+        return job
+
+def save_docs_with_job(docs: List[Document], requeue_ids: Iterable[int] = ()) -> Tuple[List[Document], Optional[ParseJob]]:
+    """单事务写入文档，并为新写入的文档及 requeue_ids 创建解析任务，进程中断时不会留下没有任务的文档"""
+    inserted = {}
+    with Session(engine) as session:
+        for statement in _save_docs_statements(docs):
+            inserted.update({row.doc_hash: row.id for row in session.exec(statement).all()})
+        new_docs = _collect_new_docs(docs, inserted)
+        doc_ids = [doc.id for doc in new_docs] + list(requeue_ids)
+        job = _add_job(session, doc_ids) if doc_ids else None
+        session.commit()
+        if job is not None:
+            session.refresh(job)
+            logger.info(f"解析任务创建成功: {job.id}, 文档数: {len(doc_ids)}")
+        return new_docs, job
+
+def filter_unqueued_docs(doc_ids: List[int]) -> List[int]:
+    """返回没有待处理或处理中任务的文档 id"""
+    queued = set()
+    with Session(engine) as session:
+        for start in range(0, len(doc_ids), SQLITE_MAX_VARIABLES):
+            queued.update(session.exec(
+                select(ParseJobItem.doc_id)
+                .where(col(ParseJobItem.doc_id).in_(doc_ids[start:start + SQLITE_MAX_VARIABLES]))
+                .where(col(ParseJobItem.status).in_([JOB_PENDING, JOB_RUNNING]))
+            ).all())
+    return [doc_id for doc_id in doc_ids if doc_id not in queued]
+
+def get_job(job_id: int) -> Tuple[Optional[ParseJob], List[ParseJobItem]]:
+    with Session(engine) as session:
+        job = session.get(ParseJob, job_id)
+        if not job:
+            return None, []
+        items = session.exec(
+            select(ParseJobItem).where(ParseJobItem.job_id == job_id).order_by(ParseJobItem.id)
+        ).all()
+        return job, list(items)
+
+def _claimable_clause(lease_seconds: float):
+    """待处理，或处理中但超过租期未续租（处理进程已退出）"""
+    expired = datetime.now() - timedelta(seconds=lease_seconds)
+    return or_(
+        ParseJobItem.status == JOB_PENDING,
+        and_(ParseJobItem.status == JOB_RUNNING, col(ParseJobItem.update_time) < expired),
+    )
+
+def claim_item(lease_seconds: float) -> Optional[ParseJobItem]:
+    """原子地领取一个待处理的文档，多个线程/进程并发领取不会重复
+
+    处理中的文档由领取方定期调用 renew_items 续租，超过 lease_seconds 未续租的可被其它进程重新领取。
+    """
+    with Session(engine) as session:
+        claimable = _claimable_clause(lease_seconds)
+        next_id = (
+            select(ParseJobItem.id)
+            .where(claimable)
+            .order_by(ParseJobItem.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        row = session.exec(
+            update(ParseJobItem)
+            .where(col(ParseJobItem.id) == next_id)
+            .where(claimable)
+            .values(status=JOB_RUNNING, attempts=ParseJobItem.attempts + 1, update_time=datetime.now())
+            .returning(ParseJobItem.id, ParseJobItem.job_id, ParseJobItem.doc_id, ParseJobItem.attempts)
+        ).first()
+        if not row:
+            session.commit()
+            return None
+        session.exec(
+            update(ParseJob)
+            .where(ParseJob.id == row.job_id, ParseJob.status == JOB_PENDING)
+            .values(status=JOB_RUNNING, update_time=datetime.now())
+        )
+        session.commit()
+        return ParseJobItem(id=row.id, job_id=row.job_id, doc_id=row.doc_id, attempts=row.attempts, status=JOB_RUNNING)
+
+def finish_item(item: ParseJobItem, error: Optional[str] = None, max_attempts: int = 1):
+    """记录文档处理结果；失败且未超过最大尝试次数时重新排队"""
+    if error is None:
+        status = JOB_SUCCEEDED
+    elif item.attempts < max_attempts:
+        status = JOB_PENDING
+    else:
+        status = JOB_FAILED
+    with Session(engine) as session:
+        session.exec(
+            update(ParseJobItem)
+            .where(ParseJobItem.id == item.id)
+            .values(status=status, error=error[:2048] if error else None, update_time=datetime.now())
+        )
+        _refresh_job(session, item.job_id)
+        session.commit()
+
+def retry_job(job_id: int) -> int:
+    """将任务中失败的文档重新排队，返回重新排队的数量"""
+    with Session(engine) as session:
+        result = session.exec(_retry_job_statement(job_id))
+        _refresh_job(session, job_id)
+        session.commit()
+        return result.rowcount
+
+def renew_items(item_ids: List[int]):
+    """续租处理中的文档"""
+    if not item_ids:
+        return
+    with Session(engine) as session:
+        session.exec(
+            update(ParseJobItem)
+            .where(col(ParseJobItem.id).in_(item_ids), ParseJobItem.status == JOB_RUNNING)
+            .values(update_time=datetime.now())
+        )
+        session.commit()
+
+def _refresh_job(session: Session, job_id: int):
+    counts = dict(session.exec(
+        select(ParseJobItem.status, func.count(ParseJobItem.id))
+        .where(ParseJobItem.job_id == job_id)
+        .group_by(ParseJobItem.status)
+    ).all())
+    succeeded = counts.get(JOB_SUCCEEDED, 0)
+    failed = counts.get(JOB_FAILED, 0)
+    unfinished = counts.get(JOB_PENDING, 0) + counts.get(JOB_RUNNING, 0)
+    if unfinished:
+        status = JOB_RUNNING
+    else:
+        status = JOB_FAILED if failed else JOB_SUCCEEDED
+    session.exec(
+        update(ParseJob)
+        .where(ParseJob.id == job_id)
+        .values(succeeded=succeeded, failed=failed, status=status, update_time=datetime.now())
+    )
+
+def _retry_job_statement(job_id: int):
+    return (
+        update(ParseJobItem)
+        .where(ParseJobItem.job_id == job_id, ParseJobItem.status == JOB_FAILED)
+        .values(status=JOB_PENDING, attempts=0, error=None, update_time=datetime.now())
+    )
+
+# 异步接口（FastAPI 请求处理使用，不阻塞事件循环）
+async def create_job_async(doc_ids: List[int]) -> ParseJob:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        job = ParseJob(total=len(doc_ids))
+        session.add(job)
+        await session.flush()
+        session.add_all([ParseJobItem(job_id=job.id, doc_id=doc_id) for doc_id in doc_ids])
+        await session.commit()
+        logger.info(f"解析任务创建成功: {job.id}, 文档数: {len(doc_ids)}")
+        return job
+
+async def get_job_async(job_id: int) -> Tuple[Optional[ParseJob], List[ParseJobItem]]:
+    async with AsyncSession(async_engine) as session:
+        job = await session.get(ParseJob, job_id)
+        if not job:
+            return None, []
+        items = (await session.exec(
+            select(ParseJobItem).where(ParseJobItem.job_id == job_id).order_by(ParseJobItem.id)
+        )).all()
+        return job, list(items)
+
+async def retry_job_async(job_id: int) -> int:
+    async with AsyncSession(async_engine) as session:
+        result = await session.exec(_retry_job_statement(job_id))
+        await session.run_sync(lambda sync_session: _refresh_job(sync_session, job_id))
+        await session.commit()
+        return result.rowcount
@@ -0,0 +1,191 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import SQLModel, Field, Session, select, func, col, delete
+from typing import List, Optional, Tuple
+from dao.sqlite.database import engine
+from dao.sqlite.document import Document, SQLITE_MAX_VARIABLES
+
+# 有效行变更记录保留的版本数，落后更多版本的读取方重新加载全部有效行
+RAG_NUMPY_CHANGE_LOG_VERSIONS = int(os.getenv("RAG_NUMPY_CHANGE_LOG_VERSIONS", 1000))
+
+logger = logging.getLogger(__name__)
+
+# NumPy 向量存储的记录元数据，向量本身按 row_index 存放在内存映射文件中
+class VectorRecord(SQLModel, table=True):
+    __tablename__ = "vector_record"
+
+    row_index: int = Field(primary_key=True)
+    chunk_id: str = Field(max_length=128, unique=True)
+    doc_hash: str = Field(max_length=128, index=True)
+    meta: str = Field(default="{}")
+    document: str | None = None
+    uri: str | None = Field(default=None, max_length=2048)
+
+# 每次写入或删除递增 version，读取方据此判断是否需要重新加载有效行
+class VectorStoreState(SQLModel, table=True):
+    __tablename__ = "vector_store_state"
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
+
+# 有效行的增量变更，读取方按版本顺序应用，避免每次写入后重新加载全部有效行
+class VectorRowChange(SQLModel, table=True):
+    __tablename__ = "vector_row_change"
+
+    id: int | None = Field(default=None, primary_key=True)
+    version: int = Field(index=True)
+    row_index: int
+    valid: bool
+
+def _bump_version(session: Session) -> int:
+    return session.exec(
+        sqlite_insert(VectorStoreState)
+        .values(id=1, version=1)
+        .on_conflict_do_update(index_elements=["id"], set_={"version": VectorStoreState.version + 1})
+        .returning(VectorStoreState.version)
+    ).scalar_one()
+
+def _log_changes(session: Session, version: int, added: List[int], removed: List[int]):
+    """记录本版本的有效行变更，并清理超出保留范围的旧记录"""
+    changes = [{"version": version, "row_index": row, "valid": False} for row in removed]
+    changes.extend({"version": version, "row_index": row, "valid": True} for row in added)
+    if changes:
+        session.exec(sqlite_insert(VectorRowChange), params=changes)
+    session.exec(delete(VectorRowChange).where(col(VectorRowChange.version) <= version - RAG_NUMPY_CHANGE_LOG_VERSIONS))
+
+def get_store_version() -> int:
+    with Session(engine) as session:
+        state = session.get(VectorStoreState, 1)
+        return state.version if state else 0
+
+def bump_store_version():
+    """元数据未变但向量文件或编码文件被替换时，通知读取方重新加载"""
+    with Session(engine) as session:
+        _bump_version(session)
+        session.commit()
+
+def load_valid_rows() -> Tuple[int, List[int]]:
+    """在同一读事务中返回 (version, 全部有效行号)"""
+    with Session(engine) as session:
+        state = session.get(VectorStoreState, 1)
+        rows = session.exec(select(VectorRecord.row_index)).all()
+        return (state.version if state else 0), list(rows)
+
+def load_row_changes(since_version: int) -> Optional[Tuple[int, List[Tuple[int, bool]]]]:
+    """在同一读事务中返回 (version, since_version 之后按顺序的 (行号, 是否有效) 变更)；
+    变更记录已被清理时返回 None，调用方需重新加载全部有效行
+    """
+    with Session(engine) as session:
+        state = session.get(VectorStoreState, 1)
+        version = state.version if state else 0
+        if since_version > version or since_version < version - RAG_NUMPY_CHANGE_LOG_VERSIONS:
+            return None
+        rows = session.exec(
+            select(VectorRowChange.row_index, VectorRowChange.valid)
+            .where(col(VectorRowChange.version) > since_version)
+            .order_by(VectorRowChange.id)
+        ).all()
+        return version, [(row_index, valid) for row_index, valid in rows]
+
+def replace_records(records: List[VectorRecord]):
+    """按 chunk_id 覆盖记录，旧记录对应的向量行不再有效"""
+    with Session(engine) as session:
+        chunk_ids = [record.chunk_id for record in records]
+        removed = []
+        for start in range(0, len(chunk_ids), SQLITE_MAX_VARIABLES):
+            removed.extend(session.exec(
+                delete(VectorRecord)
+                .where(col(VectorRecord.chunk_id).in_(chunk_ids[start:start + SQLITE_MAX_VARIABLES]))
+                .returning(VectorRecord.row_index)
+            ).scalars())
+        session.add_all(records)
+        _log_changes(session, _bump_version(session), [record.row_index for record in records], removed)
+        session.commit()
+
+def delete_records(doc_hashes: List[str]) -> int:
+    removed = []
+    with Session(engine) as session:
+        for start in range(0, len(doc_hashes), SQLITE_MAX_VARIABLES):
+            removed.extend(session.exec(
+                delete(VectorRecord)
+                .where(col(VectorRecord.doc_hash).in_(doc_hashes[start:start + SQLITE_MAX_VARIABLES]))
+                .returning(VectorRecord.row_index)
+            ).scalars())
+        if removed:
+            _log_changes(session, _bump_version(session), [], removed)
+        session.commit()
+    return len(removed)
+
+def get_records_by_rows(rows: List[int]) -> List[VectorRecord]:
+    result = []
+    with Session(engine) as session:
+        for start in range(0, len(rows), SQLITE_MAX_VARIABLES):
+            result.extend(session.exec(
+                select(VectorRecord).where(col(VectorRecord.row_index).in_(rows[start:start + SQLITE_MAX_VARIABLES]))
+            ).all())
+    return result
+
+def get_records_by_doc(doc_hashes: List[str]) -> List[VectorRecord]:
+    result = []
+    with Session(engine) as session:
+        for start in range(0, len(doc_hashes), SQLITE_MAX_VARIABLES):
+            result.extend(session.exec(
+                select(VectorRecord)
+                .where(col(VectorRecord.doc_hash).in_(doc_hashes[start:start + SQLITE_MAX_VARIABLES]))
+                .order_by(VectorRecord.row_index)
+            ).all())
+    return result
+
+def _chunks(values: Optional[List[str]], size: int) -> List[Optional[List[str]]]:
+    if not values:
+        return [None]
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+def find_rows(
+    doc_hashes: Optional[List[str]] = None,
+    doc_names: Optional[List[str]] = None,
+    dates: Optional[List[str]] = None
+) -> List[int]:
+    """返回满足全部条件的有效行号；doc_name 与日期（YYYY-MM-DD）通过 document 表的索引过滤
+
+    doc_hash 与 doc_name 列表按 SQLite 变量上限分批查询，每行只属于一个文档，各批结果不重复。
+    每个日期占用两个变量（起止时间），每批都要带上，先从变量预算中扣除。
+    """
+    days = sorted({datetime.strptime(date, "%Y-%m-%d") for date in dates or []})
+    budget = SQLITE_MAX_VARIABLES - 2 * len(days)
+    if budget < 2:
+        raise ValueError(f"too many dates: {len(days)}")
+    # 两个列表同时分批，各占剩余变量的一半
+    size = budget // 2
+    rows = []
+    with Session(engine) as session:
+        for hash_chunk in _chunks(doc_hashes, size):
+            for name_chunk in _chunks(doc_names, size):
+                statement = select(VectorRecord.row_index)
+                if hash_chunk:
+                    statement = statement.where(col(VectorRecord.doc_hash).in_(hash_chunk))
+                if name_chunk or days:
+                    statement = statement.join(Document, col(Document.doc_hash) == col(VectorRecord.doc_hash))
+                    if name_chunk:
+                        statement = statement.where(col(Document.doc_name).in_(name_chunk))
+                    if days:
+                        statement = statement.where(or_(*(
+                            and_(col(Document.create_time) >= day, col(Document.create_time) < day + timedelta(days=1))
+                            for day in days
+                        )))
+                rows.extend(session.exec(statement).all())
+    return rows
+
+def page_records(offset: int, limit: int) -> List[VectorRecord]:
+    with Session(engine) as session:
+        return list(session.exec(
+            select(VectorRecord).order_by(VectorRecord.row_index).offset(offset).limit(limit)
+        ).all())
+
+def count_records() -> int:
+    with Session(engine) as session:
+        result = session.exec(select(func.count(VectorRecord.row_index))).first()
+        return result if result is not None else 0
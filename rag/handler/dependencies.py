@@ -0,0 +1,26 @@
+import httpx
+from fastapi import Request
+from core.vector.base import VectorAnalyzer
+from core.doc.worker import IngestWorkerPool
+from core.knowledge.session import SessionManager
+from core.knowledge.backend import LLMBackendPool
+
+def get_analyzer(request: Request) -> VectorAnalyzer:
+    """应用生命周期内共享的 VectorAnalyzer"""
+    return request.app.state.analyzer
+
+def get_llm_client(request: Request) -> httpx.AsyncClient:
+    """应用生命周期内共享的 llama.cpp 异步 HTTP 连接池"""
+    return request.app.state.llm_client
+
+def get_llm_pool(request: Request) -> LLMBackendPool:
+    """多个 llama.cpp 后端的负载均衡，共享 llm_client 连接池"""
+    return request.app.state.llm_pool
+
+def get_ingest_pool(request: Request) -> IngestWorkerPool:
+    """后台解析任务线程池"""
+    return request.app.state.ingest_pool
+
+def get_chat_sessions(request: Request) -> SessionManager:
+    """服务端会话与 llama.cpp slot 绑定"""
+    return request.app.state.chat_sessions
@@ -1,9 +1,13 @@
 import logging
-from fastapi import APIRouter, UploadFile, File, Query, Body
+from fastapi import APIRouter, UploadFile, File, Query, Body, Depends
 from pydantic import BaseModel, Field
-from typing import List, Union
-from core.doc.document import process_document, list_document, parse_documents
+from typing import List, Union, Optional
+from core.doc.document import process_documents, list_document, submit_parse_job, submit_reindex_stale, get_parse_job
+from core.vector.base import VectorAnalyzer
+from core.doc.worker import IngestWorkerPool
+from dao.sqlite.job import retry_job_async
 from handler.response import format_json_response
+from handler.dependencies import get_ingest_pool, get_analyzer
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +19,7 @@ async def upload_document(files: List[UploadFile] = File(..., description="支
     results = []
     success_count = 0
     fail_docs = []
-    for f in files:
-        ret = await process_document(f)
+    for f, ret in zip(files, await process_documents(files)):
         if ret:
             results.append({
                 "doc_name": f.filename,
@@ -37,45 +40,82 @@ async def upload_document(files: List[UploadFile] = File(..., description="支
 
 @router.get("/list", summary="列出所有文档")
 async def document_list(
-    page: int = Query(
-        default=1, 
-        ge=1, 
-        description="页码(从1开始)"
+    cursor: Optional[str] = Query(
+        default=None,
+        description="分页游标(上一页返回的 next_cursor，首页不传)"
     ),
     page_count: int = Query(
         default=10,
         ge=1,
         le=100,
         description="每页数量(1-100)"
+    ),
+    name_prefix: Optional[str] = Query(
+        default=None,
+        description="文件名前缀"
     )
 ):
-    """获取文档列表"""
+    """获取文档列表，按上传时间倒序"""
     try:
-        total, doc_list = list_document(page, page_count)
-        return format_json_response(msg={
-            "documents": doc_list,
-            "total": total,
-            "page": page,
-            "page_count": page_count,
-        })
+        total, doc_list, next_cursor = await list_document(page_count, cursor, name_prefix)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
     except Exception as e:
         logger.error(f"list documents error: {str(e)}")
-    finally:
-        return format_json_response(code=1, msg={
-            "documents": doc_list,
-            "total": total,
-            "page": page,
-            "page_count": page_count,
-        })
+        return format_json_response(code=1, msg="list documents error")
+
+    return format_json_response(msg={
+        "documents": doc_list,
+        "total": total,
+        "page_count": page_count,
+        "next_cursor": next_cursor,
+    })
 
 @router.post("/parse", summary="分析文档")
 async def document_parse(
-    doc_id: Union[int, List[int], None],
-    doc_hash: Union[str, List[str], None]
+    doc_id: Union[int, List[int], None] = Body(default=None, description="文档ID"),
+    doc_hash: Union[str, List[str], None] = Body(default=None, description="文档哈希"),
+    force: bool = Body(default=False, description="已按当前配置建立索引的文档也重新解析"),
+    analyzer: VectorAnalyzer = Depends(get_analyzer),
+    ingest_pool: IngestWorkerPool = Depends(get_ingest_pool)
 ):
-    """分析文档"""
-    ret = parse_documents(doc_id, doc_hash)
-    if ret:
-        return format_json_response(code=1, msg="parse document error")
+    """创建后台解析任务，通过 /document/jobs/{job_id} 查询进度；索引已是最新的文档跳过"""
+    job, skipped = await submit_parse_job(analyzer, doc_id, doc_hash, force)
+    if not job:
+        if skipped:
+            return format_json_response(msg={"job_id": None, "total": 0, "skipped": skipped})
+        return format_json_response(code=1, msg="document not found")
     
-    return format_json_response(msg="parse document success")
+    ingest_pool.notify()
+    return format_json_response(msg={"job_id": job.id, "total": job.total, "skipped": skipped})
+
+@router.post("/reindex-stale", summary="重建过期索引")
+async def document_reindex_stale(
+    dry_run: bool = Query(default=False, description="只统计过期文档数，不创建任务"),
+    analyzer: VectorAnalyzer = Depends(get_analyzer),
+    ingest_pool: IngestWorkerPool = Depends(get_ingest_pool)
+):
+    """只重建向量模型、维度、分块参数或插件版本与当前配置不一致的文档"""
+    result = await submit_reindex_stale(analyzer, dry_run)
+    if result["job_id"] is not None:
+        ingest_pool.notify()
+    return format_json_response(msg=result)
+
+@router.get("/jobs/{job_id}", summary="查询解析任务")
+async def document_job(job_id: int):
+    """查询解析任务进度及每个文档的错误信息"""
+    job = await get_parse_job(job_id)
+    if not job:
+        return format_json_response(code=1, msg="job not found")
+
+    return format_json_response(msg=job)
+
+@router.post("/jobs/{job_id}/retry", summary="重试解析任务")
+async def document_job_retry(
+    job_id: int,
+    ingest_pool: IngestWorkerPool = Depends(get_ingest_pool)
+):
+    """重新排队任务中失败的文档"""
+    requeued = await retry_job_async(job_id)
+    ingest_pool.notify()
+    return format_json_response(msg={"job_id": job_id, "requeued": requeued})
@@ -1,83 +1,364 @@
+import os
+import time
+import asyncio
 import logging
 import pprint
-import numpy as np
-from typing import Union, List, Optional
-from fastapi import APIRouter, Query
+from contextlib import aclosing, nullcontext
+from datetime import datetime
+from typing import Dict, Union, List, Optional, Set, Tuple
+from fastapi import APIRouter, Query, Depends, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
-from core.vector.base import VectorAnalyzer
-from core.knowledge.knowledge import retrieval_and_ask
-from handler.response import format_json_response
+from core.vector.base import VectorAnalyzer, SEARCH_MODES
+from core.vector.storage.db import RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN, build_where
+from core.knowledge.knowledge import retrieval_and_ask, stream_retrieval_and_ask
+from core.knowledge.answer_cache import RAG_ANSWER_CACHE_ENABLED, get_answer_cache
+from core.knowledge.session import SessionManager
+from core.knowledge.backend import LLMBackendPool
+from core.vector.embeddings.embedding import RAG_EMBEDDING_CACHE_ENABLED
+from core.vector.embeddings.cache import get_cache_store
+from handler.response import format_json_response, format_sse_event
+from handler.dependencies import get_analyzer, get_llm_pool, get_chat_sessions
+from utils.vectors import VECTOR_ENCODINGS, BINARY_MEDIA_TYPE, encode_vector, pack_vectors
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/knowledge", tags=["本地知识查询"])
 
+# 批量检索单次请求的最大查询数
+RAG_SIMILARITY_BATCH_MAX_QUERIES = int(os.getenv("RAG_SIMILARITY_BATCH_MAX_QUERIES", 2000))
+
+# 可选返回字段，doc_hash 与 chunk_id 始终返回
+RESPONSE_FIELDS = ("metadata", "doc_content", "vector", "uri", "score", "distance")
+# 返回字段对应的向量库 include 字段
+FIELD_INCLUDES = {"metadata": "metadatas", "doc_content": "documents", "vector": "embeddings", "uri": "uris"}
+
+def parse_fields(fields: Optional[str], vector_encoding: str) -> Tuple[Set[str], List[str]]:
+    """解析 fields 参数，返回 (返回字段, 向量库 include)，非法参数抛出 ValueError"""
+    if vector_encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"unsupported vector encoding: {vector_encoding}")
+    selected = set(RESPONSE_FIELDS)
+    if fields:
+        selected = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = selected - set(RESPONSE_FIELDS)
+        if unknown:
+            raise ValueError(f"unsupported fields: {','.join(sorted(unknown))}")
+    if vector_encoding == "binary":
+        selected = {"vector"}
+    # doc_hash 取自 metadata，始终读取
+    include = ["metadatas", *(FIELD_INCLUDES[field] for field in selected if field in FIELD_INCLUDES and field != "metadata")]
+    return selected, include
+
+def format_chunks(ids: List[str], columns: Dict[str, Optional[list]], fields: Set[str], vector_encoding: str) -> Response:
+    """按返回字段与向量编码组装分块结果"""
+    if vector_encoding == "binary":
+        embeddings = columns.get("embeddings")
+        return Response(
+            content=pack_vectors(ids, embeddings if embeddings is not None else [None] * len(ids)),
+            media_type=BINARY_MEDIA_TYPE,
+        )
+    return format_json_response(code=0, msg=build_chunk_details(ids, columns, fields, vector_encoding))
+
+def build_chunk_details(ids: List[str], columns: Dict[str, Optional[list]], fields: Set[str], vector_encoding: str) -> List[dict]:
+    """未读取的列为 None"""
+    size = len(ids)
+    metadatas, documents, embeddings, uris, scores, distances = (
+        columns.get(key) if columns.get(key) is not None else [None] * size
+        for key in ("metadatas", "documents", "embeddings", "uris", "scores", "distances")
+    )
+    details = []
+    for chunk_id, doc_md, doc_content, embedding, uri, score, distance in zip(
+        ids, metadatas, documents, embeddings, uris, scores, distances
+    ):
+        detail = {
+            "doc_hash": (doc_md or {}).get("doc_hash", chunk_id),
+            "chunk_id": chunk_id,
+        }
+        if "metadata" in fields:
+            detail["metadata"] = doc_md
+        if "doc_content" in fields:
+            detail["doc_content"] = doc_content
+        if "vector" in fields:
+            # 全文检索命中的分块没有向量
+            detail["vector"] = encode_vector(embedding, vector_encoding)
+        if "uri" in fields:
+            detail["uri"] = uri
+        if "score" in fields:
+            # 全文/混合检索的相关度，越大越相关
+            detail["score"] = score
+        if "distance" in fields:
+            # 向量距离，越小越相似
+            detail["distance"] = distance
+        details.append(detail)
+    return details
+
 @router.get("/doc-vector", summary="获取文档向量")
 async def doc_vector(
     doc_hashes: Union[str, List[str]] = Query(
         default=None,
         description="文档ID"
-    )
+    ),
+    fields: Optional[str] = Query(
+        default=None,
+        description=f"返回字段，逗号分隔: {','.join(RESPONSE_FIELDS)}，默认全部"
+    ),
+    vector_encoding: str = Query(
+        default="float",
+        description=f"向量编码: {'/'.join(VECTOR_ENCODINGS)}"
+    ),
+    analyzer: VectorAnalyzer = Depends(get_analyzer)
 ):
     if not doc_hashes:
         return format_json_response(code=1, msg="input document hash")
-    analyzer = VectorAnalyzer()
-    get_results = analyzer.get_vectors(doc_hashes)
-    details = []
-    for doc_hash, doc_md, doc_content, embeddings, uri in zip(
-        get_results["ids"], get_results["metadatas"], get_results["documents"], get_results["embeddings"], get_results["uris"]
-    ):
-        arr = np.array(embeddings)
-        vectors = arr.tolist()
-        details.append({
-            "doc_hash": doc_hash,
-            "metadata": doc_md,
-            "doc_content": doc_content,
-            "vector": vectors,
-            "uri": uri,
-        })
-    return format_json_response(code=0, msg=details)
+    try:
+        selected, include = parse_fields(fields, vector_encoding)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+
+    get_results = await asyncio.to_thread(analyzer.get_vectors, doc_hashes, include)
+    return format_chunks(get_results["ids"], get_results, selected, vector_encoding)
 
 @router.get("/similarity", summary="搜索相似文档")
 async def search_similarity(
     text: str = Query(
         default="",
         description="文本内容"
-    )
+    ),
+    mode: Optional[str] = Query(
+        default=None,
+        description=f"检索模式: {'/'.join(SEARCH_MODES)}，默认使用 RAG_SEARCH_MODE"
+    ),
+    fields: Optional[str] = Query(
+        default=None,
+        description=f"返回字段，逗号分隔: {','.join(RESPONSE_FIELDS)}，默认全部"
+    ),
+    vector_encoding: str = Query(
+        default="float",
+        description=f"向量编码: {'/'.join(VECTOR_ENCODINGS)}"
+    ),
+    analyzer: VectorAnalyzer = Depends(get_analyzer)
 ):
     if not text:
         return format_json_response(code=1, msg="input some text")
-    
-    analyzer = VectorAnalyzer()
-    query_results = analyzer.search_similarity(text)
-    details = []
-    for doc_hash, doc_md, doc_content, embeddings, uri in zip(
-        query_results["ids"][0], query_results["metadatas"][0], query_results["documents"][0], query_results["embeddings"][0], query_results["uris"][0]
-    ):
-        
-        arr = np.array(embeddings)
-        vectors = arr.tolist()
-        details.append({
-            "doc_hash": doc_hash,
-            "metadata": doc_md,
-            "doc_content": doc_content,
-            "vector": vectors,
-            "uri": uri,
+    if mode and mode not in SEARCH_MODES:
+        return format_json_response(code=1, msg=f"unsupported search mode: {mode}")
+    try:
+        selected, include = parse_fields(fields, vector_encoding)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+
+    query_results = await asyncio.to_thread(analyzer.search_similarity, text, mode, include)
+    columns = {
+        key: column[0] if column is not None else None
+        for key, column in ((key, query_results.get(key)) for key in ("metadatas", "documents", "embeddings", "uris", "scores", "distances"))
+    }
+    return format_chunks(query_results["ids"][0], columns, selected, vector_encoding)
+
+class BatchSimilarityRequest(BaseModel):
+    queries: List[str] = Field(min_length=1, max_length=RAG_SIMILARITY_BATCH_MAX_QUERIES, description="查询文本")
+    n_results: int = Field(default=RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN, ge=1, le=1000, description="每个查询返回的分块数")
+    doc_names: Optional[List[str]] = Field(default=None, description="只在这些文件名中检索")
+    dates: Optional[List[str]] = Field(default=None, description="只在这些日期目录(YYYY-MM-DD)中检索")
+    doc_hashes: Optional[List[str]] = Field(default=None, description="只在这些文档中检索")
+    fields: Optional[str] = Field(default=None, description=f"返回字段，逗号分隔: {','.join(RESPONSE_FIELDS)}，默认全部")
+    vector_encoding: str = Field(default="float", description="向量编码: float/base64-f32/base64-f16")
+
+@router.post("/similarity/batch", summary="批量搜索相似文档")
+async def search_similarity_batch(
+    req: BatchSimilarityRequest,
+    analyzer: VectorAnalyzer = Depends(get_analyzer)
+):
+    """全部查询一次批量向量化、一次向量检索，msg 与 queries 按顺序一一对应"""
+    if any(not text for text in req.queries):
+        return format_json_response(code=1, msg="queries must not be empty")
+    if req.vector_encoding == "binary":
+        return format_json_response(code=1, msg="binary vector encoding is not supported for batch search")
+    try:
+        for date in req.dates or []:
+            datetime.strptime(date, "%Y-%m-%d")
+        selected, include = parse_fields(req.fields, req.vector_encoding)
+        where = build_where(doc_hash=req.doc_hashes, doc_name=req.doc_names, date=req.dates)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+
+    query_results = await asyncio.to_thread(
+        analyzer.search_similarity_batch, req.queries, req.n_results, include, where
+    )
+    results = []
+    for index, text in enumerate(req.queries):
+        columns = {
+            key: query_results[key][index] if query_results.get(key) is not None else None
+            for key in ("metadatas", "documents", "embeddings", "uris", "distances")
+        }
+        results.append({
+            "query": text,
+            "results": build_chunk_details(query_results["ids"][index], columns, selected, req.vector_encoding),
         })
-    return format_json_response(code=0, msg=details)
+    return format_json_response(msg=results)
+
+@router.get("/vector-store/recall", summary="量化检索召回率评估")
+async def vector_store_recall(
+    k: int = Query(default=10, ge=1, le=1000, description="top-k"),
+    samples: int = Query(default=100, ge=1, le=10000, description="抽样查询数"),
+    analyzer: VectorAnalyzer = Depends(get_analyzer)
+):
+    """以库中随机向量为查询，对比 int8 量化检索与精确检索的 recall@k，仅 NumPy 存储且开启量化时可用"""
+    evaluate_recall = getattr(analyzer.vector_db.backend, "evaluate_recall", None)
+    if not evaluate_recall:
+        return format_json_response(code=1, msg="recall evaluation requires NumPy vector storage")
+    try:
+        result = await asyncio.to_thread(evaluate_recall, k, samples)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+    return format_json_response(msg=result)
+
+@router.post("/vector-store/retrain-quantizer", summary="重新训练量化参数")
+async def vector_store_retrain_quantizer(analyzer: VectorAnalyzer = Depends(get_analyzer)):
+    """按当前全部向量重新训练 int8 量化参数并重建编码，仅 NumPy 存储且开启量化时可用"""
+    retrain_quantizer = getattr(analyzer.vector_db.backend, "retrain_quantizer", None)
+    if not retrain_quantizer:
+        return format_json_response(code=1, msg="quantizer retraining requires NumPy vector storage")
+    try:
+        result = await asyncio.to_thread(retrain_quantizer)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+    return format_json_response(msg=result)
+
+@router.get("/embedding-cache", summary="向量缓存统计")
+async def embedding_cache_stats():
+    if not RAG_EMBEDDING_CACHE_ENABLED:
+        return format_json_response(code=1, msg="embedding cache disabled")
+    return format_json_response(msg=get_cache_store().stats())
+
+@router.get("/answer-cache", summary="回答缓存统计")
+async def answer_cache_stats():
+    if not RAG_ANSWER_CACHE_ENABLED:
+        return format_json_response(code=1, msg="answer cache disabled")
+    return format_json_response(msg=get_answer_cache().stats())
 
 class ChatRequest(BaseModel):
     question: str
     contexts: Optional[List[dict[str, str]]] = None
-    
+    # 服务端会话 id，传入时只需提交本轮问题，不能同时传 contexts
+    session_id: Optional[str] = None
+
+def open_turn(req: ChatRequest, sessions: SessionManager, llm_pool: LLMBackendPool):
+    """按请求打开会话中的一轮提问，未使用会话时返回空上下文；会话不存在或参数冲突时抛出 ValueError"""
+    if not req.session_id:
+        return nullcontext()
+    if req.contexts:
+        raise ValueError("contexts is not allowed with session_id")
+    session = sessions.get(req.session_id)
+    if session is None:
+        raise ValueError(f"session not found or expired: {req.session_id}")
+    return sessions.turn(llm_pool, session)
+
 @router.post("/chat", summary="提问")
-async def chat_with_hint(req: ChatRequest):
+async def chat_with_hint(
+    req: ChatRequest,
+    analyzer: VectorAnalyzer = Depends(get_analyzer),
+    llm_pool: LLMBackendPool = Depends(get_llm_pool),
+    sessions: SessionManager = Depends(get_chat_sessions)
+):
     """提问"""
     if not req.question:
         return format_json_response(code=1, msg="input your question")
     
     if not req.contexts:
         req.contexts = []
-    
-    answer = retrieval_and_ask(question=req.question, contexts=req.contexts)
-    return format_json_response(msg=answer)
+
+    try:
+        session_turn = open_turn(req, sessions, llm_pool)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+
+    usage = {}
+    async with session_turn as turn:
+        answer = await retrieval_and_ask(analyzer, llm_pool, question=req.question, contexts=req.contexts, usage=usage, turn=turn)
+    response = format_json_response(msg=answer)
+    # 提示词统计放在响应头，不改变返回结构
+    for key, header in (("prompt_tokens", "X-Prompt-Tokens"), ("cached_tokens", "X-Cached-Tokens")):
+        if usage.get(key) is not None:
+            response.headers[header] = str(usage[key])
+    if usage.get("answer_cache"):
+        response.headers["X-Answer-Cache"] = "hit"
+    return response
+
+@router.post("/chat/stream", summary="流式提问(SSE)")
+async def chat_with_hint_stream(
+    req: ChatRequest,
+    request: Request,
+    analyzer: VectorAnalyzer = Depends(get_analyzer),
+    llm_pool: LLMBackendPool = Depends(get_llm_pool),
+    sessions: SessionManager = Depends(get_chat_sessions)
+):
+    """提问，以 Server-Sent Events 逐段返回回答"""
+    if not req.question:
+        return format_json_response(code=1, msg="input your question")
+
+    try:
+        session_turn = open_turn(req, sessions, llm_pool)
+    except ValueError as e:
+        return format_json_response(code=1, msg=str(e))
+
+    async def event_stream():
+        started = time.perf_counter()
+        ttft_ms = None
+        usage = {}
+        try:
+            async with session_turn as turn, aclosing(
+                stream_retrieval_and_ask(analyzer, llm_pool, req.question, req.contexts or [], usage, turn)
+            ) as contents:
+                async for content in contents:
+                    if await request.is_disconnected():
+                        logger.info("client disconnected, cancel generation")
+                        return
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        yield format_sse_event({"ttft_ms": round(ttft_ms, 1)}, event="meta")
+                    yield format_sse_event({"content": content})
+        except Exception as e:
+            logger.error(f"chat stream error: {str(e)}")
+            yield format_sse_event({"error": str(e)}, event="error")
+            return
+
+        total_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"chat stream finished, ttft: {ttft_ms}ms, total: {total_ms:.1f}ms")
+        yield format_sse_event({
+            "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+            "total_ms": round(total_ms, 1),
+            "usage": usage,
+        }, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/chat/session", summary="创建会话")
+async def create_chat_session(sessions: SessionManager = Depends(get_chat_sessions)):
+    session = sessions.create()
+    return format_json_response(msg={"session_id": session.session_id, "ttl": sessions.ttl})
+
+@router.get("/chat/session/{session_id}", summary="会话详情")
+async def get_chat_session(session_id: str, sessions: SessionManager = Depends(get_chat_sessions)):
+    session = sessions.get(session_id)
+    if session is None:
+        return format_json_response(code=1, msg=f"session not found or expired: {session_id}")
+    return format_json_response(msg={**session.summary(), "history": session.history()})
+
+@router.delete("/chat/session/{session_id}", summary="删除会话")
+async def delete_chat_session(session_id: str, sessions: SessionManager = Depends(get_chat_sessions)):
+    if not sessions.delete(session_id):
+        return format_json_response(code=1, msg=f"session not found or expired: {session_id}")
+    return format_json_response(msg="ok")
+
+@router.get("/chat/sessions", summary="会话统计")
+async def chat_session_stats(sessions: SessionManager = Depends(get_chat_sessions)):
+    sessions.purge_expired()
+    return format_json_response(msg=sessions.stats())
+
+@router.get("/llm-backends", summary="大模型后端状态")
+async def llm_backend_stats(llm_pool: LLMBackendPool = Depends(get_llm_pool)):
+    return format_json_response(msg=llm_pool.stats())
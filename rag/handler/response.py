@@ -1,7 +1,22 @@
+import json
+import orjson
 from fastapi.responses import JSONResponse
 
-def format_json_response(msg: any, code=0) -> JSONResponse:
-    return JSONResponse(content={
+class ORJSONResponse(JSONResponse):
+    """orjson 序列化，numpy 数组无需先转换为 list"""
+
+    def render(self, content: any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+def format_json_response(msg: any, code=0) -> ORJSONResponse:
+    return ORJSONResponse(content={
         "code": code,
         "msg": msg,
     })
+
+def format_sse_event(data: any, event: str = None) -> str:
+    """格式化 Server-Sent Events 消息"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
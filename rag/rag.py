@@ -1,9 +1,15 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from pathlib import Path
 import logging
 from dao.sqlite.database import create_db_and_tables
 
+logger = logging.getLogger(__name__)
+
+# llama.cpp 两次输出之间的最长等待时间（秒）
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 300))
+
 def init_config():
     """全局日志初始化函数"""
     formatter = logging.Formatter(
@@ -22,13 +28,43 @@ def init_config():
     RAG_VECTOR_DIR = os.getenv("RAG_VECTOR_DIR")
     Path(RAG_VECTOR_DIR).mkdir(mode=0o755, parents=True, exist_ok=True)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用级共享资源：进程内只创建一次，请求之间复用，退出时统一释放"""
+    import httpx
+    from core.vector.base import VectorAnalyzer
+    from core.doc.worker import IngestWorkerPool
+    from core.knowledge.session import SessionManager
+    from core.knowledge.backend import LLMBackendPool
+
+    app.state.analyzer = VectorAnalyzer()
+    app.state.ingest_pool = IngestWorkerPool(app.state.analyzer)
+    app.state.ingest_pool.start()
+    # llama.cpp 请求复用同一异步连接池（keep-alive）
+    app.state.llm_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+    app.state.llm_pool = LLMBackendPool(app.state.llm_client)
+    app.state.llm_pool.start()
+    app.state.chat_sessions = SessionManager()
+    logger.info("shared resources initialized")
+    try:
+        yield
+    finally:
+        await app.state.llm_pool.stop()
+        await app.state.llm_client.aclose()
+        app.state.ingest_pool.stop()
+        app.state.analyzer.close()
+        logger.info("shared resources released")
+
 if __name__ == "__main__":
     init_config()
     
     import uvicorn
     from handler.document import router as document_router
     from handler.knowledge import router as knowledge_router
-    app = FastAPI(title="RAG 服务")
+    app = FastAPI(title="RAG 服务", lifespan=lifespan)
     # 注册子路由
     app.include_router(document_router)
     app.include_router(knowledge_router)
@@ -0,0 +1,208 @@
+import os
+import json
+import logging
+import argparse
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator
+import numpy as np
+from rag import init_config
+
+logger = logging.getLogger(__name__)
+
+RAG_FEEDS_DIR = os.getenv("RAG_FEEDS_DIR")
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+RECORDS_FILE = "records.ndjson"
+EMBEDDINGS_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.ndjson"
+
+# 快照目录结构：
+#   manifest.json     版本、集合名与存储后端、向量模型与维度、记录数，最后写入，存在即表示快照完整
+#   records.ndjson    每行一个分块 {"id", "metadata", "document"}，与 embeddings.npy 的行一一对应
+#   embeddings.npy    float32 小端的 (记录数, 维度) 矩阵
+#   documents.ndjson  每行一个 Document 元数据
+
+def iter_documents(page_size: int) -> Iterator[dict]:
+    from dao.sqlite.document import list_doc
+
+    cursor = None
+    while True:
+        docs = list_doc(page_size, cursor)
+        for doc in docs:
+            record = doc.model_dump(exclude={"id"})
+            record["create_time"] = doc.create_time.isoformat()
+            record["parsed_at"] = doc.parsed_at.isoformat() if doc.parsed_at else None
+            yield record
+        if len(docs) < page_size:
+            return
+        cursor = (docs[-1].create_time, docs[-1].id)
+
+def export_snapshot(target: Path, page_size: int):
+    from core.vector.storage.db import VectorDatabase, RAR_CHROMA_DB_COLLECTION_NAME, RAG_VECTOR_STORAGE_TYPE
+    from core.vector.embeddings.qwen import DASH_SCOPE_EMBEDDINGS_MODEL, EMBEDDING_DIMENSION
+
+    if target.exists() and any(target.iterdir()):
+        raise ValueError(f"snapshot directory is not empty: {target}")
+    target.mkdir(parents=True, exist_ok=True)
+
+    backend = VectorDatabase(embeddings=None).backend
+    total = backend.count()
+    dimension = int(EMBEDDING_DIMENSION)
+    embeddings = np.lib.format.open_memmap(
+        target.joinpath(EMBEDDINGS_FILE), mode="w+", dtype="<f4", shape=(total, dimension)
+    )
+
+    # 导出过程中集合可能有新增或删除，以开始时的记录数为上限，实际行数写入 manifest
+    written = 0
+    with target.joinpath(RECORDS_FILE).open("w", encoding="utf-8") as records:
+        while written < total:
+            page = backend.page(
+                offset=written,
+                limit=min(page_size, total - written),
+                include=["metadatas", "documents", "embeddings"],
+            )
+            if not page["ids"]:
+                break
+            rows = len(page["ids"])
+            embeddings[written:written + rows] = np.asarray(page["embeddings"], dtype="<f4")
+            for chunk_id, metadata, document in zip(page["ids"], page["metadatas"], page["documents"]):
+                records.write(json.dumps({"id": chunk_id, "metadata": metadata, "document": document}, ensure_ascii=False))
+                records.write("\n")
+            written += rows
+            logger.info(f"exported records: {written}/{total}")
+    embeddings.flush()
+    del embeddings
+
+    document_count = 0
+    with target.joinpath(DOCUMENTS_FILE).open("w", encoding="utf-8") as documents:
+        for record in iter_documents(page_size):
+            documents.write(json.dumps(record, ensure_ascii=False))
+            documents.write("\n")
+            document_count += 1
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "collection": RAR_CHROMA_DB_COLLECTION_NAME,
+        "storage_type": RAG_VECTOR_STORAGE_TYPE,
+        "embedding_model": DASH_SCOPE_EMBEDDINGS_MODEL,
+        "embedding_dimension": dimension,
+        "record_count": written,
+        "document_count": document_count,
+        "feeds_dir": Path(RAG_FEEDS_DIR).resolve().as_posix(),
+        "create_time": datetime.now().isoformat(),
+    }
+    target.joinpath(MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    logger.info(f"snapshot exported: {target}, records: {written}, documents: {document_count}")
+
+def import_documents(source: Path, manifest: dict, page_size: int) -> Dict[str, "Document"]:
+    """导入 Document 元数据，返回 doc_hash 到本地文档记录的映射"""
+    from dao.sqlite.document import Document, save_docs, get_docs
+
+    # 快照来自其它环境时，将原 RAG_FEEDS_DIR 下的路径映射到本地 RAG_FEEDS_DIR
+    old_feeds_dir = manifest.get("feeds_dir")
+    new_feeds_dir = Path(RAG_FEEDS_DIR).resolve().as_posix()
+
+    local_docs: Dict[str, Document] = {}
+    with source.joinpath(DOCUMENTS_FILE).open("r", encoding="utf-8") as documents:
+        while lines := list(islice(documents, page_size)):
+            docs = []
+            for line in lines:
+                record = json.loads(line)
+                if old_feeds_dir and record["dest_dir"].startswith(old_feeds_dir):
+                    record["dest_dir"] = new_feeds_dir + record["dest_dir"][len(old_feeds_dir):]
+                record["create_time"] = datetime.fromisoformat(record["create_time"])
+                if record.get("parsed_at"):
+                    record["parsed_at"] = datetime.fromisoformat(record["parsed_at"])
+                docs.append(Document(**record))
+            saved = save_docs(docs)
+            # 本地已存在的文档以本地记录为准
+            for doc in get_docs(doc_hashes=[doc.doc_hash for doc in docs]):
+                local_docs[doc.doc_hash] = doc
+            logger.info(f"imported documents: {len(saved)} new, {len(docs) - len(saved)} existing")
+    return local_docs
+
+def import_snapshot(source: Path, page_size: int, force: bool):
+    from core.vector.storage.db import VectorDatabase
+    from core.vector.embeddings.qwen import DASH_SCOPE_EMBEDDINGS_MODEL, EMBEDDING_DIMENSION
+    from dao.sqlite.chunk import upsert_chunks
+
+    manifest_path = source.joinpath(MANIFEST_FILE)
+    if not manifest_path.exists():
+        raise ValueError(f"incomplete snapshot, {MANIFEST_FILE} not found: {source}")
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot version: {manifest.get('version')}")
+    # 向量模型或维度不一致时，快照中的向量与本地查询向量不可比较
+    if (manifest["embedding_model"], manifest["embedding_dimension"]) != (DASH_SCOPE_EMBEDDINGS_MODEL, int(EMBEDDING_DIMENSION)):
+        message = (f"embedding mismatch: snapshot {manifest['embedding_model']}:{manifest['embedding_dimension']}, "
+                   f"local {DASH_SCOPE_EMBEDDINGS_MODEL}:{EMBEDDING_DIMENSION}")
+        if not force:
+            raise ValueError(message)
+        logger.warning(message)
+
+    local_docs = import_documents(source, manifest, page_size)
+
+    backend = VectorDatabase(embeddings=None).backend
+    page_size = min(page_size, backend.max_batch_size)
+    total = manifest["record_count"]
+    embeddings = np.load(source.joinpath(EMBEDDINGS_FILE), mmap_mode="r")
+    if embeddings.shape[0] < total:
+        raise ValueError(f"embeddings rows {embeddings.shape[0]} less than record count {total}")
+
+    imported = 0
+    with source.joinpath(RECORDS_FILE).open("r", encoding="utf-8") as records:
+        while imported < total and (lines := list(islice(records, min(page_size, total - imported)))):
+            rows = [json.loads(line) for line in lines]
+            metadatas, uris = [], []
+            for row in rows:
+                metadata = row["metadata"]
+                doc = local_docs.get(metadata.get("doc_hash"))
+                doc_path = doc.full_path() if doc else None
+                if doc:
+                    metadata["posix"] = doc_path.as_posix()
+                    metadata["date"] = doc.create_time.strftime("%Y-%m-%d")
+                metadatas.append(metadata)
+                uris.append(doc_path.as_uri() if doc_path and doc_path.is_absolute() else None)
+            backend.upsert(
+                ids=[row["id"] for row in rows],
+                metadatas=metadatas,
+                documents=[row["document"] for row in rows],
+                embeddings=np.ascontiguousarray(embeddings[imported:imported + len(rows)]),
+                uris=uris,
+            )
+            # 同步写入全文索引，导入后 lexical/hybrid 检索即可使用
+            upsert_chunks([{
+                "chunk_id": row["id"],
+                "doc_hash": row["metadata"].get("doc_hash", row["id"]),
+                "doc_name": row["metadata"].get("doc_name", ""),
+                "chunk_index": row["metadata"].get("chunk_index", 0),
+                "content": row["document"] or "",
+            } for row in rows])
+            imported += len(rows)
+            logger.info(f"imported records: {imported}/{total}")
+    logger.info(f"snapshot imported: {source}, records: {imported}")
+
+def main():
+    parser = argparse.ArgumentParser(description="导出或导入向量库快照，避免迁移时重新向量化")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="导出快照")
+    export_parser.add_argument("target", type=Path, help="快照目录（不存在或为空）")
+    import_parser = subparsers.add_parser("import", help="导入快照")
+    import_parser.add_argument("source", type=Path, help="快照目录")
+    import_parser.add_argument("--force", action="store_true", help="向量模型或维度不一致时仍然导入")
+    for sub in (export_parser, import_parser):
+        sub.add_argument("--page-size", type=int, default=1000, help="每页读写的记录数")
+    args = parser.parse_args()
+
+    init_config()
+
+    if args.command == "export":
+        export_snapshot(args.target.resolve(), args.page_size)
+    else:
+        import_snapshot(args.source.resolve(), args.page_size, args.force)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 模块在导入时读取配置，需在导入被测模块之前指向临时目录
+_TEST_DIR = Path(tempfile.mkdtemp(prefix="rag-test-"))
+os.environ.update({
+    "RAG_FEEDS_DIR": str(_TEST_DIR / "feeds"),
+    "RAG_SQLITE_DIR": str(_TEST_DIR / "sqlite"),
+    "SQLITE_METADATA_DB": "metadata.db",
+    "RAG_VECTOR_DIR": str(_TEST_DIR / "vector"),
+    "RAG_CHROMA_DB": "Chroma.db",
+    "RAG_CHROMA_LEGACY_DIR": "",
+    "RAG_VECTOR_STORAGE_TYPE": "NumPy",
+    "RAR_CHROMA_DB_COLLECTION_NAME": "test",
+    "RAG_CHROMA_DB_DOCUMENTS_NUMBER_RETURN": "4",
+    "EMBEDDINGS_MODEL": "QWen",
+    "EMBEDDING_DIMENSION": "8",
+    "DASH_SCOPE_API_KEY": "test",
+    "DASH_SCOPE_BASE_URL": "http://127.0.0.1:1/v1",
+    "LLM_SERVER_BASE_URL": "http://127.0.0.1:1",
+    "LLM_CHAT_ENDPOINT": "v1/chat/completions",
+    "RAG_INGEST_PROCESSES": "1",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+from sqlmodel import Session, SQLModel, delete
+
+@pytest.fixture(scope="session")
+def database():
+    from dao.sqlite.database import create_db_and_tables, engine
+    create_db_and_tables()
+    return engine
+
+@pytest.fixture
+def db(database):
+    """每个用例开始前清空全部表"""
+    with Session(database) as session:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            session.exec(delete(table))
+        session.commit()
+    return database
@@ -0,0 +1,50 @@
+from langchain_core.documents import Document as LangchainDocument
+from core.knowledge.answer_cache import AnswerCache
+from core.vector.base import VectorAnalyzer
+from dao.sqlite.chunk import get_corpus_version, upsert_chunks
+from dao.sqlite.document import Document
+
+class FakeVectorDatabase:
+    def save(self, doc, chunks, vectors):
+        pass
+
+def reparse(doc: Document, content: str):
+    """只执行解析结果入库的部分：向量库为空实现，分块写入 SQLite"""
+    analyzer = VectorAnalyzer.__new__(VectorAnalyzer)
+    analyzer.vector_db = FakeVectorDatabase()
+    chunk = LangchainDocument(page_content=content, metadata={"chunk_index": 0})
+    analyzer._save_index(doc, None, [chunk], [[1.0, 0.0]])
+
+def cache_answer(cache: AnswerCache, doc_hashes, corpus_version: int):
+    cache.put("q", [1.0, 0.0], doc_hashes, "answer", generation_ms=10, corpus_version=corpus_version)
+
+def test_reparse_invalidates_cached_answer(db):
+    doc = Document(dest_dir="/tmp", doc_name="a.txt", doc_hash="h1")
+    reparse(doc, "first")
+    cache = AnswerCache(threshold=0.9, ttl=60, max_items=10)
+    cache_answer(cache, ["h1", "h2"], get_corpus_version())
+    assert cache.lookup([1.0, 0.0], ["h1", "h2"]) is not None
+
+    reparse(doc, "second")
+    assert cache.lookup([1.0, 0.0], ["h1", "h2"]) is None
+    assert cache.stats()["invalidations"] == 1
+
+def test_unrelated_document_keeps_cached_answer(db):
+    cache = AnswerCache(threshold=0.9, ttl=60, max_items=10)
+    cache_answer(cache, ["h1"], get_corpus_version())
+    reparse(Document(dest_dir="/tmp", doc_name="b.txt", doc_hash="h2"), "other")
+    assert cache.lookup([1.0, 0.0], ["h1"]) is not None
+
+def test_snapshot_import_invalidates_cached_answer(db):
+    cache = AnswerCache(threshold=0.9, ttl=60, max_items=10)
+    cache_answer(cache, ["h1"], get_corpus_version())
+    # 快照导入在其它进程中写入分块
+    upsert_chunks([{"chunk_id": "h1-0", "doc_hash": "h1", "doc_name": "a.txt", "chunk_index": 0, "content": "imported"}])
+    assert cache.lookup([1.0, 0.0], ["h1"]) is None
+
+def test_answer_generated_during_reparse_is_not_reused(db):
+    cache = AnswerCache(threshold=0.9, ttl=60, max_items=10)
+    corpus_version = get_corpus_version()
+    reparse(Document(dest_dir="/tmp", doc_name="a.txt", doc_hash="h1"), "changed while generating")
+    cache_answer(cache, ["h1"], corpus_version)
+    assert cache.lookup([1.0, 0.0], ["h1"]) is None
@@ -0,0 +1,26 @@
+from dao.sqlite.chunk import _split_terms, build_match_query, replace_chunks, search_chunks
+
+def test_cjk_run_split_into_overlapping_trigrams():
+    assert _split_terms("向量数据库") == ["向量数", "量数据", "数据库"]
+
+def test_cjk_and_latin_split_within_word():
+    assert _split_terms("RAG向量检索 embedding") == ["RAG", "向量检", "量检索", "embedding"]
+
+def test_short_terms_dropped_and_duplicates_removed():
+    # trigram 分词器无法匹配少于三个字符的词
+    assert _split_terms("检索 ab 检索系统 检索系统") == ["检索系", "索系统"]
+    assert _split_terms("三个字") == ["三个字"]
+
+def test_japanese_and_korean_runs():
+    assert _split_terms("ベクトル検索") == ["ベクト", "クトル", "トル検", "ル検索"]
+    assert _split_terms("벡터검색") == ["벡터검", "터검색"]
+
+def test_match_query_quotes_terms():
+    assert build_match_query('数据库 "x"y') == '"数据库" OR """x""y"'
+
+def test_cjk_query_matches_without_exact_sentence(db):
+    replace_chunks("h1", "a.txt", [{"chunk_id": "h1-0", "chunk_index": 0, "content": "本系统使用向量数据库存储文档分块"}])
+    replace_chunks("h2", "b.txt", [{"chunk_id": "h2-0", "chunk_index": 0, "content": "无关内容"}])
+    # 整句未在原文中出现，但命中多个三字组
+    results = search_chunks("向量数据库检索", 10)
+    assert [row["chunk_id"] for row in results] == ["h1-0"]
@@ -0,0 +1,35 @@
+import sqlite3
+from core.vector.embeddings.cache import EmbeddingCacheStore
+
+def disk_total(db_path) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache").fetchone()[0]
+
+def test_size_limit_shared_between_processes(tmp_path):
+    db_path = tmp_path / "embedding_cache.db"
+    # 两个存储实例模拟共用缓存文件的两个进程
+    stores = [EmbeddingCacheStore(db_path, max_bytes=10_000, memory_items=10) for _ in range(2)]
+    for index in range(40):
+        stores[index % 2].put_many({f"key-{index}".encode(): bytes(1000)})
+
+    assert disk_total(db_path) <= 10_000
+    assert stores[0].stats()["disk_bytes"] == stores[1].stats()["disk_bytes"] == disk_total(db_path)
+
+def test_size_initialized_from_existing_rows(tmp_path):
+    db_path = tmp_path / "embedding_cache.db"
+    EmbeddingCacheStore(db_path, max_bytes=10_000, memory_items=10).put_many({b"a": bytes(300), b"b": bytes(200)})
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DROP TABLE embedding_cache_size")
+
+    store = EmbeddingCacheStore(db_path, max_bytes=10_000, memory_items=10)
+    assert store.stats()["disk_bytes"] == 500
+
+def test_get_many_reads_disk_and_memory(tmp_path):
+    db_path = tmp_path / "embedding_cache.db"
+    EmbeddingCacheStore(db_path, max_bytes=10_000, memory_items=10).put_many({b"a": b"1234", b"b": b"5678"})
+
+    store = EmbeddingCacheStore(db_path, max_bytes=10_000, memory_items=10)
+    assert store.get_many([b"a", b"c"]) == {b"a": b"1234"}
+    assert store.get_many([b"a", b"b"]) == {b"a": b"1234", b"b": b"5678"}
+    stats = store.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 2, 1)
@@ -0,0 +1,153 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import openai
+import pytest
+import core.vector.embeddings.qwen as qwen
+from core.vector.embeddings.qwen import QwenEmbeddings
+
+DIMENSION = 8
+
+class EmbeddingServer(ThreadingHTTPServer):
+    """本地模拟的向量接口：前 failures 个请求返回 status，其余请求按文本序号返回向量"""
+
+    daemon_threads = True
+
+    def __init__(self, failures: int = 0, status: int = 429, retry_after: str = "0", latency: float = 0):
+        super().__init__(("127.0.0.1", 0), EmbeddingHandler)
+        self.failures = failures
+        self.status = status
+        self.retry_after = retry_after
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server: EmbeddingServer = self.server
+        texts = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["input"]
+        with server.lock:
+            server.requests.append((time.monotonic(), texts))
+            failed = len(server.requests) <= server.failures
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.latency)
+            if failed:
+                self.reply(server.status, {"error": {"message": "busy"}}, {"Retry-After": server.retry_after})
+                return
+            # 倒序返回，客户端需按 index 还原顺序
+            data = [
+                {"object": "embedding", "index": index, "embedding": [float(text[1:])] + [0.0] * (DIMENSION - 1)}
+                for index, text in reversed(list(enumerate(texts)))
+            ]
+            self.reply(200, {"object": "list", "data": data, "model": "stub", "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+@pytest.fixture
+def serve(monkeypatch):
+    servers = []
+    monkeypatch.setattr(qwen, "DASH_SCOPE_EMBEDDINGS_MODEL", "stub")
+    monkeypatch.setattr(qwen, "EMBEDDING_DIMENSION", str(DIMENSION))
+    monkeypatch.setattr(qwen, "DASH_SCOPE_EMBEDDINGS_BATCH_SIZE", 10)
+    monkeypatch.setattr(qwen, "DASH_SCOPE_EMBEDDINGS_CONCURRENCY", 4)
+    monkeypatch.setattr(qwen, "DASH_SCOPE_EMBEDDINGS_MAX_RETRIES", 3)
+
+    def start(**kwargs) -> EmbeddingServer:
+        server = EmbeddingServer(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        monkeypatch.setenv("DASH_SCOPE_BASE_URL", server.base_url)
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def texts(count: int):
+    return [f"t{i}" for i in range(count)]
+
+def test_batches_run_concurrently_and_keep_order(serve):
+    server = serve(latency=0.2)
+    embeddings = QwenEmbeddings()
+    try:
+        started = time.monotonic()
+        vectors = embeddings.embed_documents(texts(40))
+        elapsed = time.monotonic() - started
+    finally:
+        embeddings.close()
+    assert [vector[0] for vector in vectors] == [float(i) for i in range(40)]
+    assert [len(batch) for _, batch in server.requests] == [10] * 4
+    assert server.max_in_flight > 1
+    # 四个批次并发，总耗时明显小于串行的 0.8 秒
+    assert elapsed < 0.6
+
+def test_request_rate_limited(serve, monkeypatch):
+    monkeypatch.setattr(qwen, "DASH_SCOPE_EMBEDDINGS_BATCH_SIZE", 1)
+    monkeypatch.setattr(qwen, "DASH_SCOPE_EMBEDDINGS_RATE_LIMIT", 50)
+    server = serve()
+    embeddings = QwenEmbeddings()
+    try:
+        vectors = embeddings.embed_documents(texts(75))
+    finally:
+        embeddings.close()
+    assert len(vectors) == 75
+    times = sorted(at for at, _ in server.requests)
+    # 令牌桶允许 50 个请求的突发，其余 25 个按每秒 50 个发出
+    assert times[-1] - times[0] >= 0.45
+
+def test_rate_limited_batch_retried_after_retry_after(serve):
+    server = serve(failures=2, retry_after="0.3")
+    embeddings = QwenEmbeddings()
+    try:
+        vectors = embeddings.embed_documents(texts(5))
+    finally:
+        embeddings.close()
+    assert [vector[0] for vector in vectors] == [float(i) for i in range(5)]
+    times = [at for at, _ in server.requests]
+    assert len(times) == 3
+    # Retry-After 是退避的下限
+    assert all(later - earlier >= 0.3 for earlier, later in zip(times, times[1:]))
+
+def test_server_error_gives_up_after_max_retries(serve):
+    server = serve(failures=100, status=503)
+    embeddings = QwenEmbeddings()
+    embeddings.executor.backoff_base = 0.01
+    try:
+        with pytest.raises(openai.InternalServerError):
+            embeddings.embed_documents(texts(5))
+    finally:
+        embeddings.close()
+    assert len(server.requests) == 1 + qwen.DASH_SCOPE_EMBEDDINGS_MAX_RETRIES
+
+def test_client_error_not_retried(serve):
+    server = serve(failures=100, status=400)
+    embeddings = QwenEmbeddings()
+    try:
+        with pytest.raises(openai.BadRequestError):
+            embeddings.embed_documents(texts(5))
+    finally:
+        embeddings.close()
+    assert len(server.requests) == 1
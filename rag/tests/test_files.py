@@ -0,0 +1,51 @@
+import io
+import pytest
+from utils.files import JsonStreamValidator, is_valid_json
+
+VALID = [
+    '{"name": "向量", "items": [1, -2.5e3, true, false, null], "nested": {"a": [], "b": {}}}',
+    '"escaped \\" quote \\\\ and \\u4e2d"',
+    '[12345678901234567890, 0.5, "x"]',
+    '  \n[ ]  ',
+]
+INVALID = [
+    '{"a": 1,}',
+    '[1 2]',
+    '{"a" 1}',
+    '"unterminated',
+    '"bad \\x escape"',
+    '[01]',
+    '[truex]',
+    '{"a": 1}}',
+    '{"a": [1}',
+]
+
+def validate_split(text: str, split: int) -> bool:
+    validator = JsonStreamValidator()
+    return validator.feed(text[:split]) and validator.feed(text[split:], final=True)
+
+@pytest.mark.parametrize("text", VALID)
+def test_valid_json_at_every_chunk_boundary(text):
+    for split in range(len(text) + 1):
+        assert validate_split(text, split), split
+
+@pytest.mark.parametrize("text", INVALID)
+def test_invalid_json_at_every_chunk_boundary(text):
+    for split in range(len(text) + 1):
+        assert not validate_split(text, split), split
+
+def test_single_character_chunks():
+    validator = JsonStreamValidator()
+    text = VALID[0]
+    assert all(validator.feed(char) for char in text)
+    assert validator.feed("", final=True)
+
+def test_truncated_document_is_invalid():
+    validator = JsonStreamValidator()
+    assert validator.feed('{"a": [1, 2')
+    assert not validator.feed("", final=True)
+
+def test_multibyte_character_split_across_reads(monkeypatch):
+    monkeypatch.setattr("utils.files.VALIDATE_CHUNK_SIZE", 3)
+    assert is_valid_json(io.BytesIO('{"键": "中文内容"}'.encode("utf-8")))
+    assert not is_valid_json(io.BytesIO('{"键": "中文内容"'.encode("utf-8")))
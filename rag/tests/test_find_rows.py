@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session
+from dao.sqlite.database import engine
+from dao.sqlite.document import Document, SQLITE_MAX_VARIABLES
+from dao.sqlite.vector import VectorRecord, replace_records, find_rows
+
+def add_document(doc_hash: str, create_time: datetime, row_index: int):
+    with Session(engine) as session:
+        session.add(Document(dest_dir="/tmp", doc_name=f"{doc_hash}.txt", doc_hash=doc_hash, create_time=create_time))
+        session.commit()
+    replace_records([VectorRecord(row_index=row_index, chunk_id=f"{doc_hash}-0", doc_hash=doc_hash)])
+
+@pytest.fixture
+def bound_parameters():
+    """记录每条语句绑定的变量数"""
+    counts = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        counts.append(len(parameters))
+    event.listen(engine, "before_cursor_execute", record)
+    yield counts
+    event.remove(engine, "before_cursor_execute", record)
+
+def test_full_hash_list_with_dates_stays_under_variable_limit(db, bound_parameters):
+    day = datetime(2024, 1, 10, 12)
+    add_document("a", day, 0)
+    add_document("b", day - timedelta(days=3), 1)
+    add_document("c", day, 2)
+    # 命中的 hash 放在最后一批，日期条件必须在每批都生效
+    doc_hashes = [f"missing-{i}" for i in range(SQLITE_MAX_VARIABLES)] + ["a", "b"]
+    dates = [(day - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(0, 20, 2)]
+    assert sorted(find_rows(doc_hashes=doc_hashes, doc_names=[f"{h}.txt" for h in doc_hashes], dates=dates)) == [0]
+    assert bound_parameters and max(bound_parameters) <= SQLITE_MAX_VARIABLES
+
+def test_too_many_dates_rejected(db):
+    dates = [(datetime(2000, 1, 1) + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(SQLITE_MAX_VARIABLES)]
+    with pytest.raises(ValueError):
+        find_rows(dates=dates)
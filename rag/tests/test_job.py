@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from sqlmodel import Session, update
+from dao.sqlite.database import engine
+from dao.sqlite.job import (
+    ParseJobItem, create_job, get_job, claim_item, finish_item, renew_items,
+    JOB_PENDING, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED,
+)
+
+LEASE_SECONDS = 60
+
+def expire_lease(item_id: int):
+    """模拟处理进程退出：最后一次续租在租期之前"""
+    with Session(engine) as session:
+        session.exec(
+            update(ParseJobItem)
+            .where(ParseJobItem.id == item_id)
+            .values(update_time=datetime.now() - timedelta(seconds=LEASE_SECONDS + 1))
+        )
+        session.commit()
+
+def item_status(item_id: int) -> str:
+    with Session(engine) as session:
+        return session.get(ParseJobItem, item_id).status
+
+def job_status(job_id: int) -> str:
+    return get_job(job_id)[0].status
+
+def test_running_item_not_claimed_again_within_lease(db):
+    job = create_job([1])
+    item = claim_item(LEASE_SECONDS)
+    assert item.attempts == 1
+    assert job_status(job.id) == JOB_RUNNING
+    assert claim_item(LEASE_SECONDS) is None
+
+def test_expired_lease_is_reclaimed(db):
+    create_job([1])
+    item = claim_item(LEASE_SECONDS)
+    expire_lease(item.id)
+    reclaimed = claim_item(LEASE_SECONDS)
+    assert reclaimed.id == item.id
+    assert reclaimed.attempts == 2
+
+def test_renewed_lease_is_not_reclaimed(db):
+    create_job([1])
+    item = claim_item(LEASE_SECONDS)
+    expire_lease(item.id)
+    renew_items([item.id])
+    assert claim_item(LEASE_SECONDS) is None
+
+def test_finish_item_requeues_until_max_attempts(db):
+    job = create_job([1])
+    item = claim_item(LEASE_SECONDS)
+    finish_item(item, error="boom", max_attempts=2)
+    assert item_status(item.id) == JOB_PENDING
+
+    item = claim_item(LEASE_SECONDS)
+    assert item.attempts == 2
+    finish_item(item, error="boom", max_attempts=2)
+    assert item_status(item.id) == JOB_FAILED
+    assert job_status(job.id) == JOB_FAILED
+
+def test_finish_item_after_reclaim_keeps_latest_result(db):
+    job = create_job([1, 2])
+    first = claim_item(LEASE_SECONDS)
+    expire_lease(first.id)
+    second = claim_item(LEASE_SECONDS)
+    assert second.id == first.id
+    finish_item(second)
+    assert item_status(first.id) == JOB_SUCCEEDED
+    # 另一个文档仍待处理，任务未结束
+    assert job_status(job.id) == JOB_RUNNING
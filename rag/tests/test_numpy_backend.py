@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import core.vector.storage.numpy_mmap as numpy_mmap
+from core.vector.storage.numpy_mmap import NumpyBackend, normalize
+
+DIMENSION = 16
+ROWS = 2000
+
+@pytest.fixture
+def backend(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(numpy_mmap, "RAG_VECTOR_DIR", tmp_path.as_posix())
+    monkeypatch.setattr(numpy_mmap, "EMBEDDING_DIMENSION", str(DIMENSION))
+    monkeypatch.setattr(numpy_mmap, "RAG_NUMPY_QUANTIZATION", "int8")
+    monkeypatch.setattr(numpy_mmap, "RAG_NUMPY_QUANT_MIN_ROWS", ROWS // 2)
+    return NumpyBackend()
+
+def upsert(backend: NumpyBackend, vectors: np.ndarray):
+    ids = [f"c{i}" for i in range(len(vectors))]
+    backend.upsert(ids, [{"doc_hash": f"h{i % 20}"} for i in range(len(vectors))], ids, vectors.tolist(), [None] * len(vectors))
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = normalize(queries) @ normalize(vectors).T
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+def recall(approx: np.ndarray, exact: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx.tolist(), exact.tolist())]))
+
+def test_quantized_top_k_matches_exact(backend):
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(ROWS, DIMENSION)).astype(np.float32)
+    queries = rng.normal(size=(50, DIMENSION)).astype(np.float32)
+    upsert(backend, vectors)
+    assert backend.codes_path.exists()
+
+    expected = exact_top_k(vectors, queries, 10)
+    exact_rows, _ = backend.search(queries, 10, exact=True)
+    assert exact_rows.tolist() == expected.tolist()
+
+    rescored_rows, rescored_scores = backend.search(queries, 10)
+    first_pass_rows, _ = backend.search(queries, 10, rescore=False)
+    assert recall(rescored_rows, expected) >= 0.95
+    assert recall(first_pass_rows, expected) >= 0.7
+    # 重排后的分数是精确的余弦相似度
+    exact_scores = np.einsum("qkd,qd->qk", normalize(vectors)[rescored_rows], normalize(queries))
+    assert np.allclose(rescored_scores, exact_scores, atol=1e-5)
+
+def test_below_min_rows_searches_exactly(backend):
+    rng = np.random.default_rng(11)
+    vectors = rng.normal(size=(ROWS // 4, DIMENSION)).astype(np.float32)
+    upsert(backend, vectors)
+    assert not backend.codes_path.exists()
+    rows, _ = backend.search(vectors[:5], 3)
+    assert rows[:, 0].tolist() == list(range(5))
+
+def test_quantized_search_respects_allowed_rows(backend):
+    rng = np.random.default_rng(13)
+    vectors = rng.normal(size=(ROWS, DIMENSION)).astype(np.float32)
+    upsert(backend, vectors)
+    allowed = list(range(0, ROWS, 7))
+    rows, _ = backend.search(vectors[:10], 5, allowed_rows=allowed)
+    assert set(rows.ravel().tolist()) <= set(allowed)
@@ -0,0 +1,37 @@
+import sqlite3
+from sqlmodel import create_engine, SQLModel
+from dao.sqlite.database import SCHEMA_MIGRATIONS, SchemaState, migrate_schema
+
+def columns(db_path, table: str):
+    with sqlite3.connect(db_path) as conn:
+        return {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+def schema_version(db_path) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT version FROM schema_state WHERE id = 1").fetchone()[0]
+
+def test_adds_columns_to_existing_table_once(tmp_path, database):
+    db_path = tmp_path / "legacy.db"
+    with sqlite3.connect(db_path) as conn:
+        # 加列之前的 document 表结构
+        conn.execute(
+            "CREATE TABLE document (id INTEGER PRIMARY KEY, dest_dir VARCHAR(1024), doc_name VARCHAR(255), "
+            "doc_hash VARCHAR(64) UNIQUE, doc_size INTEGER, create_time DATETIME)"
+        )
+        conn.execute("INSERT INTO document VALUES (1, '/tmp', 'a.txt', 'h1', 1, '2024-01-01 00:00:00')")
+    legacy = create_engine(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(legacy, tables=[SchemaState.__table__])
+
+    migrate_schema(legacy)
+    assert set(SCHEMA_MIGRATIONS[0][1]) <= columns(db_path, "document")
+    assert schema_version(db_path) == len(SCHEMA_MIGRATIONS)
+    # 版本号已是最新，再次执行不会重复加列
+    migrate_schema(legacy)
+    assert schema_version(db_path) == len(SCHEMA_MIGRATIONS)
+
+def test_new_database_only_records_version(tmp_path, database):
+    db_path = tmp_path / "new.db"
+    fresh = create_engine(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(fresh)
+    migrate_schema(fresh)
+    assert schema_version(db_path) == len(SCHEMA_MIGRATIONS)
@@ -0,0 +1,48 @@
+import time
+import pytest
+import core.doc.worker as worker
+from core.doc.worker import IngestWorkerPool
+from dao.sqlite.job import create_job, get_job, JOB_FAILED
+
+def wait_until(predicate, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+@pytest.fixture
+def pool(db, monkeypatch):
+    monkeypatch.setattr(worker, "RAG_INGEST_POLL_INTERVAL", 0.05)
+    pool = IngestWorkerPool(analyzer=None, workers=1, processes=1, max_attempts=1)
+    yield pool
+    pool.stop()
+
+def test_failed_index_state_write_still_finishes_item(pool, monkeypatch):
+    def locked(*args, **kwargs):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(worker, "update_index_state", locked)
+
+    # 文档不存在，处理失败后写入索引状态时抛出异常
+    job = create_job([404])
+    pool.start()
+
+    assert wait_until(lambda: get_job(job.id)[1][0].status == JOB_FAILED)
+    assert pool.threads[0].is_alive()
+
+def test_claim_error_does_not_kill_worker(pool, monkeypatch):
+    calls = []
+    claim_item = worker.claim_item
+    def flaky(lease_seconds):
+        calls.append(lease_seconds)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return claim_item(lease_seconds)
+    monkeypatch.setattr(worker, "claim_item", flaky)
+
+    job = create_job([404])
+    pool.start()
+
+    assert wait_until(lambda: get_job(job.id)[1][0].status == JOB_FAILED)
+    assert pool.threads[0].is_alive()
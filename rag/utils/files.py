@@ -1,10 +1,16 @@
-from io import BytesIO
+import re
+import csv
+import codecs
 import hashlib
-import binascii
+from io import TextIOWrapper
+from pathlib import Path
+from zipfile import ZipFile, BadZipFile
 from fastapi import UploadFile
-from typing import Dict, Tuple, Optional
+from typing import BinaryIO, Dict, List, Tuple, Union
 
 MAX_FILE_SIZE = 100 * 1024 * 1024
+# 内容校验时每次读取的字节数
+VALIDATE_CHUNK_SIZE = 64 * 1024
 
 ALLOWED_MIME_TYPES = {
     'application/pdf',
@@ -15,122 +21,198 @@ ALLOWED_MIME_TYPES = {
     'text/plain'
 }
 
-# 文件签名数据库（十六进制格式）
-FILE_SIGNATURES: Dict[str, Dict[str, Tuple[bytes, Optional[int]]]] = {
+# 辅助验证函数（流式读取，内存占用与文件大小无关）
+def is_valid_json(stream: BinaryIO) -> bool:
+    validator = JsonStreamValidator()
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        while chunk := stream.read(VALIDATE_CHUNK_SIZE):
+            if not validator.feed(decoder.decode(chunk)):
+                return False
+        return validator.feed(decoder.decode(b"", final=True), final=True)
+    except UnicodeDecodeError:
+        return False
+
+def is_valid_csv(stream: BinaryIO) -> bool:
+    text_stream = TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        # 验证首行字段数一致性，csv 模块逐行读取
+        reader = csv.reader(text_stream)
+        header = next(reader)
+        for row in reader:
+            if len(row) != len(header):
+                return False
+        return True
+    except (csv.Error, UnicodeDecodeError, StopIteration):
+        return False
+    finally:
+        # 不随包装器一起关闭底层文件
+        text_stream.detach()
+
+def is_python_source(stream: BinaryIO) -> bool:
+    return stream_contains(stream, (b"import ", b"def "))
+
+def stream_contains(stream: BinaryIO, needles: Tuple[bytes, ...]) -> bool:
+    """流式查找任一字节串，相邻块之间保留重叠部分以免漏掉跨块的匹配"""
+    overlap = max(len(needle) for needle in needles) - 1
+    tail = b""
+    while chunk := stream.read(VALIDATE_CHUNK_SIZE):
+        window = tail + chunk
+        if any(needle in window for needle in needles):
+            return True
+        tail = window[-overlap:] if overlap else b""
+    return False
+
+# 文件签名数据库（原始字节）
+FILE_SIGNATURES: Dict[str, Dict[str, object]] = {
     # 文本类
-    ".txt": {"patterns": (b"",), "offset": 0},  # 无固定签名
-    ".md": {"patterns": (b"",), "offset": 0},
+    ".txt": {},  # 无固定签名
+    ".md": {},
     
     # 文档类
     ".pdf": {
         "patterns": (b"%PDF-",),
         "offset": 0,
-        "additional": lambda h: b"%%EOF" in h[-1024:]  # 验证尾部特征
+        "tail_contains": (b"%%EOF", 1024)  # 验证尾部特征
     },
     ".docx": {
-        "patterns": (b"504B0304", b"504B0506", b"504B0708"),  # ZIP头
+        "patterns": (b"PK\x03\x04", b"PK\x05\x06", b"PK\x07\x08"),  # ZIP头
         "offset": 0,
-        "structure": ["[Content_Types].xml", "word/"]
+        "zip_files": ["[Content_Types].xml", "word/"]
     },
     ".pptx": {
-        "patterns": (b"504B0304",),
+        "patterns": (b"PK\x03\x04",),
         "offset": 0,
-        "structure": ["[Content_Types].xml", "ppt/"]
+        "zip_files": ["[Content_Types].xml", "ppt/"]
     },
     ".xlsx": {
-        "patterns": (b"504B0304",),
+        "patterns": (b"PK\x03\x04",),
         "offset": 0,
-        "structure": ["[Content_Types].xml", "xl/"]
+        "zip_files": ["[Content_Types].xml", "xl/"]
     },
     
     # 数据类
     ".json": {
-        "validate": lambda c: is_valid_json(c)
+        "validate": is_valid_json
     },
     ".csv": {
-        "validate": lambda c: is_valid_csv(c)
+        "validate": is_valid_csv
     },
     
     # 音频类
     ".mp3": {
-        "patterns": (b"494433", b"FFFB", b"FFF3"),  # ID3v2或MPEG帧
+        "patterns": (b"ID3", b"\xff\xfb", b"\xff\xf3"),  # ID3v2或MPEG帧
         "offset": 0
     },
     ".wav": {
-        "patterns": (b"52494646",),  # "RIFF"
+        "patterns": (b"RIFF",),
         "offset": 0,
-        "subheader": (b"57415645", 8)  # "WAVE" at 8字节
+        "subheader": (b"WAVE", 8)  # "WAVE" at 8字节
     },
     
     # 图片类
     ".png": {
-        "patterns": (b"89504E470D0A1A0A",),  # PNG头
+        "patterns": (b"\x89PNG\r\n\x1a\n",),  # PNG头
         "offset": 0,
-        "trailer": (b"49454E44AE426082", -12)  # IEND trailer
+        "trailer": (b"IEND\xaeB`\x82", 12)  # IEND trailer
     },
     ".jpg": {
-        "patterns": (b"FFD8FFE0", b"FFD8FFE1", b"FFD8FFE8"),
+        "patterns": (b"\xff\xd8\xff\xe0", b"\xff\xd8\xff\xe1", b"\xff\xd8\xff\xe8"),
         "offset": 0,
-        "trailer": (b"FFD9", -2)  # EOI标记
+        "trailer": (b"\xff\xd9", 2)  # EOI标记
     },
     
     # 编程类
     ".py": {
-        "patterns": (b"2321",),  # shebang可能
-        "offset": 0,
-        "validate": lambda c: b"import " in c or b"def " in c
+        "validate": is_python_source
     }
 }
 
+class SignatureMatcher:
+    """预编译的文件头匹配器，直接比较原始字节"""
+
+    def __init__(self, signatures: Dict[str, Dict[str, object]]):
+        self.rules: Dict[str, Tuple[Tuple[int, bytes], ...]] = {}
+        self.header_size = 0
+        for ext, spec in signatures.items():
+            offset = spec.get("offset", 0)
+            rules = [(offset, pattern) for pattern in spec.get("patterns", ()) if pattern]
+            if "subheader" in spec:
+                pattern, sub_offset = spec["subheader"]
+                self.header_size = max(self.header_size, sub_offset + len(pattern))
+            self.rules[ext] = tuple(rules)
+            for rule_offset, pattern in rules:
+                self.header_size = max(self.header_size, rule_offset + len(pattern))
+        self.subheaders = {
+            ext: spec["subheader"] for ext, spec in signatures.items() if "subheader" in spec
+        }
+
+    def match(self, ext: str, header: bytes) -> bool:
+        """文件头是否符合扩展名对应的签名（无签名的类型总是通过）"""
+        rules = self.rules.get(ext)
+        if rules is None:
+            return False
+        if rules and not any(header.startswith(pattern, offset) for offset, pattern in rules):
+            return False
+        if ext in self.subheaders:
+            pattern, offset = self.subheaders[ext]
+            return header.startswith(pattern, offset)
+        return True
+
+SIGNATURE_MATCHER = SignatureMatcher(FILE_SIGNATURES)
+
 def get_file_hash(file_path: str) -> str:
     """计算文件哈希值(SHA-256)"""
     sha256 = hashlib.sha256()
     with open(file_path, 'rb') as f:
-        while chunk := f.read(8192):
+        while chunk := f.read(1024 * 1024):
             sha256.update(chunk)
     return sha256.hexdigest()
 
+def get_file_ext(file_name: str) -> str:
+    return Path(file_name).suffix.lower()
+
 def check_file_size(file: UploadFile):
-    content = b''
-    if file.size > MAX_FILE_SIZE:
-        raise BaseException("文件大小超过限制")
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise ValueError("文件大小超过限制")
 
 async def validate_upload_file(file: UploadFile) -> bool:
-    """验证上传文件的签名"""
-    ext = file.filename.split('.')[-1].lower()
-    if f".{ext}" not in FILE_SIGNATURES:
-        raise ValueError(f"不支持的文件类型: .{ext}")
-    
-    spec = FILE_SIGNATURES[f".{ext}"]
-    
-    # 读取文件头（异步优化）
-    header = await read_upload_file_header(file, max_bytes=64)
-    
-    # 基础签名验证
-    if "patterns" in spec:
-        if not check_header_pattern(header, spec["patterns"], spec.get("offset", 0)):
-            return False
+    """验证上传文件的签名（只读取文件头）"""
+    ext = get_file_ext(file.filename)
+    if ext not in FILE_SIGNATURES:
+        raise ValueError(f"不支持的文件类型: {ext}")
     
-    # ZIP结构验证
+    header = await read_upload_file_header(file, max_bytes=SIGNATURE_MATCHER.header_size)
+    return SIGNATURE_MATCHER.match(ext, header)
+
+def validate_file_content(file_path: Union[str, Path], ext: str) -> bool:
+    """验证落盘文件的结构与内容，只读取必要的部分，不会整体载入内存"""
+    spec = FILE_SIGNATURES.get(ext)
+    if spec is None:
+        return False
+
+    with open(file_path, "rb") as f:
+        # 尾部验证（PDF/图片）
+        if "tail_contains" in spec:
+            pattern, size = spec["tail_contains"]
+            if pattern not in read_file_tail(f, size):
+                return False
+        if "trailer" in spec:
+            pattern, size = spec["trailer"]
+            if not read_file_tail(f, size).endswith(pattern):
+                return False
+
+        # 内容格式验证
+        if "validate" in spec:
+            f.seek(0)
+            if not spec["validate"](f):
+                return False
+
+    # ZIP结构验证（zipfile 从文件尾部读取中央目录）
     if "zip_files" in spec:
-        content = await file.read()
-        await file.seek(0)  # 重置指针
-        if not validate_zip_structure(content, spec["zip_files"]):
+        if not validate_zip_structure(file_path, spec["zip_files"]):
             return False
-    
-    # 尾部验证（PDF/图片）
-    if "trailer" in spec:
-        trailer_data = await read_upload_file_trailer(file, spec["trailer"][1])
-        if not trailer_data.endswith(spec["trailer"][0]):
-            return False
-    
-    # 内容格式验证
-    if "validate" in spec:
-        content = await file.read()
-        await file.seek(0)
-        if not spec["validate"](content):
-            return False
-    
+
     return True
 
 async def read_upload_file_header(file: UploadFile, max_bytes: int = 64) -> bytes:
@@ -140,56 +222,138 @@ async def read_upload_file_header(file: UploadFile, max_bytes: int = 64) -> byte
     await file.seek(0)
     return header
 
-async def read_upload_file_trailer(file: UploadFile, offset: int) -> bytes:
+def read_file_tail(f: BinaryIO, size: int) -> bytes:
     """读取文件尾部数据"""
-    file_size = file.size
-    if offset < 0:
-        read_pos = max(0, file_size + offset)
-    else:
-        read_pos = max(0, file_size - offset)
-    
-    await file.seek(read_pos)
-    return await file.read()
-
-def check_header_pattern(header: bytes, patterns: Tuple[str], offset: int) -> bool:
-    """验证二进制模式"""
-    hex_header = binascii.hexlify(header).upper()
-    for pattern in patterns:
-        pattern_bytes = binascii.unhexlify(pattern)
-        start = offset * 2  # 转换为hex偏移量
-        end = start + len(pattern)
-        if hex_header[start:end] == pattern:
-            return True
-    return False
+    f.seek(0, 2)
+    f.seek(max(0, f.tell() - size))
+    return f.read(size)
 
-def validate_zip_structure(content: bytes, required_files: Tuple[str]) -> bool:
-    """验证ZIP包结构"""
-    from zipfile import ZipFile
+def validate_zip_structure(file_path: Union[str, Path], required_files: List[str]) -> bool:
+    """验证ZIP包结构，以 / 结尾的条目按目录前缀匹配"""
     try:
-        with ZipFile(BytesIO(content)) as zf:
-            return all(name in zf.namelist() for name in required_files)
-    except:
+        with ZipFile(file_path) as zf:
+            names = zf.namelist()
+    except (BadZipFile, OSError):
         return False
+    for required in required_files:
+        if required.endswith("/"):
+            if not any(name.startswith(required) for name in names):
+                return False
+        elif required not in names:
+            return False
+    return True
 
-# 辅助验证函数
-def is_valid_json(content: bytes) -> bool:
-    import json
-    try:
-        json.loads(content.decode('utf-8'))
+class JsonStreamValidator:
+    """增量 JSON 语法校验器，只保存嵌套栈和跨块的残余片段"""
+
+    TOKEN = re.compile(
+        r'[ \t\r\n]*(?:([{}\[\]:,])|(")|(-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null))'
+    )
+    STRING_BODY = re.compile(r'(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*')
+    WHITESPACE = re.compile(r'[ \t\r\n]*')
+    SCALAR_EXTENT = re.compile(r'[^ \t\r\n,:\]\}\[\{"]*')
+    # 跨块残余片段的上限（未完成的数字、字面量或转义序列）
+    MAX_CARRY = 1024
+
+    def __init__(self):
+        self.stack: List[str] = []
+        self.state = "value"
+        self.in_string = False
+        self.carry = ""
+
+    def feed(self, text: str, final: bool = False) -> bool:
+        buf = self.carry + text
+        self.carry = ""
+        pos = 0
+        size = len(buf)
+        while pos < size:
+            if self.in_string:
+                end = self.STRING_BODY.match(buf, pos).end()
+                if end == size:
+                    pos = end
+                    break
+                if buf[end] == '"':
+                    self.in_string = False
+                    pos = end + 1
+                    if not self._on_string():
+                        return False
+                    continue
+                # 转义序列被分块截断
+                if buf[end] == "\\" and size - end < 6 and not final:
+                    self.carry = buf[end:]
+                    return True
+                return False
+
+            match = self.TOKEN.match(buf, pos)
+            if match is None:
+                rest = buf[self.WHITESPACE.match(buf, pos).end():]
+                if not rest:
+                    break
+                if not final and len(rest) < self.MAX_CARRY:
+                    self.carry = rest
+                    return True
+                return False
+            punct, quote, scalar = match.groups()
+            if scalar is not None:
+                # 数字或字面量必须以分隔符结束，到达块尾时可能在下一块继续
+                token_end = self.SCALAR_EXTENT.match(buf, match.start(3)).end()
+                if token_end == size and not final:
+                    if size - match.start(3) >= self.MAX_CARRY:
+                        return False
+                    self.carry = buf[match.start(3):]
+                    return True
+                if token_end != match.end():
+                    return False
+            pos = match.end()
+            if quote:
+                if self.state not in ("value", "value_or_end", "key", "key_or_end"):
+                    return False
+                self.in_string = True
+            elif scalar is not None:
+                if not self._on_value():
+                    return False
+            elif not self._on_punct(punct):
+                return False
+
+        if final:
+            return not self.in_string and not self.carry and self.state == "done"
         return True
-    except:
-        return False
 
-def is_valid_csv(content: bytes) -> bool:
-    import csv
-    from io import StringIO
-    try:
-        # 验证首行字段数一致性
-        reader = csv.reader(StringIO(content.decode('utf-8-sig')))
-        header = next(reader)
-        for row in reader:
-            if len(row) != len(header):
+    def _after_value(self):
+        self.state = "comma_or_end" if self.stack else "done"
+
+    def _on_value(self) -> bool:
+        if self.state not in ("value", "value_or_end"):
+            return False
+        self._after_value()
+        return True
+
+    def _on_string(self) -> bool:
+        if self.state in ("key", "key_or_end"):
+            self.state = "colon"
+            return True
+        return self._on_value()
+
+    def _on_punct(self, punct: str) -> bool:
+        if punct in "{[":
+            if self.state not in ("value", "value_or_end"):
+                return False
+            self.stack.append(punct)
+            self.state = "key_or_end" if punct == "{" else "value_or_end"
+        elif punct == ":":
+            if self.state != "colon":
+                return False
+            self.state = "value"
+        elif punct == ",":
+            if self.state != "comma_or_end":
+                return False
+            self.state = "key" if self.stack[-1] == "{" else "value"
+        else:
+            opener = "{" if punct == "}" else "["
+            if not self.stack or self.stack[-1] != opener:
+                return False
+            if self.state not in ("comma_or_end", "key_or_end" if opener == "{" else "value_or_end"):
                 return False
+            self.stack.pop()
+            self._after_value()
         return True
-    except:
-        return False
\ No newline at end of file
@@ -0,0 +1,53 @@
+import struct
+import base64
+import numpy as np
+from typing import List, Optional, Sequence, Union
+
+# 向量编码方式：float 为 JSON 数组；base64-* 为小端字节序的 base64 字符串；binary 为整体二进制响应
+VECTOR_ENCODINGS = ("float", "base64-f32", "base64-f16", "binary")
+_BASE64_DTYPES = {
+    "base64-f32": np.dtype("<f4"),
+    "base64-f16": np.dtype("<f2"),
+}
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+def encode_vector(vector, encoding: str) -> Union[np.ndarray, str, None]:
+    """编码单个向量，float 编码直接返回 float32 数组，由 orjson 序列化"""
+    if vector is None:
+        return None
+    if encoding == "float":
+        return np.asarray(vector, dtype=np.float32)
+    return base64.b64encode(np.asarray(vector, dtype=_BASE64_DTYPES[encoding]).tobytes()).decode("ascii")
+
+def decode_vector(data: str, encoding: str) -> np.ndarray:
+    """encode_vector 的逆操作，供客户端参考"""
+    return np.frombuffer(base64.b64decode(data), dtype=_BASE64_DTYPES[encoding])
+
+def pack_vectors(ids: Sequence[str], vectors: Sequence[Optional[Sequence[float]]]) -> bytes:
+    """打包为二进制：uint32 行数、uint32 维度，逐行 uint16 id 长度 + UTF-8 id，最后是行优先的 float32 矩阵
+
+    全部为小端字节序；没有向量的行（如全文检索命中）会被跳过。
+    """
+    rows = [(chunk_id, vector) for chunk_id, vector in zip(ids, vectors) if vector is not None]
+    matrix = np.asarray([vector for _, vector in rows], dtype="<f4")
+    dimension = matrix.shape[1] if matrix.ndim == 2 else 0
+    parts: List[bytes] = [struct.pack("<II", len(rows), dimension)]
+    for chunk_id, _ in rows:
+        encoded_id = chunk_id.encode("utf-8")
+        parts.append(struct.pack("<H", len(encoded_id)))
+        parts.append(encoded_id)
+    parts.append(matrix.tobytes())
+    return b"".join(parts)
+
+def unpack_vectors(data: bytes):
+    """pack_vectors 的逆操作，返回 (ids, matrix)"""
+    count, dimension = struct.unpack_from("<II", data, 0)
+    offset = 8
+    ids = []
+    for _ in range(count):
+        (length,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        ids.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    matrix = np.frombuffer(data, dtype="<f4", offset=offset, count=count * dimension).reshape(count, dimension)
+    return ids, matrix